@@ -0,0 +1,77 @@
+import argparse
+import json
+import logging
+import sys
+from os.path import join
+from pathlib import Path
+
+from data_generator_executor import get_credentials
+from lib.benchmark import ShopDataGeneratorBenchmark, find_regressions, load_baseline, save_baseline
+from lib.clickhouse_hook import ClickhouseNativeHook
+from lib.load_query import load_query
+from lib.stand_in import StandInHook
+
+HOST = "localhost"
+QUERIES_PATH = "queries"
+DIR_PATH = Path(__file__).parent.resolve()
+BASELINE_PATH = join(DIR_PATH, "benchmark_baseline.json")
+ENTITIES = [
+    "delivery",
+    "delivery_products_line",
+    "invoice",
+    "invoice_products_line",
+    "product",
+    "provider",
+    "storage",
+]
+
+
+def reset_tables(hook: ClickhouseNativeHook) -> None:
+    hook.execute(query=load_query(join(DIR_PATH, QUERIES_PATH, "shop.sql")), log_query=False)
+    for entity in ENTITIES:
+        hook.execute(query=load_query(join(DIR_PATH, QUERIES_PATH, f"{entity}.sql")), log_query=False)
+        hook.execute(query=f"TRUNCATE TABLE shop.{entity}", log_query=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ShopDataGenerator throughput benchmark")
+    parser.add_argument("--mode", choices=["cpu", "server", "stand-in"], default="cpu")
+    parser.add_argument("--scales", type=float, nargs="+", default=[0.1, 1])
+    parser.add_argument("--repeats", type=int, default=3, help="runs per scale, the fastest is reported")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="store results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed rows/s drop, as a fraction")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.mode in ("server", "stand-in"):
+        if args.mode == "server":
+            login, password = get_credentials()
+            hook = ClickhouseNativeHook(login=login, password=password, host=HOST)
+        else:
+            # the server path without network and server time, the queries run on in-memory tables
+            hook = StandInHook()
+        benchmark = ShopDataGeneratorBenchmark(
+            make_client=lambda: hook,
+            reset=lambda: reset_tables(hook),
+            scales=args.scales,
+            repeats=args.repeats,
+            mode=args.mode,
+        )
+    else:
+        benchmark = ShopDataGeneratorBenchmark(scales=args.scales, repeats=args.repeats)
+    results = benchmark.run()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([result.to_dict() for result in results], f, indent=2)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+        logging.info(f"Baseline saved to {args.baseline}.")
+    else:
+        regressions = find_regressions(results, load_baseline(args.baseline), args.threshold)
+        for regression in regressions:
+            logging.error(f"Throughput regression {regression}")
+        if regressions:
+            sys.exit(1)
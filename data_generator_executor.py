@@ -1,23 +1,33 @@
+import argparse
 import logging
-import random
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
 from os.path import join
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
-import keyring
-import numpy as np
-
-from lib.clickhouse_hook import ClickhouseNativeHook
-from lib.data_generator import ShopDataGenerator
 from lib.load_query import load_query
+from lib.scale import SCALE_PRESETS, parse_scale_factor, scale_counts
 
+# defaults of the command line options, heavy dependencies (NumPy, pandas, clickhouse_driver, keyring)
+# are imported only by the functions that need them, so '--help' and DDL only runs start fast
 # HOST = "ch_server"  # change to localhost
 HOST = "localhost"
-GENERATE_DATA = True
-TRUNCATE_ON_START = True
+MODE = "rows"  # "bulk", "streaming" or "async" for the bulk modes
+CHUNK_SIZE = 100000
+WORKERS = None  # N runs sharded bulk generation on N processes, the same data for any N
+MEMORY_LIMIT_BYTES = 256 * 1024 * 1024
+MAX_INFLIGHT_INSERTS = 2
+OUTPUT_PATH = "output"
+PARTITION_ROWS = 1000000
 QUERIES_PATH = "queries"
 DIR_PATH = Path(__file__).parent.resolve()
 SEED = 42
+KEYRING_SERVICE = "clickhouse_lab1"
 
+# the database first, then its tables
+DATABASE_ENTITY = "shop"
 ENTITIES = [
     "delivery",
     "delivery_products_line",
@@ -26,33 +36,257 @@ ENTITIES = [
     "product",
     "provider",
     "storage",
-    "shop",
 ]
 
-# keyring example, in prod version should be hide
-keyring.set_password("clickhouse_lab1", "username", "default")
-keyring.set_password("clickhouse_lab1", "password", "default")
 
-CLICKHOUSE_LOGIN = keyring.get_password("clickhouse_lab1", "username")
-CLICKHOUSE_PASSWORD = keyring.get_password("clickhouse_lab1", "password")
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Shop database data generator")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument(
+        "--scale-factor",
+        "-s",
+        help=f"entity counts, a preset ({', '.join(SCALE_PRESETS)}) or a number; 'ShopDataGenerator' defaults if unset",
+    )
+    parser.add_argument("--mode", choices=["rows", "bulk", "streaming", "async"], default=MODE)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per insert block of bulk modes")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=WORKERS,
+        help="run sharded bulk generation on N processes (1 runs it in this process), "
+        "its data depends on --seed and --chunk-size but not on N and differs from --mode bulk",
+    )
+    parser.add_argument("--memory-limit-bytes", type=int, default=MEMORY_LIMIT_BYTES, help="streaming mode limit")
+    parser.add_argument("--max-inflight-inserts", type=int, default=MAX_INFLIGHT_INSERTS, help="async mode limit")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--no-generate", action="store_true", help="only create (and truncate) the tables")
+    parser.add_argument("--no-truncate", action="store_true", help="keep the rows of existing tables")
+    parser.add_argument("--checkpoint", help="checkpoint file of bulk mode, resumed from with '--no-truncate'")
+    parser.add_argument("--layout", help="layout profile of the tables, e.g. 'product_time'")
+    parser.add_argument(
+        "--output-format", choices=["parquet", "native", "csv"], help="write files to '--output-path' without a server"
+    )
+    parser.add_argument("--output-path", default=OUTPUT_PATH)
+    parser.add_argument(
+        "--stand-in", action="store_true", help="dry run against an in-memory stand-in instead of a clickhouse server"
+    )
+    parser.add_argument("--partition-rows", type=int, default=PARTITION_ROWS, help="maximum rows per output file")
+    parser.add_argument("--metrics-json", help="e.g. 'metrics.json'")
+    parser.add_argument("--metrics-prometheus", help="e.g. '/var/lib/node_exporter/textfile/shop_generator.prom'")
+    args = parser.parse_args(argv)
+    if args.workers is not None:
+        # the sharded generator only runs bulk generation into clickhouse, without checkpoints or metrics
+        if args.workers < 1:
+            parser.error("--workers must be at least 1")
+        if args.mode != "bulk":
+            parser.error("--workers runs sharded bulk generation, it needs --mode bulk")
+        for option, value in [
+            ("--checkpoint", args.checkpoint),
+            ("--metrics-json", args.metrics_json),
+            ("--metrics-prometheus", args.metrics_prometheus),
+            ("--output-format", args.output_format),
+        ]:
+            if value is not None:
+                parser.error(f"{option} is not supported with --workers")
+        if args.stand_in and args.workers > 1:
+            parser.error("--stand-in keeps the tables in this process, worker processes can't write to them")
+    if args.scale_factor is not None:
+        try:
+            args.scale_factor = parse_scale_factor(args.scale_factor)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
 
-if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-    random.seed(SEED)
-    np.random.seed(SEED)
-    client = ClickhouseNativeHook(login=CLICKHOUSE_LOGIN, password=CLICKHOUSE_PASSWORD, host=HOST).get_connection()
-    # create tables if not exists
-    for entity in ENTITIES:
-        query = load_query(join(DIR_PATH, join(QUERIES_PATH, f"{entity}.sql")))
-        client.execute(query=query)
-        if TRUNCATE_ON_START and entity != "shop":
-            truncate_query = f"TRUNCATE TABLE shop.{entity}"
-            logging.info(truncate_query)
-            client.execute(query=truncate_query)
-
-    logging.info("Tables created successfully.")
-    # generate data
-    if GENERATE_DATA:
-        data_generator = ShopDataGenerator(clickhouse_connection=client)
+
+def get_credentials() -> Tuple[str, str]:
+    """Clickhouse user and password saved to keyring by 'setup_keyring.py', clickhouse's default user otherwise."""
+    import keyring
+    from keyring.errors import KeyringError
+
+    try:
+        login = keyring.get_password(KEYRING_SERVICE, "username")
+        password = keyring.get_password(KEYRING_SERVICE, "password")
+    except KeyringError:
+        login = password = None
+    if login is None:
+        logging.warning("Учетные данные не найдены в keyring (см. setup_keyring.py), используется пользователь default")
+        return "default", "default"
+    return login, password
+
+
+def get_generator_kwargs(args: argparse.Namespace) -> Dict[str, Any]:
+    """Entity counts of the scale factor, with enough unique names for the scaled providers and storages."""
+    if args.scale_factor is None:
+        return {}
+    from lib.data_generator import ShopDataGenerator
+
+    counts = scale_counts(args.scale_factor)
+    # unique names are '<prefix>_<suffix>' with a suffix below 'name_suffix_max_value'
+    name_suffixes = max(
+        math.ceil(counts["provider_count"] / len(ShopDataGenerator.PROVIDER_NAMES)),
+        math.ceil(counts["storage_count"] / len(ShopDataGenerator.STORAGE_NAMES)),
+        math.ceil(counts["storage_count"] / len(ShopDataGenerator.ADDRESSES_NAMES)),
+    )
+    return dict(counts, name_suffix_max_value=max(2000, name_suffixes))
+
+
+def create_tables(hook: Any, schemas: Dict[str, Any], layout: Any, truncate: bool) -> None:
+    """Creates the database, then creates (and truncates) its tables concurrently on the hook's connections."""
+    hook.execute(query=load_query(join(DIR_PATH, QUERIES_PATH, f"{DATABASE_ENTITY}.sql")))
+
+    def create_table(entity: str) -> None:
+        table_name = f"{DATABASE_ENTITY}.{entity}"
+        if layout is not None and table_name in schemas:
+            # an existing table keeps its layout, drop it to change the profile
+            query = layout.get(table_name).render(schemas[table_name])
+        else:
+            query = load_query(join(DIR_PATH, QUERIES_PATH, f"{entity}.sql"))
+        hook.execute(query=query)
+        if truncate:
+            hook.execute(query=f"TRUNCATE TABLE {table_name}")
+
+    with ThreadPoolExecutor(max_workers=hook.pool_size) as executor:
+        # list() re-raises the first failure
+        list(executor.map(create_table, ENTITIES))
+
+
+def count_rows(hook: Any) -> Dict[str, int]:
+    def count(entity: str) -> int:
+        return hook.execute(query=f"SELECT count() FROM {DATABASE_ENTITY}.{entity}", log_query=False)[0][0]
+
+    with ThreadPoolExecutor(max_workers=hook.pool_size) as executor:
+        return dict(zip((f"{DATABASE_ENTITY}.{entity}" for entity in ENTITIES), executor.map(count, ENTITIES)))
+
+
+def log_summary(rows: Dict[str, int], seconds: float) -> None:
+    for table_name, table_rows in sorted(rows.items()):
+        logging.info(f"{table_name}: {table_rows} rows, {table_rows / seconds:.0f} rows/s")
+    total = sum(rows.values())
+    logging.info(f"Total: {total} rows in {seconds:.2f} s, {total / seconds:.0f} rows/s")
+
+
+def seed_global_random(seed: int) -> None:
+    """Seeds the 'random' module used by row mode and NumPy's global generator."""
+    import random
+
+    import numpy as np
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def write_files(args: argparse.Namespace, schemas: Dict[str, Any], layout: Any, metrics: Any) -> Dict[str, int]:
+    from lib.data_generator import ShopDataGenerator
+    from lib.file_sink import FILE_SINKS
+    from lib.schema import get_column_types
+
+    seed_global_random(args.seed)
+    with FILE_SINKS[args.output_format](
+        join(DIR_PATH, args.output_path), partition_rows=args.partition_rows, column_types=get_column_types(schemas)
+    ) as sink:
+        ShopDataGenerator(
+            clickhouse_connection=None,
+            sink=sink,
+            chunk_size=args.chunk_size,
+            seed=args.seed,
+            metrics=metrics,
+            schemas=schemas,
+            layout=layout,
+            **get_generator_kwargs(args),
+        ).execute_bulk()
+    logging.info(f"Data written to {args.output_path} successfully.")
+    return sink.written_rows
+
+
+def insert_data(args: argparse.Namespace, hook: Any, layout: Any, metrics: Any) -> None:
+    from lib.data_generator import ShopDataGenerator
+
+    seed_global_random(args.seed)
+    generator_kwargs = get_generator_kwargs(args)
+    if args.workers is not None:
+        from lib.parallel_generator import ParallelShopDataGenerator
+
+        ParallelShopDataGenerator(
+            hook=hook,
+            workers=args.workers,
+            shard_size=args.chunk_size,
+            seed=args.seed,
+            layout=layout,
+            **generator_kwargs,
+        ).execute()
+        return
+    checkpoint_path = join(DIR_PATH, args.checkpoint) if args.checkpoint and args.mode == "bulk" else None
+    data_generator = ShopDataGenerator(
+        clickhouse_connection=hook.get_connection(),
+        chunk_size=args.chunk_size,
+        seed=args.seed,
+        metrics=metrics,
+        checkpoint_path=checkpoint_path,
+        layout=layout,
+        **generator_kwargs,
+    )
+    if args.mode == "async":
+        from lib.async_generator import AsyncClickhouseNativeHook, AsyncShopDataGenerator
+
+        async_hook = AsyncClickhouseNativeHook(hook=hook)
+        AsyncShopDataGenerator(
+            generator=data_generator, hook=async_hook, max_inflight_inserts=args.max_inflight_inserts
+        ).execute()
+        async_hook.close()
+    elif args.mode == "streaming":
+        from lib.pipeline import StreamingPipeline
+
+        StreamingPipeline(generator=data_generator, hook=hook, memory_limit_bytes=args.memory_limit_bytes).run()
+    elif args.mode == "bulk":
+        data_generator.execute_bulk()
+    else:
         data_generator.execute()
-        logging.info("Data inserted successfully.")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+    started = time.perf_counter()
+
+    from lib.layout import LAYOUT_PROFILES
+    from lib.metrics import JsonExporter, Metrics, PrometheusTextExporter
+    from lib.schema import load_schemas
+
+    metrics = Metrics() if args.metrics_json or args.metrics_prometheus else None
+    schemas = load_schemas(join(DIR_PATH, QUERIES_PATH))
+    layout = LAYOUT_PROFILES[args.layout] if args.layout is not None else None
+    if args.output_format is not None:
+        rows = write_files(args, schemas, layout, metrics)
+    else:
+        from lib.checkpoint import CheckpointStore
+
+        if args.stand_in:
+            from lib.stand_in import StandInHook
+
+            hook = StandInHook(metrics=metrics)
+        else:
+            from lib.clickhouse_hook import ClickhouseNativeHook
+
+            login, password = get_credentials()
+            hook = ClickhouseNativeHook(login=login, password=password, host=args.host, metrics=metrics)
+        create_tables(hook, schemas, layout, truncate=not args.no_truncate)
+        logging.info("Tables created successfully.")
+        if args.checkpoint and not args.no_truncate:
+            # the checkpoint describes the rows that were just truncated
+            CheckpointStore(join(DIR_PATH, args.checkpoint)).remove()
+        rows = {}
+        if not args.no_generate:
+            rows_before = count_rows(hook)
+            insert_data(args, hook, layout, metrics)
+            logging.info("Data inserted successfully.")
+            rows = {table_name: count - rows_before[table_name] for table_name, count in count_rows(hook).items()}
+        hook.close()
+    log_summary(rows, time.perf_counter() - started)
+    if args.metrics_json:
+        JsonExporter(args.metrics_json).export(metrics)
+    if args.metrics_prometheus:
+        PrometheusTextExporter(args.metrics_prometheus).export(metrics)
+
+
+if __name__ == "__main__":
+    main()
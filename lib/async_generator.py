@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Set, Tuple
+
+import numpy as np
+
+from lib.clickhouse_hook import ClickhouseNativeHook
+from lib.data_generator import ShopDataGenerator
+from lib.metrics import maybe_stage
+
+Chunk = Tuple[str, Dict[str, np.ndarray]]
+
+
+class AsyncClickhouseNativeHook:
+    def __init__(self, hook: ClickhouseNativeHook, max_workers: Optional[int] = None):
+        """
+        'asyncio' interface over 'ClickhouseNativeHook'.
+
+        Every call runs on a thread of its own executor with a pooled connection of 'hook', so the event loop
+        stays free while a query or an insert is on the wire.
+
+        :param hook: hook providing the connection pool
+        :param max_workers: quantity of executor threads, 'hook.pool_size' by default
+        """
+        self.hook = hook
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or hook.pool_size, thread_name_prefix="clickhouse_io"
+        )
+
+    async def run(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Runs a blocking call on the I/O executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+
+    async def execute(self, query: str, *args, **kwargs) -> Any:
+        return await self.run(self.hook.execute, query, *args, **kwargs)
+
+    async def query_dataframe(self, query: str, *args, **kwargs) -> Any:
+        return await self.run(self.hook.query_dataframe, query, *args, **kwargs)
+
+    async def insert_dataframe(self, query: str, dataframe: Any, *args, **kwargs) -> Any:
+        return await self.run(self.hook.insert_dataframe, query, dataframe, *args, **kwargs)
+
+    def close(self, wait: bool = True) -> None:
+        """Stops the executor, with 'wait' False calls still running are left to finish on their own."""
+        self._executor.shutdown(wait=wait)
+        self.hook.close()
+
+
+class AsyncShopDataGenerator:
+    def __init__(
+        self,
+        generator: ShopDataGenerator,
+        hook: AsyncClickhouseNativeHook,
+        max_inflight_inserts: int = 2,
+        logger: Any = None,
+    ):
+        """
+        Runs 'ShopDataGenerator' bulk output with generation overlapping inserts.
+
+        Chunks are generated one at a time on a dedicated thread, and each generated chunk is handed to an
+        insert task, so chunk N + 1 is being built while chunk N is on the wire. At most 'max_inflight_inserts'
+        inserts run at once; generation waits for a free slot, which also bounds the chunks held in memory.
+        Stages are separated by a barrier, because the next stage reads the IDs inserted by the previous one.
+
+        :param generator: configured generator, its 'chunk_size' is the size of an insert
+        :param hook: async hook, its pool should hold at least 'max_inflight_inserts' connections
+        :param max_inflight_inserts: quantity of concurrent inserts, 1 gives plain double-buffering
+        """
+        if max_inflight_inserts < 1:
+            raise ValueError("max_inflight_inserts must be positive")
+        self.generator = generator
+        self.hook = hook
+        self.max_inflight_inserts = max_inflight_inserts
+        self.logger = logger if logger is not None else logging.getLogger()
+
+        self.inserted_rows: Dict[str, int] = {}
+        self._error: Optional[Exception] = None
+        self._generation_executor: Optional[ThreadPoolExecutor] = None
+
+    def execute(self) -> Dict[str, int]:
+        """Blocking entry point, returns the quantity of inserted rows per table."""
+        return asyncio.run(self.run())
+
+    async def run(self) -> Dict[str, int]:
+        inflight = asyncio.Semaphore(self.max_inflight_inserts)
+        # the generator and its stock ledger are not thread-safe, chunks are built on a single thread
+        self._generation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="generation")
+        try:
+            await self._generate(self.generator.check_unique_capacity)
+            for stage_name, sources in self.generator.iter_stages():
+                with maybe_stage(self.generator.metrics, stage_name):
+                    pending: Set[asyncio.Task] = set()
+                    try:
+                        for source in sources:
+                            while True:
+                                await inflight.acquire()
+                                self._raise_error()
+                                chunk = await self._generate(next, source, None)
+                                if chunk is None:
+                                    inflight.release()
+                                    break
+                                task = asyncio.create_task(self._insert(chunk, inflight))
+                                pending.add(task)
+                                task.add_done_callback(pending.discard)
+                        await asyncio.gather(*pending)
+                    finally:
+                        for task in pending:
+                            task.cancel()
+                        await asyncio.gather(*pending, return_exceptions=True)
+                self._raise_error()
+                self.logger.info(f"{stage_name} successfully inserted.")
+        finally:
+            self._generation_executor.shutdown(wait=True)
+        return self.inserted_rows
+
+    async def _generate(self, func: Callable[..., Any], *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._generation_executor, partial(func, *args))
+
+    async def _insert(self, chunk: Chunk, inflight: asyncio.Semaphore) -> None:
+        table_name, columns = chunk
+        try:
+            await self.hook.run(self.generator._insert_columns, columns, table_name, client=self.hook.hook)
+            rows = len(columns[self.generator.id_field_name])
+            self.inserted_rows[table_name] = self.inserted_rows.get(table_name, 0) + rows
+        except Exception as e:
+            self._error = e
+        finally:
+            inflight.release()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("Insert failed, generation stopped") from self._error
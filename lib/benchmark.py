@@ -0,0 +1,366 @@
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lib.clickhouse_hook import ClickhouseNativeHook
+from lib.data_generator import ShopDataGenerator
+from lib.scale import BULK_COUNTS
+
+Chunk = Tuple[str, Dict[str, np.ndarray]]
+
+# entity counts of the row-wise cases at scale factor 1
+ROW_COUNTS = {
+    "provider_count": 20,
+    "storage_count": 20,
+    "product_count": 50,
+    "delivery_count": 50,
+    "delivery_products_line_count": 50,
+    "invoice_product_line_count": 50,
+}
+
+
+@dataclass
+class BenchmarkResult:
+    mode: str
+    case: str
+    scale: float
+    rows: int
+    seconds: float
+    io_seconds: float
+    queries: int
+    peak_memory_bytes: Optional[int]
+
+    @property
+    def key(self) -> str:
+        return f"{self.mode}/{self.case}/{self.scale:g}"
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    @property
+    def queries_per_row(self) -> float:
+        return self.queries / self.rows if self.rows else 0.0
+
+    @property
+    def generation_seconds(self) -> float:
+        return max(self.seconds - self.io_seconds, 0.0)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(
+            asdict(self),
+            rows_per_second=self.rows_per_second,
+            queries_per_row=self.queries_per_row,
+            generation_seconds=self.generation_seconds,
+        )
+
+
+class CountingClient:
+    def __init__(self, client: Any):
+        """
+        Proxy for a clickhouse client or hook that counts queries, inserted rows and the time spent waiting
+        for queries. A hook does not log the queries, logging would be timed as I/O.
+        """
+        self.client = client
+        self.queries = 0
+        self.inserted_rows = 0
+        self.io_seconds = 0.0
+        self._read_kwargs = {"log_query": False} if isinstance(client, ClickhouseNativeHook) else {}
+
+    def execute(self, *args, **kwargs) -> Any:
+        return self._call(self.client.execute, *args, **kwargs, **self._read_kwargs)
+
+    def query_dataframe(self, *args, **kwargs) -> Any:
+        return self._call(self.client.query_dataframe, *args, **kwargs, **self._read_kwargs)
+
+    def insert_dataframe(self, query: str, dataframe: Any, *args, **kwargs) -> Any:
+        result = self._call(self.client.insert_dataframe, query, dataframe, *args, **kwargs)
+        self.inserted_rows += len(dataframe)
+        return result
+
+    def _call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.io_seconds += time.perf_counter() - started
+            self.queries += 1
+
+
+class NullSink:
+    """Sink dropping every chunk, isolates generation from I/O."""
+
+    def write(self, table_name: str, columns: Dict[str, np.ndarray]) -> None:
+        pass
+
+
+class PeakMemory:
+    def __init__(self, interval: float = 0.01):
+        """
+        Samples the resident set size in a background thread, 'peak_bytes' is the growth over the start value.
+        Reads '/proc/self/statm', so 'peak_bytes' stays None on systems without procfs.
+        """
+        self.interval = interval
+        self.peak_bytes: Optional[int] = None
+        self._start = self._peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def __enter__(self) -> "PeakMemory":
+        rss = self._rss()
+        if rss is not None:
+            self._start = self._peak = rss
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self._thread.is_alive():
+            self._stop.set()
+            self._thread.join()
+            self._peak = max(self._peak, self._rss())
+            self.peak_bytes = self._peak - self._start
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._peak = max(self._peak, self._rss())
+
+    @staticmethod
+    def _rss() -> Optional[int]:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return None
+
+
+class ShopDataGeneratorBenchmark:
+    def __init__(
+        self,
+        make_client: Optional[Callable[[], Any]] = None,
+        reset: Optional[Callable[[], None]] = None,
+        scales: Sequence[float] = (0.1, 1),
+        repeats: int = 3,
+        seed: int = 0,
+        logger: Any = None,
+        mode: Optional[str] = None,
+        **generator_kwargs,
+    ):
+        """
+        Measures 'ShopDataGenerator' throughput per entity and for whole runs at several scale factors.
+
+        Without 'make_client' the benchmark runs in CPU mode: bulk generation without a server, chunks go to
+        a sink that drops them. With it, every case runs against the returned client (e.g. a local clickhouse
+        through 'ClickhouseNativeHook') after calling 'reset', and the row-wise 'generate_*_row' methods and
+        'execute' are measured as well. Entity counts are 'BULK_COUNTS' and 'ROW_COUNTS' times the scale.
+
+        :param make_client: returns the client to benchmark against, None for CPU mode
+        :param reset: empties the tables before every run
+        :param scales: scale factors
+        :param repeats: runs per scale factor, the fastest run of every case is reported
+        :param seed: seed of the generation
+        :param mode: name of the mode in result keys, "cpu" without 'make_client' and "server" with it by default
+        :param generator_kwargs: extra 'ShopDataGenerator' parameters
+        """
+        self.make_client = make_client
+        self.reset = reset
+        self.scales = scales
+        self.repeats = repeats
+        self.seed = seed
+        self.generator_kwargs = generator_kwargs
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.mode = mode if mode is not None else "cpu" if make_client is None else "server"
+
+    def run(self) -> List[BenchmarkResult]:
+        best: Dict[str, BenchmarkResult] = {}
+        for scale in self.scales:
+            for _ in range(self.repeats):
+                results = self.run_bulk(scale)
+                if self.make_client is not None:
+                    results += self.run_rows(scale)
+                for result in results:
+                    if result.key not in best or result.rows_per_second > best[result.key].rows_per_second:
+                        best[result.key] = result
+        return list(best.values())
+
+    def run_bulk(self, scale: float) -> List[BenchmarkResult]:
+        """One result per entity of 'execute_bulk', plus 'execute_bulk' itself counting rows of all tables."""
+        generator, client = self._make_generator(BULK_COUNTS, scale)
+        results, rows = [], 0
+        with PeakMemory() as memory:
+            started = time.perf_counter()
+            generator.check_unique_capacity()
+            for _, sources in generator.iter_stages():
+                for source in sources:
+                    result, source_rows = self._measure_source(generator, client, scale, source)
+                    results.append(result)
+                    rows += source_rows
+            seconds = time.perf_counter() - started
+        queries, io_seconds = self._io(client)
+        results.append(
+            BenchmarkResult(self.mode, "execute_bulk", scale, rows, seconds, io_seconds, queries, memory.peak_bytes)
+        )
+        for result in results:
+            self._log(result)
+        return results
+
+    def run_rows(self, scale: float) -> List[BenchmarkResult]:
+        """
+        One result per 'generate_*_row' method, plus 'execute' itself. Rows are the rows produced: invoice
+        attempts rejected for lack of stock are not counted, 'execute' counts the rows inserted into all tables.
+        """
+        generator, client = self._make_generator(ROW_COUNTS, scale)
+        generator.check_unique_capacity()
+        cases = [
+            ("generate_provider_row", generator.provider_count, generator.generate_provider_row),
+            ("generate_storage_row", generator.storage_count, generator.generate_storage_row),
+            ("generate_delivery_row", generator.delivery_count, generator.generate_delivery_row),
+            ("generate_product_row", generator.product_count, generator.generate_product_row),
+            (
+                "generate_delivery_product_line_row",
+                generator.delivery_products_line_count,
+                generator.generate_delivery_product_line_row,
+            ),
+            (
+                "generate_invoice__invoice_product_line_rows",
+                generator.invoice_product_line_count,
+                generator.generate_invoice__invoice_product_line_rows,
+            ),
+        ]
+        results = []
+        for case, count, generate_row in cases:
+            results.append(self._measure(case, scale, client, partial(_repeat, generate_row, count)))
+
+        generator, client = self._make_generator(ROW_COUNTS, scale)
+        results.append(self._measure("execute", scale, client, partial(_inserted_rows, client, generator.execute)))
+        return results
+
+    def _measure_source(
+        self, generator: ShopDataGenerator, client: Optional[CountingClient], scale: float, source: Iterator[Chunk]
+    ) -> Tuple[BenchmarkResult, int]:
+        """
+        Generates and inserts a stage source. The result is named and counted after the source's first table,
+        for invoices the time includes their lines. Also returns the rows inserted into all tables.
+        """
+        queries, io_seconds = self._io(client)
+        started = time.perf_counter()
+        table_name, rows, total_rows = None, 0, 0
+        for chunk_table_name, columns in source:
+            generator._insert_columns(columns, chunk_table_name)
+            table_name = table_name or chunk_table_name
+            chunk_rows = len(columns[generator.id_field_name])
+            rows += chunk_rows if chunk_table_name == table_name else 0
+            total_rows += chunk_rows
+        seconds = time.perf_counter() - started
+        queries_after, io_seconds_after = self._io(client)
+        result = BenchmarkResult(
+            self.mode,
+            f"bulk.{table_name}",
+            scale,
+            rows,
+            seconds,
+            io_seconds_after - io_seconds,
+            queries_after - queries,
+            None,
+        )
+        return result, total_rows
+
+    def _make_generator(
+        self, counts: Dict[str, int], scale: float
+    ) -> Tuple[ShopDataGenerator, Optional[CountingClient]]:
+        kwargs = {name: max(int(count * scale), 1) for name, count in counts.items()}
+        kwargs.update(self.generator_kwargs)
+        if self.make_client is None:
+            return ShopDataGenerator(clickhouse_connection=None, sink=NullSink(), seed=self.seed, **kwargs), None
+        if self.reset is not None:
+            self.reset()
+        client = CountingClient(self.make_client())
+        return ShopDataGenerator(clickhouse_connection=client, seed=self.seed, **kwargs), client
+
+    def _measure(
+        self, case: str, scale: float, client: Optional[CountingClient], run: Callable[[], int]
+    ) -> BenchmarkResult:
+        """Times 'run', which returns the quantity of rows it produced."""
+        queries, io_seconds = self._io(client)
+        with PeakMemory() as memory:
+            started = time.perf_counter()
+            rows = run()
+            seconds = time.perf_counter() - started
+        queries_after, io_seconds_after = self._io(client)
+        result = BenchmarkResult(
+            self.mode,
+            case,
+            scale,
+            rows,
+            seconds,
+            io_seconds_after - io_seconds,
+            queries_after - queries,
+            memory.peak_bytes,
+        )
+        self._log(result)
+        return result
+
+    def _log(self, result: BenchmarkResult) -> None:
+        self.logger.info(
+            f"{result.key}: {result.rows} rows, {result.rows_per_second:.0f} rows/s, "
+            f"{result.queries_per_row:.2f} queries/row, {result.io_seconds:.2f}s of {result.seconds:.2f}s in I/O"
+        )
+
+    @staticmethod
+    def _io(client: Optional[CountingClient]) -> Tuple[int, float]:
+        return (client.queries, client.io_seconds) if client is not None else (0, 0.0)
+
+
+def save_baseline(results: List[BenchmarkResult], path: str) -> None:
+    """Stores results keyed by 'mode/case/scale', merged into the existing baseline file."""
+    baseline = load_baseline(path)
+    baseline.update({result.key: result.to_dict() for result in results})
+    with open(path, "w") as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+def load_baseline(path: str) -> Dict[str, Dict[str, Any]]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def find_regressions(
+    results: List[BenchmarkResult],
+    baseline: Dict[str, Dict[str, Any]],
+    threshold: float = 0.2,
+    min_seconds: float = 0.05,
+) -> List[str]:
+    """
+    Cases whose rows/s fell more than 'threshold' (a fraction) below the baseline.
+    Cases shorter than 'min_seconds' are too noisy to compare and are skipped.
+    """
+    regressions = []
+    for result in results:
+        if result.seconds < min_seconds:
+            continue
+        expected = baseline.get(result.key, {}).get("rows_per_second")
+        if expected and result.rows_per_second < expected * (1 - threshold):
+            regressions.append(
+                f"{result.key}: {result.rows_per_second:.0f} rows/s, baseline {expected:.0f} rows/s "
+                f"({result.rows_per_second / expected - 1:+.0%})"
+            )
+    return regressions
+
+
+def _repeat(func: Callable[[], Any], count: int) -> int:
+    """Calls 'func' 'count' times, returns the quantity of calls that produced a row (returned not None)."""
+    return sum(func() is not None for _ in range(count))
+
+
+def _inserted_rows(client: CountingClient, func: Callable[[], Any]) -> int:
+    before = client.inserted_rows
+    func()
+    return client.inserted_rows - before
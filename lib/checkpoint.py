@@ -0,0 +1,59 @@
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+META_KEY = "meta"
+
+
+class CheckpointStore:
+    def __init__(self, path: str):
+        """
+        Local checkpoint file: a JSON document and named NumPy arrays in one '.npz' archive.
+
+        Every 'save' writes a temporary file and renames it over the previous checkpoint,
+        so a crash while saving leaves the previous checkpoint intact.
+
+        :param path: checkpoint file path
+        """
+        self.path = path
+
+    def save(self, meta: Dict[str, Any], arrays: Dict[str, np.ndarray]) -> None:
+        if META_KEY in arrays:
+            raise ValueError(f"'{META_KEY}' is reserved for the checkpoint document")
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "wb") as f:
+            np.savez(f, **{META_KEY: np.array(json.dumps(meta))}, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.path)
+
+    def load(self) -> Optional[Tuple[Dict[str, Any], Dict[str, np.ndarray]]]:
+        """The saved document and arrays, None if there is no checkpoint."""
+        if not os.path.exists(self.path):
+            return None
+        with np.load(self.path, allow_pickle=False) as archive:
+            arrays = {name: archive[name] for name in archive.files}
+        return json.loads(str(arrays.pop(META_KEY))), arrays
+
+    def remove(self) -> None:
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def to_ranges(values: np.ndarray) -> np.ndarray:
+    """Sorted unique integers as [start, stop) rows, generated IDs are a few contiguous blocks."""
+    values = np.unique(np.asarray(values, dtype=np.int64))
+    if not len(values):
+        return np.empty((0, 2), dtype=np.int64)
+    breaks = np.flatnonzero(np.diff(values) != 1) + 1
+    starts = values[np.concatenate(([0], breaks))]
+    stops = values[np.concatenate((breaks - 1, [len(values) - 1]))] + 1
+    return np.stack([starts, stops], axis=1)
+
+
+def from_ranges(ranges: np.ndarray, dtype: Any = np.uint32) -> np.ndarray:
+    if not len(ranges):
+        return np.empty(0, dtype=dtype)
+    return np.concatenate([np.arange(start, stop, dtype=dtype) for start, stop in ranges.tolist()])
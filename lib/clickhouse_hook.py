@@ -1,7 +1,18 @@
 import logging
-from typing import Any
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
 from clickhouse_driver import Client
+from clickhouse_driver.protocol import ServerPacketTypes
+
+from lib.metrics import Metrics, record_call, result_size
+from lib.result_cache import ResultCache
+
+if TYPE_CHECKING:
+    from pandas import DataFrame
 
 
 class ClickhouseNativeHook:
@@ -13,8 +24,35 @@ class ClickhouseNativeHook:
         port: int = 9000,
         secure: bool = False,
         *args,
+        pool_size: int = 4,
+        pool_timeout: Optional[float] = None,
+        max_idle_time: float = 300.0,
+        health_check_interval: float = 30.0,
+        compression: Union[bool, str] = False,
+        compress_block_size: Optional[int] = None,
+        metrics: Optional[Metrics] = None,
+        result_cache: Optional[ResultCache] = None,
         **kwargs,
     ):
+        """
+        Hook for clickhouse native protocol with a pool of warm connections.
+
+        :param login: clickhouse user
+        :param password: clickhouse password
+        :param host: clickhouse host
+        :param port: clickhouse native protocol port
+        :param secure: use TLS
+        :param pool_size: maximum quantity of connections checked out at once
+        :param pool_timeout: seconds to wait for a free connection, None to wait forever
+        :param max_idle_time: idle connections older than this are closed instead of reused
+        :param health_check_interval: connections idle longer than this are pinged before reuse
+        :param compression: wire compression for 'Client' (True, 'lz4', 'lz4hc' or 'zstd'),
+            requires the driver compression extras ('lz4', 'clickhouse-cityhash' or 'zstd')
+        :param compress_block_size: compression block size, driver default if None
+        :param metrics: registry recording every execute, query_dataframe and insert_dataframe call, None to disable
+        :param result_cache: cache of execute and query_dataframe read results, invalidated by writes through
+            this hook, None to send every query to the server (see 'ResultCache')
+        """
         self.login = login
         self.password = password
         self.host = host
@@ -22,6 +60,36 @@ class ClickhouseNativeHook:
         self.secure = secure
         self.args = args
         self.kwargs = kwargs
+        if compression:
+            self.kwargs["compression"] = compression
+            if compress_block_size is not None:
+                self.kwargs["compress_block_size"] = compress_block_size
+
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.max_idle_time = max_idle_time
+        self.health_check_interval = health_check_interval
+        self.metrics = metrics
+        self.result_cache = result_cache
+        self._idle_connections: List[Tuple[Client, float]] = []
+        self._pool_semaphore = threading.BoundedSemaphore(pool_size)
+        self._pool_lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # a hook sent to another process (e.g. a 'ProcessPoolExecutor' worker under spawn) gets an empty pool
+        # of its own; metrics and the result cache stay with the process that created them
+        state = self.__dict__.copy()
+        for name in ("_idle_connections", "_pool_semaphore", "_pool_lock"):
+            del state[name]
+        state["metrics"] = None
+        state["result_cache"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._idle_connections = []
+        self._pool_semaphore = threading.BoundedSemaphore(self.pool_size)
+        self._pool_lock = threading.Lock()
 
     def get_connection(self):
         client = Client(
@@ -35,15 +103,257 @@ class ClickhouseNativeHook:
         )
         return client
 
+    @contextmanager
+    def connection(self) -> Iterator[Client]:
+        """Checks out a pooled connection; connections left disconnected by an error are not returned."""
+        if not self._pool_semaphore.acquire(timeout=self.pool_timeout):
+            raise TimeoutError(f"No free clickhouse connection in {self.pool_timeout} seconds")
+        try:
+            conn = self._checkout()
+            try:
+                yield conn
+            except BaseException:
+                if conn.connection.connected:
+                    self._checkin(conn)
+                raise
+            else:
+                self._checkin(conn)
+        finally:
+            self._pool_semaphore.release()
+
+    def close(self) -> None:
+        """Disconnects all idle pooled connections."""
+        with self._pool_lock:
+            idle_connections, self._idle_connections = self._idle_connections, []
+        for conn, _ in idle_connections:
+            conn.disconnect()
+
     def execute(self, query: str, stream: bool = False, log_query: bool = True, *args, **kwargs) -> Any:
-        conn = self.get_connection()
         if log_query:
             self._log_query(query=query)
         if stream is True:
-            return conn.execute_iter(query=query, *args, **kwargs)
-        return conn.execute(query=query, *args, **kwargs)
+            return self._execute_iter(query, *args, **kwargs)
+        if self.result_cache is not None:
+            return self.result_cache.call(
+                "execute", query, lambda: self._execute(query, *args, **kwargs), *args, **kwargs
+            )
+        return self._execute(query, *args, **kwargs)
+
+    def query_dataframe(self, query: str, log_query: bool = True, *args, **kwargs) -> Any:
+        if log_query:
+            self._log_query(query=query)
+        if self.result_cache is not None:
+            return self.result_cache.call(
+                "query_dataframe", query, lambda: self._query_dataframe(query, *args, **kwargs), *args, **kwargs
+            )
+        return self._query_dataframe(query, *args, **kwargs)
+
+    def insert_dataframe(self, query: str, dataframe: Any, *args, **kwargs) -> Any:
+        if self.result_cache is not None:
+            # not a read, the call drops cached results of the table
+            return self.result_cache.call(
+                "insert_dataframe", query, lambda: self._insert_dataframe(query, dataframe, *args, **kwargs)
+            )
+        return self._insert_dataframe(query, dataframe, *args, **kwargs)
+
+    def _execute(self, query: str, *args, **kwargs) -> Any:
+        with self.connection() as conn:
+            if self.metrics is None:
+                return conn.execute(query=query, *args, **kwargs)
+            return record_call(self.metrics, "execute", query, conn, None, conn.execute, query, *args, **kwargs)
+
+    def _query_dataframe(self, query: str, *args, **kwargs) -> Any:
+        with self.connection() as conn:
+            if self.metrics is None:
+                return conn.query_dataframe(query, *args, **kwargs)
+            return record_call(
+                self.metrics, "query_dataframe", query, conn, None, conn.query_dataframe, query, *args, **kwargs
+            )
+
+    def _insert_dataframe(self, query: str, dataframe: Any, *args, **kwargs) -> Any:
+        with self.connection() as conn:
+            if self.metrics is None:
+                return conn.insert_dataframe(query, dataframe, *args, **kwargs)
+            return record_call(
+                self.metrics,
+                "insert_dataframe",
+                query,
+                conn,
+                dataframe,
+                conn.insert_dataframe,
+                query,
+                dataframe,
+                *args,
+                **kwargs,
+            )
+
+    def iter_batches(
+        self,
+        query: str,
+        batch_size: int = 65536,
+        max_block_size: Optional[int] = None,
+        as_dataframe: bool = False,
+        settings: Optional[Dict[str, Any]] = None,
+        query_id: Optional[str] = None,
+        log_query: bool = True,
+    ) -> Iterator[Union[Dict[str, np.ndarray], "DataFrame"]]:
+        """
+        Streams a SELECT result as column batches of 'batch_size' rows (the last one may be shorter).
+
+        See 'iter_column_batches'. The pooled connection stays checked out until the iterator is exhausted
+        or closed, an abandoned iterator disconnects it.
+
+        :param as_dataframe: yield DataFrames instead of {column name: NumPy array} dicts
+        """
+        if as_dataframe:
+            # pandas is imported on demand, a hook used only for DDL does not pay for it
+            from pandas import DataFrame
+
+        if log_query:
+            self._log_query(query=query)
+        with self.connection() as conn:
+            started, rows, nbytes = time.perf_counter(), 0, 0
+            try:
+                for batch in iter_column_batches(conn, query, batch_size, max_block_size, settings, query_id):
+                    if self.metrics is not None:
+                        rows += len(next(iter(batch.values()), ()))
+                        nbytes += sum(column.nbytes for column in batch.values())
+                    yield DataFrame(batch, copy=False) if as_dataframe else batch
+            except GeneratorExit:
+                conn.disconnect()
+                raise
+            except Exception:
+                if self.metrics is not None:
+                    self.metrics.record("iter_batches", query, time.perf_counter() - started, rows, nbytes, True)
+                raise
+            if self.metrics is not None:
+                self.metrics.record("iter_batches", query, time.perf_counter() - started, rows, nbytes)
+
+    def _execute_iter(self, query: str, *args, **kwargs) -> Iterator[Any]:
+        # the connection stays checked out until the stream is exhausted or closed
+        with self.connection() as conn:
+            try:
+                if self.metrics is None:
+                    yield from conn.execute_iter(query=query, *args, **kwargs)
+                else:
+                    yield from self._recorded_iter(conn, query, *args, **kwargs)
+            except GeneratorExit:
+                # an abandoned stream leaves unread packets, the connection can't be reused
+                conn.disconnect()
+                raise
+
+    def _recorded_iter(self, conn: Client, query: str, *args, **kwargs) -> Iterator[Any]:
+        started, rows = time.perf_counter(), 0
+        try:
+            for row in conn.execute_iter(query=query, *args, **kwargs):
+                rows += 1
+                yield row
+        except Exception:
+            self.metrics.record("execute_iter", query, time.perf_counter() - started, rows, error=True)
+            raise
+        self.metrics.record("execute_iter", query, time.perf_counter() - started, rows, result_size(conn, None)[1])
+
+    def _checkout(self) -> Client:
+        now = time.monotonic()
+        while True:
+            with self._pool_lock:
+                if not self._idle_connections:
+                    return self.get_connection()
+                conn, released_at = self._idle_connections.pop()
+            idle_time = now - released_at
+            if idle_time > self.max_idle_time:
+                conn.disconnect()
+            elif idle_time > self.health_check_interval and not self._is_alive(conn):
+                conn.disconnect()
+            else:
+                return conn
+
+    @staticmethod
+    def _is_alive(conn: Client) -> bool:
+        try:
+            return bool(conn.connection.ping())
+        except Exception:
+            return False
+
+    def _checkin(self, conn: Client) -> None:
+        with self._pool_lock:
+            self._idle_connections.append((conn, time.monotonic()))
 
     @staticmethod
     def _log_query(query):
         message = "Executing query"
         logging.info(msg=f"{message}: \n{query}")
+
+
+def iter_column_batches(
+    client: Client,
+    query: str,
+    batch_size: int = 65536,
+    max_block_size: Optional[int] = None,
+    settings: Optional[Dict[str, Any]] = None,
+    query_id: Optional[str] = None,
+) -> Iterator[Dict[str, np.ndarray]]:
+    """
+    Streams a SELECT result block by block in the driver's NumPy mode, without building row tuples.
+
+    The server sends blocks of up to 'max_block_size' rows ('batch_size' by default), they are regrouped
+    into {column name: NumPy array} batches of exactly 'batch_size' rows, so at most one batch and one block
+    are held in memory. Must be exhausted or closed before 'client' is used again, a closed iterator
+    leaves unread packets and disconnects 'client'.
+
+    :param client: clickhouse connection
+    :param query: SELECT query
+    :param batch_size: rows per yielded batch
+    :param max_block_size: server side block size, 'batch_size' by default
+    :param settings: extra query settings
+    :param query_id: query identifier
+    """
+    if batch_size < 1:
+        raise ValueError("batch_size must be positive")
+    settings = dict(settings or {}, use_numpy=True, max_block_size=max_block_size or batch_size)
+    names: List[str] = []
+    pending: List[List[np.ndarray]] = []
+    pending_rows = 0
+    with client.disconnect_on_error(query, settings):
+        client.connection.send_query(query, query_id=query_id)
+        client.connection.send_external_tables(None)
+        try:
+            for packet in client.packet_generator():
+                if packet.type != ServerPacketTypes.DATA or packet.block is None:
+                    continue
+                if not names:
+                    names = [name for name, _ in packet.block.columns_with_types]
+                if not packet.block.num_rows:
+                    continue
+                pending.append([np.asarray(column) for column in packet.block.get_columns()])
+                pending_rows += packet.block.num_rows
+                while pending_rows >= batch_size:
+                    batch, pending, pending_rows = _split_batch(pending, batch_size, pending_rows)
+                    yield dict(zip(names, batch))
+        except GeneratorExit:
+            client.disconnect()
+            raise
+    if pending_rows:
+        yield dict(zip(names, _split_batch(pending, pending_rows, pending_rows)[0]))
+
+
+def _split_batch(
+    blocks: List[List[np.ndarray]], size: int, rows: int
+) -> Tuple[List[np.ndarray], List[List[np.ndarray]], int]:
+    """Takes the first 'size' rows of buffered blocks as one batch, returns it with the remaining blocks."""
+    taken, rest, count = [], [], 0
+    for block in blocks:
+        block_rows = len(block[0])
+        if count >= size:
+            rest.append(block)
+        elif count + block_rows <= size:
+            taken.append(block)
+            count += block_rows
+        else:
+            head = size - count
+            taken.append([column[:head] for column in block])
+            rest.append([column[head:] for column in block])
+            count = size
+    if len(taken) == 1:
+        return taken[0], rest, rows - size
+    return [np.concatenate(columns) for columns in zip(*taken)], rest, rows - size
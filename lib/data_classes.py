@@ -1,60 +1,206 @@
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Any, ClassVar, Dict, Iterator, List, Optional, Sequence, Type
+
+import numpy as np
+from pandas import DataFrame
+
+
+class Row:
+    """
+    Base of row dataclasses. Fields are '__slots__', so a row holds no per instance dict,
+    and the table is class level metadata instead of a field of every row.
+    """
+
+    __slots__ = ()
+    TABLE_NAME: ClassVar[str] = ""
+
+    @property
+    def TableName(self) -> str:
+        return self.TABLE_NAME
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Field values by name, a shallow and much cheaper 'dataclasses.asdict'."""
+        return {name: getattr(self, name) for name in self.__slots__}
 
 
 @dataclass
-class Provider:
+class Provider(Row):
+    __slots__ = ("ID", "Name")
+    TABLE_NAME: ClassVar[str] = "shop.provider"
     ID: int
     Name: str
-    TableName: str = "shop.provider"
 
 
 @dataclass
-class Storage:
+class Storage(Row):
+    __slots__ = ("ID", "Name", "Address")
+    TABLE_NAME: ClassVar[str] = "shop.storage"
     ID: int
     Name: str
     Address: str
-    TableName: str = "shop.storage"
 
 
 @dataclass
-class Delivery:
+class Delivery(Row):
+    __slots__ = ("ID", "ProviderID", "StorageID", "DeliveryDateTime")
+    TABLE_NAME: ClassVar[str] = "shop.delivery"
     ID: int
     ProviderID: int
     StorageID: int
     DeliveryDateTime: datetime
-    TableName: str = "shop.delivery"
 
 
 @dataclass
-class Invoice:
+class Invoice(Row):
+    __slots__ = ("ID", "StorageID", "InvoiceDateTime")
+    TABLE_NAME: ClassVar[str] = "shop.invoice"
     ID: int
     StorageID: int
     InvoiceDateTime: datetime
-    TableName: str = "shop.invoice"
 
 
 @dataclass
-class Product:
+class Product(Row):
+    __slots__ = ("ID", "Name", "Code")
+    TABLE_NAME: ClassVar[str] = "shop.product"
     ID: int
     Name: str
     Code: int
-    TableName: str = "shop.product"
 
 
 @dataclass
-class DeliveryProductsLine:
+class DeliveryProductsLine(Row):
+    __slots__ = ("ID", "ProductID", "DeliveryID", "Quantity")
+    TABLE_NAME: ClassVar[str] = "shop.delivery_products_line"
     ID: int
     ProductID: int
     DeliveryID: int
     Quantity: int
-    TableName: str = "shop.delivery_products_line"
 
 
 @dataclass
-class InvoiceProductsLine:
+class InvoiceProductsLine(Row):
+    __slots__ = ("ID", "ProductID", "InvoiceID", "Quantity")
+    TABLE_NAME: ClassVar[str] = "shop.invoice_products_line"
     ID: int
     ProductID: int
     InvoiceID: int
     Quantity: int
-    TableName: str = "shop.invoice_products_line"
+
+
+class RowView:
+    """Read-only view of one row of a 'RecordBatch', field access reads the batch's arrays."""
+
+    __slots__ = ("_batch", "_index")
+
+    def __init__(self, batch: "RecordBatch", index: int):
+        self._batch = batch
+        self._index = index
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self._batch.columns[name][self._index]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={value!r}" for name, value in self.to_dict().items())
+        return f"{type(self._batch).ROW.__name__}View({fields})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: column[self._index] for name, column in self._batch.columns.items()}
+
+    def to_row(self) -> Row:
+        """Row dataclass with NumPy scalars converted to Python values."""
+        values = self.to_dict()
+        return type(self._batch).ROW(
+            **{name: value.item() if isinstance(value, np.generic) else value for name, value in values.items()}
+        )
+
+
+class RecordBatch:
+    """
+    Rows of one table as a struct of NumPy arrays, one per field of the 'ROW' dataclass in field order.
+
+    Arrays are kept as given, without copies, so a batch wraps the column dicts of the bulk generator as is.
+    Subclasses set 'ROW', the table defaults to 'ROW.TABLE_NAME'.
+    """
+
+    __slots__ = ("columns", "table_name")
+    ROW: ClassVar[Type[Row]] = Row
+
+    def __init__(self, columns: Dict[str, Any], table_name: Optional[str] = None):
+        names = self.ROW.__slots__
+        if set(columns) != set(names):
+            raise ValueError(f"{type(self).__name__} columns must be {list(names)}, got {list(columns)}")
+        self.columns: Dict[str, np.ndarray] = {name: np.asarray(columns[name]) for name in names}
+        if len({len(column) for column in self.columns.values()}) > 1:
+            raise ValueError(f"{type(self).__name__} columns must have the same length")
+        self.table_name = table_name if table_name is not None else self.ROW.TABLE_NAME
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Row], table_name: Optional[str] = None) -> "RecordBatch":
+        return cls({name: [getattr(row, name) for row in rows] for name in cls.ROW.__slots__}, table_name)
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+    def __getitem__(self, index: int) -> RowView:
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        return RowView(self, index % len(self))
+
+    def __iter__(self) -> Iterator[RowView]:
+        return (RowView(self, index) for index in range(len(self)))
+
+    def to_rows(self) -> List[Row]:
+        return [view.to_row() for view in self]
+
+    def to_dataframe(self) -> DataFrame:
+        """DataFrame over the batch's arrays, the input of 'insert_dataframe'."""
+        return DataFrame(self.columns, copy=False)
+
+    @property
+    def insert_query(self) -> str:
+        """Insert naming the columns, field order may differ from the table's (e.g. delivery lines)."""
+        return f"INSERT INTO {self.table_name} ({', '.join(self.columns)}) VALUES"
+
+    def to_columnar(self) -> List[np.ndarray]:
+        """Columns in field order, the input of 'execute(batch.insert_query, data, columnar=True)'."""
+        return list(self.columns.values())
+
+
+class ProviderBatch(RecordBatch):
+    __slots__ = ()
+    ROW = Provider
+
+
+class StorageBatch(RecordBatch):
+    __slots__ = ()
+    ROW = Storage
+
+
+class DeliveryBatch(RecordBatch):
+    __slots__ = ()
+    ROW = Delivery
+
+
+class InvoiceBatch(RecordBatch):
+    __slots__ = ()
+    ROW = Invoice
+
+
+class ProductBatch(RecordBatch):
+    __slots__ = ()
+    ROW = Product
+
+
+class DeliveryProductsLineBatch(RecordBatch):
+    __slots__ = ()
+    ROW = DeliveryProductsLine
+
+
+class InvoiceProductsLineBatch(RecordBatch):
+    __slots__ = ()
+    ROW = InvoiceProductsLine
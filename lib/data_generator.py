@@ -1,14 +1,17 @@
 import logging
-import time
-from dataclasses import asdict
-from datetime import datetime
+import warnings
+import zlib
+from datetime import datetime, timedelta
+from functools import lru_cache
 from random import randrange, choice, random
-from typing import Dict, Any, Tuple, Optional
+from typing import Dict, Any, Tuple, Optional, Callable, Iterator, List
 
+import numpy as np
 import pandas as pd
 from clickhouse_driver import Client
 from pandas import DataFrame
 
+from lib.checkpoint import CheckpointStore, from_ranges, to_ranges
 from lib.data_classes import (
     Provider,
     Storage,
@@ -17,35 +20,57 @@ from lib.data_classes import (
     Product,
     DeliveryProductsLine,
     InvoiceProductsLine,
+    RecordBatch,
 )
+from lib.file_sink import FileSink
+from lib.id_cache import ForeignKeyCache
+from lib.id_allocator import IdAllocator
+from lib.layout import LayoutProfile
+from lib.metrics import InstrumentedClient, Metrics, maybe_stage
+from lib.samplers import Sampler
+from lib.schema import TableSchema, load_schemas
+from lib.stock_ledger import StockLedger
+from lib.unique_values import UniqueValueAllocator, UniqueNameAllocator, UniqueCodeAllocator
 
 
 class DataGeneratorClickhouse:
     DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+    # upper bound (excluded) of random unsigned values, e.g. the numbers of product names
+    RANDOM_UINT_MAX_VALUE = 2000
 
-    def __init__(self, clickhouse_connection: Client):
+    def __init__(
+        self,
+        clickhouse_connection: Optional[Client],
+        id_allocator: Optional[IdAllocator] = None,
+        metrics: Optional[Metrics] = None,
+    ):
+        self.metrics = metrics
+        if metrics is not None and clickhouse_connection is not None:
+            clickhouse_connection = InstrumentedClient(clickhouse_connection, metrics)
         self.client = clickhouse_connection
+        self.id_allocator = id_allocator if id_allocator is not None else IdAllocator(client=clickhouse_connection)
 
     def execute(self) -> None:
         raise NotImplementedError
 
     def generate_next_uint_id(self, table_name: str, id_field_name: str = "ID") -> int:
-        """Simple autoincrement implementation"""
-        next_id = 1
-        query = f"SELECT max({id_field_name}) FROM {table_name}"
-        current_max_id = self.client.execute(query=query)[0][0]
-        if current_max_id not in (0, None):
-            next_id = current_max_id + 1
-        return next_id
+        """Simple autoincrement implementation, max(ID) is queried once per table by 'id_allocator'"""
+        return self.id_allocator.next_id(table_name, id_field_name)
 
     def check_name_value_available(self, new_name: str, field_name: str, table_name: str) -> bool:
+        """Deprecated: unique values come from 'UniqueValueAllocator', which needs no query per value."""
+        warnings.warn(
+            "check_name_value_available is deprecated, unique values are allocated by UniqueValueAllocator",
+            DeprecationWarning,
+            stacklevel=2,
+        )
         query = f"""WITH
 Names AS (SELECT {field_name} FROM {table_name} GROUP BY {field_name})
 SELECT if({new_name!r} IN Names, 1, 0) AS Result"""
         return self.client.execute(query=query)[0][0]
 
     @staticmethod
-    def generate_random_uint_value(min_value: int = 0, max_value: int = 2000) -> int:
+    def generate_random_uint_value(min_value: int = 0, max_value: int = RANDOM_UINT_MAX_VALUE) -> int:
         return randrange(min_value, max_value)
 
     @staticmethod
@@ -54,11 +79,14 @@ SELECT if({new_name!r} IN Names, 1, 0) AS Result"""
         max_value: str = "2022-12-31 00:00:00",
         time_format: str = "%Y-%m-%d %H:%M:%S",
     ) -> datetime:
-        stime = time.mktime(time.strptime(min_value, time_format))
-        etime = time.mktime(time.strptime(max_value, time_format))
+        stime = _parse_datetime(min_value, time_format)
+        etime = _parse_datetime(max_value, time_format)
+        return stime + timedelta(seconds=int(random() * (etime - stime).total_seconds()))
+
 
-        ptime = stime + random() * (etime - stime)
-        return datetime.strptime(time.strftime(time_format, time.localtime(ptime)), time_format)
+@lru_cache(maxsize=1024)
+def _parse_datetime(value: str, time_format: str) -> datetime:
+    return datetime.strptime(value, time_format)
 
 
 class ShopDataGenerator(DataGeneratorClickhouse):
@@ -101,6 +129,20 @@ class ShopDataGenerator(DataGeneratorClickhouse):
         invoice_table_name: str = "shop.invoice",
         invoice_storage_id_field_name: str = "StorageID",
         invoice_invoice_date_time_field_name: str = "InvoiceDateTime",
+        name_suffix_max_value: int = 2000,
+        product_code_min_value: int = 10000000,
+        product_code_max_value: int = 99999999,
+        product_zipf_exponent: Optional[float] = None,
+        seasonal_datetimes: bool = False,
+        stock_product_partition: Optional[Tuple[int, int]] = None,
+        chunk_size: int = 100000,
+        seed: Optional[int] = None,
+        sink: Optional[FileSink] = None,
+        schemas: Optional[Dict[str, TableSchema]] = None,
+        fk_cache_ttl: Optional[float] = None,
+        checkpoint_path: Optional[str] = None,
+        checkpoint_every: int = 1,
+        layout: Optional[LayoutProfile] = None,
         logger: Any = None,
         **kwargs,
     ):
@@ -117,6 +159,27 @@ class ShopDataGenerator(DataGeneratorClickhouse):
         :param delivery_products_line_count: delivery_products_line entities quantity to generate
         :param invoice_product_line_count: invoice_product_line_count entities quantity to generate
         ...
+        :param name_suffix_max_value: unique names are '<prefix>_<suffix>' with suffix in [0, name_suffix_max_value)
+        :param product_code_min_value: lower bound of unique product codes
+        :param product_code_max_value: upper bound (excluded) of unique product codes
+        :param product_zipf_exponent: in bulk mode, skew product popularity in delivery lines by Zipf law
+        :param seasonal_datetimes: in bulk mode, draw delivery and invoice datetimes with weekly and yearly seasonality
+        :param stock_product_partition: (partition, partitions count) to keep in the stock ledger only products
+            with 'ProductID % partitions count == partition', used by parallel generation
+        :param chunk_size: rows per insert block in bulk mode (see 'execute_bulk')
+        :param seed: seed for the bulk mode sampler and for unique value permutations
+        :param metrics: registry recording clickhouse calls and stage timings, None to disable
+        :param sink: in bulk mode, write chunks to files instead of clickhouse; with 'clickhouse_connection'
+            None generation needs no server, IDs, unique values and stock are then tracked in memory only
+        :param schemas: table schemas keyed by table name, generated columns are cast to their exact dtypes and
+            range checked; by default parsed from 'queries/*.sql', {} disables the checks
+        :param fk_cache_ttl: seconds after which cached IDs of referenced tables are checked against clickhouse,
+            None to rely on the cache being updated by this generator's own inserts (see 'ForeignKeyCache')
+        :param checkpoint_path: file to save 'execute_bulk' progress to after inserted chunks, an interrupted
+            run resumes from it, a finished one lets the next run append without reading the tables (see 'resume')
+        :param checkpoint_every: save the checkpoint every 'checkpoint_every' inserted chunks
+        :param layout: table layouts the tables were created with, bulk chunks are then split by partition and
+            sorted by the sorting key before insert, so each insert makes one part (see 'TableLayout.arrange')
         """
         super().__init__(**kwargs)
         self.insert_query = insert_query
@@ -161,86 +224,97 @@ class ShopDataGenerator(DataGeneratorClickhouse):
 
         self.logger = logger if logger is not None else logging.getLogger()
 
-        self.products_cache = None
-        self.product_cache = None
-        self.delivery_cache = None
+        self.name_suffix_max_value = name_suffix_max_value
+        self.product_code_min_value = product_code_min_value
+        self.product_code_max_value = product_code_max_value
+
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.sampler = Sampler(seed)
+        self.product_zipf_exponent = product_zipf_exponent
+        self.seasonal_datetimes = seasonal_datetimes
+
+        self.sink = sink
+        self.layout = layout
+        self.schemas = schemas if schemas is not None else load_schemas()
+        self.fk_cache = ForeignKeyCache(client=self.client, ttl=fk_cache_ttl, select_query=select_id_query)
+        for table_name, field_name in (
+            (self.provider_table_name, self.id_field_name),
+            (self.storage_table_name, self.id_field_name),
+            (self.product_table_name, self.id_field_name),
+            (self.delivery_table_name, self.id_field_name),
+            # invoices pick products among delivered ones, weighted by their quantity of delivery lines
+            (self.delivery_products_line_table_name, self.delivery_products_line_product_id_field_name),
+        ):
+            self.fk_cache.track(table_name, field_name)
+
+        self.stock_product_partition = stock_product_partition
+        # without a server nothing exists yet, the ledger is filled from the first delivery on
+        self.stock_ledger: Optional[StockLedger] = StockLedger() if self.client is None else None
+        self.unique_allocators: Dict[Tuple[str, str], UniqueValueAllocator] = {}
+
+        if checkpoint_path is not None and (self.client is None or sink is not None):
+            raise ValueError("Checkpoints require 'clickhouse_connection' and no 'sink'")
+        self.checkpoint = CheckpointStore(checkpoint_path) if checkpoint_path is not None else None
+        self.checkpoint_every = checkpoint_every
+        # bulk progress: chunks inserted per table and the highest ID of every table covered by them
+        self.run_number = 0
+        self.completed_chunks: Dict[str, int] = {}
+        self.committed_ids: Dict[str, int] = {}
+        self._uncommitted_ids: Dict[str, int] = {}
+        self._chunks_since_checkpoint = 0
 
     def generate_provider_row(self, to_insert: bool = True) -> Provider:
-        name_available_state = 1
-        new_name = ""
         new_id = self.generate_next_uint_id(table_name=self.provider_table_name, id_field_name=self.id_field_name)
-        while name_available_state:
-            new_name = f"{choice(self.PROVIDER_NAMES)}_{self.generate_random_uint_value()}"
-            name_available_state = self.check_name_value_available(
-                new_name, self.provider_name_field_name, self.provider_table_name
-            )
-            if name_available_state and self.logger:
-                self.logger.warning(f"Попытка добавить существующего провайдера, отказано. {new_name}")
+        new_name = self.get_unique_allocator(self.provider_table_name, self.provider_name_field_name).allocate(1)[0]
         provider = Provider(ID=new_id, Name=new_name)
         if to_insert:
-            self._insert_record(asdict(provider), self.provider_table_name)
+            self._insert_record(provider.to_dict(), self.provider_table_name)
         return provider
 
     def generate_storage_row(self, to_insert: bool = True) -> Storage:
-        name_available_state, address_available_state = 1, 1
-        new_name, new_address = "", ""
-
         new_id = self.generate_next_uint_id(table_name=self.storage_table_name, id_field_name=self.id_field_name)
-
-        while name_available_state:
-            new_name = f"{choice(self.STORAGE_NAMES)}_{self.generate_random_uint_value()}"
-            name_available_state = self.check_name_value_available(
-                new_name, self.storage_name_field_name, self.storage_table_name
-            )
-            if name_available_state and self.logger:
-                self.logger.warning(f"Попытка добавить существующий склад, отказано. {new_name}")
-
-        while address_available_state:
-            new_address = f"{choice(self.ADDRESSES_NAMES)}_{self.generate_random_uint_value()}"
-            address_available_state = self.check_name_value_available(
-                new_address, self.storage_address_field_name, self.storage_table_name
-            )
+        new_name = self.get_unique_allocator(self.storage_table_name, self.storage_name_field_name).allocate(1)[0]
+        new_address = self.get_unique_allocator(self.storage_table_name, self.storage_address_field_name).allocate(1)[0]
         storage = Storage(ID=new_id, Name=new_name, Address=new_address)
         if to_insert:
-            self._insert_record(asdict(storage), self.storage_table_name)
+            self._insert_record(storage.to_dict(), self.storage_table_name)
         return storage
 
     def generate_delivery_row(self, to_insert: bool = True) -> Delivery:
         new_id = self.generate_next_uint_id(table_name=self.delivery_table_name, id_field_name=self.id_field_name)
         new_datetime = self.generate_random_datetime()
-        select_storage_query = self.select_id_query.format(
-            id_field_name=self.id_field_name, table=self.storage_table_name
-        )
-        select_provider_query = self.select_id_query.format(
-            id_field_name=self.id_field_name, table=self.provider_table_name
-        )
-
-        storages = self.client.query_dataframe(select_storage_query)
-        providers = self.client.query_dataframe(select_provider_query)
-
-        provider, storage = providers.sample(n=1)[self.id_field_name], storages.sample(n=1)[self.id_field_name]
+        provider = int(self.fk_cache.sample(self.provider_table_name, 1, self.sampler)[0])
+        storage = int(self.fk_cache.sample(self.storage_table_name, 1, self.sampler)[0])
         delivery = Delivery(ID=new_id, StorageID=storage, ProviderID=provider, DeliveryDateTime=new_datetime)
         if to_insert:
-            self._insert_record(asdict(delivery), self.delivery_table_name)
+            self._insert_record(delivery.to_dict(), self.delivery_table_name)
+            if self.stock_ledger is not None:
+                self.stock_ledger.add_deliveries([new_id], [storage], [new_datetime])
         return delivery
 
     def generate_product_row(
-        self, to_insert: bool = True, min_value: int = 10000000, max_value: int = 99999999
+        self, to_insert: bool = True, min_value: Optional[int] = None, max_value: Optional[int] = None
     ) -> Product:
-        code_available_state = 1
-        new_code = 10000000
+        """
+        Product row with a unique code drawn by the code allocator.
+
+        'min_value' and 'max_value' are deprecated and ignored: the code range is set for the whole generator
+        by 'product_code_min_value' and 'product_code_max_value', so that codes stay unique.
+        """
+        if min_value is not None or max_value is not None:
+            warnings.warn(
+                "generate_product_row min_value and max_value are ignored, "
+                "use product_code_min_value and product_code_max_value of ShopDataGenerator",
+                DeprecationWarning,
+                stacklevel=2,
+            )
         new_id = self.generate_next_uint_id(table_name=self.product_table_name, id_field_name=self.id_field_name)
         new_name = f"{choice(self.PRODUCT_NAMES)}_{self.generate_random_uint_value()}"
-        while code_available_state:
-            new_code = self.generate_random_uint_value(min_value=min_value, max_value=max_value)
-            code_available_state = self.check_name_value_available(
-                new_name, self.product_code_field_name, self.product_table_name
-            )
-            if code_available_state and self.logger:
-                self.logger.warning(f"Попытка добавить товар с неуникальным кодом, отказано. {new_code}")
+        new_code = int(self.get_unique_allocator(self.product_table_name, self.product_code_field_name).allocate(1)[0])
         product = Product(ID=new_id, Name=new_name, Code=new_code)
         if to_insert:
-            self._insert_record(asdict(product), self.product_table_name)
+            self._insert_record(product.to_dict(), self.product_table_name)
         return product
 
     def generate_delivery_product_line_row(
@@ -249,22 +323,8 @@ class ShopDataGenerator(DataGeneratorClickhouse):
         new_id = self.generate_next_uint_id(
             table_name=self.delivery_products_line_table_name, id_field_name=self.id_field_name
         )
-        select_product_query = self.select_id_query.format(
-            id_field_name=self.id_field_name, table=self.product_table_name
-        )
-        select_delivery_query = self.select_id_query.format(
-            id_field_name=self.id_field_name, table=self.delivery_table_name
-        )
-        if self.product_cache is None and self.delivery_cache is None:
-            products = self.client.query_dataframe(select_product_query)
-            deliveries = self.client.query_dataframe(select_delivery_query)
-            self.product_cache = products
-            self.delivery_cache = deliveries
-        else:
-            products = self.product_cache
-            deliveries = self.delivery_cache
-
-        product, delivery = products.sample(n=1)[self.id_field_name], deliveries.sample(n=1)[self.id_field_name]
+        product = int(self.fk_cache.sample(self.product_table_name, 1, self.sampler)[0])
+        delivery = int(self.fk_cache.sample(self.delivery_table_name, 1, self.sampler)[0])
 
         quantity = self.generate_random_uint_value(min_value=min_quantity, max_value=max_quantity)
 
@@ -273,139 +333,705 @@ class ShopDataGenerator(DataGeneratorClickhouse):
         )
 
         if to_insert:
-            self._insert_record(asdict(delivery_products_line), self.delivery_products_line_table_name)
+            self._insert_record(delivery_products_line.to_dict(), self.delivery_products_line_table_name)
+            if self.stock_ledger is not None:
+                self.stock_ledger.add_delivery_lines([product], [delivery], [quantity])
 
         return delivery_products_line
 
     def generate_invoice__invoice_product_line_rows(
         self, to_insert: bool = True
     ) -> Optional[Tuple[InvoiceProductsLine, Invoice]]:
+        product = int(
+            self.fk_cache.sample(
+                self.delivery_products_line_table_name,
+                1,
+                self.sampler,
+                field_name=self.delivery_products_line_product_id_field_name,
+            )[0]
+        )
+
+        stock_ledger = self.get_stock_ledger()
+        best_storage = stock_ledger.best_storage(product)
+        if best_storage is None or best_storage[1] < 1:
+            if self.logger:
+                self.logger.error("Ошибка оформления заказа")
+            return
+        storage_id, available, first_delivery = best_storage
+        if available == 1:
+            quantity = 1
+        else:
+            quantity = self.generate_random_uint_value(min_value=1, max_value=int(available * 1.5))
+            if quantity > available:
+                if self.logger:
+                    self.logger.warning(
+                        f"Попытка сделать заказ большего количества чем есть, отказано. {quantity} > {available}"
+                    )
+                return
+
         new_id = self.generate_next_uint_id(
             table_name=self.invoice_products_line_table_name, id_field_name=self.id_field_name
         )
-
         new_invoice_id = self.generate_next_uint_id(
             table_name=self.invoice_table_name, id_field_name=self.id_field_name
         )
+        min_datetime = pd.Timestamp(first_delivery, unit="s").strftime(self.DATETIME_FORMAT)
+        invoice_datetime = self.generate_random_datetime(min_value=min_datetime, time_format=self.DATETIME_FORMAT)
+        invoice = Invoice(ID=new_invoice_id, InvoiceDateTime=invoice_datetime, StorageID=storage_id)
+        invoice_product_line = InvoiceProductsLine(
+            ID=new_id, ProductID=product, Quantity=quantity, InvoiceID=new_invoice_id
+        )
+
+        if to_insert:
+            self._insert_record(invoice.to_dict(), self.invoice_table_name)
+            self._insert_record(invoice_product_line.to_dict(), self.invoice_products_line_table_name)
+            stock_ledger.add_invoiced([product], [storage_id], [quantity])
+
+        return invoice_product_line, invoice
+
+    def get_unique_allocator(self, table_name: str, field_name: str) -> UniqueValueAllocator:
+        """Allocator of unique values for the column, existing values are loaded from clickhouse once."""
+        key = (table_name, field_name)
+        if key not in self.unique_allocators:
+            allocator = self._make_unique_allocator(table_name, field_name)
+            if self.client is not None:
+                query = f"SELECT {field_name} FROM {table_name} GROUP BY {field_name}"
+                allocator.add_existing(self.client.query_dataframe(query)[field_name].tolist())
+            self.unique_allocators[key] = allocator
+        return self.unique_allocators[key]
+
+    def _make_unique_allocator(self, table_name: str, field_name: str) -> UniqueValueAllocator:
+        seed = None if self.seed is None else [self.seed, zlib.crc32(f"{table_name}.{field_name}".encode())]
+        value_spaces = {
+            (self.provider_table_name, self.provider_name_field_name): self.PROVIDER_NAMES,
+            (self.storage_table_name, self.storage_name_field_name): self.STORAGE_NAMES,
+            (self.storage_table_name, self.storage_address_field_name): self.ADDRESSES_NAMES,
+        }
+        if (table_name, field_name) == (self.product_table_name, self.product_code_field_name):
+            return UniqueCodeAllocator(self.product_code_min_value, self.product_code_max_value, seed=seed)
+        return UniqueNameAllocator(value_spaces[table_name, field_name], self.name_suffix_max_value, seed=seed)
+
+    def get_stock_ledger(self) -> StockLedger:
+        """Stock ledger seeded from clickhouse on first use and kept up to date by the generator afterwards."""
+        if self.stock_ledger is None:
+            self.stock_ledger = self._load_stock_ledger()
+        return self.stock_ledger
+
+    def check_unique_capacity(self) -> None:
+        """Reports remaining unique values per column and fails before generation if any is too small."""
+        required = {
+            (self.provider_table_name, self.provider_name_field_name): self.provider_count,
+            (self.storage_table_name, self.storage_name_field_name): self.storage_count,
+            (self.storage_table_name, self.storage_address_field_name): self.storage_count,
+            (self.product_table_name, self.product_code_field_name): self.product_count,
+        }
+        for (table_name, field_name), count in required.items():
+            # a resumed run only generates the chunks left
+            count -= min(count, self.completed_chunks.get(table_name, 0) * self.chunk_size)
+            remaining = self.get_unique_allocator(table_name, field_name).remaining
+            self.logger.info(f"{table_name}.{field_name}: {remaining} unique values available, {count} required.")
+            if remaining < count:
+                raise ValueError(
+                    f"Not enough unique values for {table_name}.{field_name}: {remaining} < {count}, "
+                    f"increase 'name_suffix_max_value' or the product code range"
+                )
+
+    def execute(self) -> None:
+        self.check_unique_capacity()
+        stages = [
+            ("Providers", self.provider_count, self.generate_provider_row),
+            ("Storages", self.storage_count, self.generate_storage_row),
+            ("Deliveries", self.delivery_count, self.generate_delivery_row),
+            ("Products", self.product_count, self.generate_product_row),
+            ("Delivery_product_lines", self.delivery_products_line_count, self.generate_delivery_product_line_row),
+            ("Invoices", self.invoice_product_line_count, self.generate_invoice__invoice_product_line_rows),
+        ]
+        for stage_name, count, generate_row in stages:
+            with maybe_stage(self.metrics, stage_name):
+                for _ in range(count):
+                    generate_row()
+            self.logger.info(f"{stage_name} successfully inserted.")
+
+    def generate_provider_columns(self, count: int, sampler: Optional[Sampler] = None) -> Dict[str, np.ndarray]:
+        """
+        Providers draw no random values besides their unique names, which come from the unique allocator's own
+        permutation. 'sampler' is unused, it keeps the signature of the other 'generate_*_columns' methods.
+        """
+        new_ids = self._generate_id_block(self.provider_table_name, count)
+        new_names = self.get_unique_allocator(self.provider_table_name, self.provider_name_field_name).allocate(count)
+        return self._cast_columns(
+            self.provider_table_name, {self.id_field_name: new_ids, self.provider_name_field_name: new_names}
+        )
+
+    def generate_storage_columns(self, count: int, sampler: Optional[Sampler] = None) -> Dict[str, np.ndarray]:
+        """Storages only take unique names and addresses from the allocators, 'sampler' is unused as for providers."""
+        new_ids = self._generate_id_block(self.storage_table_name, count)
+        new_names = self.get_unique_allocator(self.storage_table_name, self.storage_name_field_name).allocate(count)
+        new_addresses = self.get_unique_allocator(self.storage_table_name, self.storage_address_field_name).allocate(
+            count
+        )
+        return self._cast_columns(
+            self.storage_table_name,
+            {
+                self.id_field_name: new_ids,
+                self.storage_name_field_name: new_names,
+                self.storage_address_field_name: new_addresses,
+            },
+        )
+
+    def generate_delivery_columns(self, count: int, sampler: Optional[Sampler] = None) -> Dict[str, np.ndarray]:
+        sampler = sampler if sampler is not None else self.sampler
+        new_ids = self._generate_id_block(self.delivery_table_name, count)
+        storages = self.fk_cache.get(self.storage_table_name)
+        providers = self.fk_cache.get(self.provider_table_name)
+        return self._cast_columns(
+            self.delivery_table_name,
+            {
+                self.id_field_name: new_ids,
+                self.delivery_provider_id_field_name: sampler.choice(providers, size=count),
+                self.delivery_storage_id_field_name: sampler.choice(storages, size=count),
+                self.delivery_delivery_date_time_field_name: self._sample_datetimes(sampler, count),
+            },
+        )
+
+    def generate_product_columns(self, count: int, sampler: Optional[Sampler] = None) -> Dict[str, np.ndarray]:
+        sampler = sampler if sampler is not None else self.sampler
+        new_ids = self._generate_id_block(self.product_table_name, count)
+        new_names = self._format_names(
+            sampler.choice(self.PRODUCT_NAMES, size=count), sampler.integers(0, self.RANDOM_UINT_MAX_VALUE, size=count)
+        )
+        new_codes = self.get_unique_allocator(self.product_table_name, self.product_code_field_name).allocate(count)
+        return self._cast_columns(
+            self.product_table_name,
+            {
+                self.id_field_name: new_ids,
+                self.product_name_field_name: new_names,
+                self.product_code_field_name: new_codes,
+            },
+        )
+
+    def generate_delivery_product_line_columns(
+        self, count: int, sampler: Optional[Sampler] = None, min_quantity: int = 1, max_quantity: int = 100
+    ) -> Dict[str, np.ndarray]:
+        sampler = sampler if sampler is not None else self.sampler
+        new_ids = self._generate_id_block(self.delivery_products_line_table_name, count)
+        products = self.fk_cache.get(self.product_table_name)
+        deliveries = self.fk_cache.get(self.delivery_table_name)
+        if self.product_zipf_exponent is None:
+            picked_products = sampler.choice(products, size=count)
+        else:
+            picked_products = products[sampler.zipf_indices(len(products), count, self.product_zipf_exponent)]
+        return self._cast_columns(
+            self.delivery_products_line_table_name,
+            {
+                self.id_field_name: new_ids,
+                self.delivery_products_line_product_id_field_name: picked_products,
+                self.delivery_products_line_delivery_id_field_name: sampler.choice(deliveries, size=count),
+                self.delivery_products_line_quantity_field_name: sampler.integers(
+                    min_quantity, max_quantity, size=count, dtype=np.uint16
+                ),
+            },
+        )
+
+    def generate_invoice__invoice_product_line_columns(
+        self, count: int, sampler: Optional[Sampler] = None
+    ) -> Tuple[Dict[str, np.ndarray], Dict[str, np.ndarray]]:
+        """
+        Bulk counterpart of 'generate_invoice__invoice_product_line_rows'.
+
+        Every one of 'count' attempts picks a product weighted by its delivery lines, the storage with
+        the largest stock of it and a quantity up to 1.5 of that stock. Attempts exceeding the stock are
+        rejected, as in the row-wise method, so fewer than 'count' invoices may be returned. An attempt sees
+        the stock left by the earlier attempts of the chunk: the n-th attempts of all products are drawn at
+        once, round after round. The result is reproducible for a given seed and 'chunk_size' only, since every
+        chunk draws from its own sampler substream.
+        Stock is read from 'stock_ledger', which 'execute_bulk' updates once the chunk is inserted.
+        """
+        sampler = sampler if sampler is not None else self.sampler
+        stock_ledger = self.get_stock_ledger()
+        empty_invoices = {
+            self.id_field_name: np.empty(0, dtype=np.uint32),
+            self.invoice_storage_id_field_name: np.empty(0, dtype=np.uint32),
+            self.invoice_invoice_date_time_field_name: np.empty(0, dtype="datetime64[s]"),
+        }
+        empty_lines = {
+            self.id_field_name: np.empty(0, dtype=np.uint32),
+            self.invoice_products_line_product_id_field_name: np.empty(0, dtype=np.uint32),
+            self.invoice_products_line_invoice_id_field_name: np.empty(0, dtype=np.uint32),
+            self.invoice_products_line_quantity_field_name: np.empty(0, dtype=np.uint16),
+        }
+        product_ids = stock_ledger.sample_products(sampler, count)
+        if not len(product_ids):
+            return empty_invoices, empty_lines
+
+        # attempts grouped by product, 'ranks' numbers the attempts of a product in chunk order
+        order = np.argsort(product_ids, kind="stable")
+        group_starts = np.flatnonzero(np.diff(product_ids[order], prepend=-1))
+        group_sizes = np.diff(np.append(group_starts, count))
+        groups = np.empty(count, dtype=np.int64)
+        groups[order] = np.repeat(np.arange(len(group_starts)), group_sizes)
+        ranks = np.empty(count, dtype=np.int64)
+        ranks[order] = np.arange(count) - np.repeat(group_starts, group_sizes)
+
+        # chunk-local copy of the balances of the picked products, a contiguous slice per product
+        slice_starts, slice_ends = stock_ledger.product_slices(product_ids[order][group_starts])
+        slice_sizes = slice_ends - slice_starts
+        local_starts = np.cumsum(slice_sizes) - slice_sizes
+        ledger_positions = np.repeat(slice_starts - local_starts, slice_sizes) + np.arange(slice_sizes.sum())
+        available = stock_ledger.delivered[ledger_positions] - stock_ledger.invoiced[ledger_positions]
+
+        balances = np.zeros(count, dtype=np.int64)
+        quantity = np.zeros(count, dtype=np.int64)
+        accepted = np.zeros(count, dtype=bool)
+        exhausted = np.zeros(len(group_starts), dtype=bool)
+        rank_order = np.argsort(ranks, kind="stable")
+        rank_starts = np.concatenate(([0], np.cumsum(np.bincount(ranks))))
+        for rank_start, rank_end in zip(rank_starts[:-1], rank_starts[1:]):
+            # one attempt per product, the products without stock reject all their remaining attempts
+            attempts = rank_order[rank_start:rank_end]
+            attempts = attempts[~exhausted[groups[attempts]]]
+            if not len(attempts):
+                continue
+            sizes = slice_sizes[groups[attempts]]
+            offsets = np.cumsum(sizes) - sizes
+            local = np.repeat(local_starts[groups[attempts]] - offsets, sizes) + np.arange(sizes.sum())
+            largest = np.maximum.reduceat(available[local], offsets)
+            # the first of the largest balances, the lowest storage ID as in 'StockLedger.best_storage'
+            candidates = np.flatnonzero(available[local] == np.repeat(largest, sizes))
+            best = local[candidates[np.searchsorted(candidates, offsets)]]
 
-        select_product_query = self.select_id_query.format(
-            id_field_name=self.delivery_products_line_product_id_field_name,
-            table=self.delivery_products_line_table_name,
+            upper = np.maximum((largest * 1.5).astype(np.int64), 2)
+            drawn = np.where(largest == 1, 1, sampler.integers(1, upper, size=len(attempts)))
+            fits = (largest > 0) & (drawn <= largest)
+            exhausted[groups[attempts[largest < 1]]] = True
+            available[best[fits]] -= drawn[fits]
+            balances[attempts] = best
+            quantity[attempts] = drawn
+            accepted[attempts[fits]] = True
+
+        rejected = count - int(accepted.sum())
+        if rejected and self.logger:
+            self.logger.warning(f"Попытка сделать заказ большего количества чем есть, отказано. {rejected} раз")
+        if not accepted.any():
+            return empty_invoices, empty_lines
+
+        positions = ledger_positions[balances[accepted]]
+        product_ids, quantity = product_ids[accepted], quantity[accepted]
+        new_count = len(positions)
+        new_ids = self._generate_id_block(self.invoice_products_line_table_name, new_count)
+        new_invoice_ids = self._generate_id_block(self.invoice_table_name, new_count)
+        min_datetimes = stock_ledger.first_deliveries[positions].astype("datetime64[s]")
+
+        invoices = {
+            self.id_field_name: new_invoice_ids,
+            self.invoice_storage_id_field_name: stock_ledger.storages_at(positions),
+            self.invoice_invoice_date_time_field_name: self._sample_datetimes(
+                sampler, new_count, min_value=min_datetimes
+            ),
+        }
+        invoice_product_lines = {
+            self.id_field_name: new_ids,
+            self.invoice_products_line_product_id_field_name: product_ids,
+            self.invoice_products_line_invoice_id_field_name: new_invoice_ids,
+            self.invoice_products_line_quantity_field_name: quantity,
+        }
+        return (
+            self._cast_columns(self.invoice_table_name, invoices),
+            self._cast_columns(self.invoice_products_line_table_name, invoice_product_lines),
         )
-        if self.products_cache is None:
-            products = self.client.query_dataframe(select_product_query)
-            self.products_cache = products
+
+    def execute_bulk(self) -> None:
+        """Columnar variant of 'execute': every entity is generated and inserted in blocks of 'chunk_size' rows."""
+        if self.checkpoint is not None and not self.resume():
+            self._start_checkpoints()
+        self.check_unique_capacity()
+        for stage_name, sources in self.iter_stages():
+            with maybe_stage(self.metrics, stage_name):
+                for source in sources:
+                    for table_name, columns in source:
+                        self._insert_columns(columns, table_name)
+                        if self.checkpoint is not None:
+                            self._commit_chunk(table_name, columns)
+            self.logger.info(f"{stage_name} successfully inserted.")
+        if self.checkpoint is not None:
+            self.save_checkpoint(finished=True)
+
+    def resume(self) -> bool:
+        """
+        Restores the state of the last checkpoint, returns False if there is none.
+
+        An interrupted run continues with its next chunk: rows past the IDs its checkpoint covers (a chunk
+        inserted after the last save) are deleted first, then ID high-water marks, the sampler, unique value
+        indexes, the stock ledger and cached parent IDs are restored instead of being read from the tables.
+        After a finished run, a new run appends to the tables from the same state, with fresh random streams.
+        """
+        loaded = self.checkpoint.load()
+        if loaded is None:
+            return False
+        meta, arrays = loaded
+        if meta["finished"]:
+            # unique value permutations depend on the seed, and the state is stale if someone else wrote
+            if meta["settings"]["seed"] != self.seed or any(
+                self.id_allocator.load_high_water_mark(table_name, self.id_field_name) != committed_id
+                for table_name, committed_id in meta["committed_ids"].items()
+            ):
+                self.logger.warning(
+                    f"Контрольная точка {self.checkpoint.path} устарела, состояние будет прочитано из таблиц"
+                )
+                return False
+            self.run_number = meta["run_number"] + 1
+            self.completed_chunks = {}
+            self.committed_ids = meta["committed_ids"]
         else:
-            products = self.products_cache
-        product = int(products.sample(n=1)[self.delivery_products_line_product_id_field_name])
+            if meta["settings"] != self._checkpoint_settings():
+                raise ValueError(
+                    f"Checkpoint {self.checkpoint.path} was saved with other settings: {meta['settings']}, "
+                    "remove it to start over"
+                )
+            self.run_number = meta["run_number"]
+            self.completed_chunks = meta["completed_chunks"]
+            self.committed_ids = meta["committed_ids"]
+            self._rollback_uncommitted()
+
+        self.id_allocator.high_water_marks.update(self.committed_ids)
+        self.sampler.rng.bit_generator.state = meta["rng_state"]
+        for number, (table_name, field_name, position) in enumerate(meta["unique_allocators"]):
+            allocator = self._make_unique_allocator(table_name, field_name)
+            allocator.position = position
+            allocator.taken_positions = arrays[f"unique_{number}"]
+            self.unique_allocators[table_name, field_name] = allocator
+        if meta["stock_ledger"]:
+            self.stock_ledger = StockLedger.from_arrays(
+                {name[len("ledger_") :]: array for name, array in arrays.items() if name.startswith("ledger_")}
+            )
+        for number, table_name in enumerate(meta["fk_tables"]):
+            self.fk_cache.set(table_name, from_ranges(arrays[f"ids_{number}"]), self.id_field_name)
+        self.logger.info(f"Resumed from checkpoint {self.checkpoint.path}: {self.completed_chunks} chunks done.")
+        return True
+
+    def save_checkpoint(self, finished: bool = False) -> None:
+        meta = {
+            "finished": finished,
+            "run_number": self.run_number,
+            "settings": self._checkpoint_settings(),
+            "completed_chunks": self.completed_chunks,
+            "committed_ids": self.committed_ids,
+            "rng_state": self.sampler.rng.bit_generator.state,
+            "unique_allocators": [],
+            "stock_ledger": self.stock_ledger is not None,
+            "fk_tables": [],
+        }
+        arrays = {}
+        for number, ((table_name, field_name), allocator) in enumerate(self.unique_allocators.items()):
+            meta["unique_allocators"].append([table_name, field_name, allocator.position])
+            arrays[f"unique_{number}"] = allocator.taken_positions
+        if self.stock_ledger is not None:
+            arrays.update({f"ledger_{name}": array for name, array in self.stock_ledger.to_arrays().items()})
+        # only ID columns, as ranges: parent IDs are contiguous blocks, the product IDs of delivery lines are not
+        for (table_name, field_name), values in self.fk_cache.loaded().items():
+            if field_name == self.id_field_name:
+                arrays[f"ids_{len(meta['fk_tables'])}"] = to_ranges(values)
+                meta["fk_tables"].append(table_name)
+        self.checkpoint.save(meta, arrays)
+        self._chunks_since_checkpoint = 0
+
+    def _start_checkpoints(self) -> None:
+        """Records the tables' high-water marks before the run, the rollback point of its first chunks."""
+        for table_name in self._checkpoint_tables():
+            self.committed_ids[table_name] = self.id_allocator.load_high_water_mark(table_name, self.id_field_name)
+        self.save_checkpoint()
+
+    def _commit_chunk(self, table_name: str, columns: Dict[str, np.ndarray]) -> None:
+        ids = columns[self.id_field_name]
+        if len(ids):
+            self._uncommitted_ids[table_name] = max(self._uncommitted_ids.get(table_name, 0), int(ids.max()))
+        # an invoice chunk is complete once its lines are inserted as well
+        if table_name == self.invoice_table_name:
+            return
+        if table_name == self.invoice_products_line_table_name:
+            table_name = self.invoice_table_name
+        self.completed_chunks[table_name] = self.completed_chunks.get(table_name, 0) + 1
+        self.committed_ids.update(self._uncommitted_ids)
+        self._uncommitted_ids = {}
+        self._chunks_since_checkpoint += 1
+        if self._chunks_since_checkpoint >= self.checkpoint_every:
+            self.save_checkpoint()
+
+    def _rollback_uncommitted(self) -> None:
+        """Deletes rows inserted after the last checkpoint, they would be generated again."""
+        for table_name, committed_id in self.committed_ids.items():
+            current_max_id = self.id_allocator.load_high_water_mark(table_name, self.id_field_name)
+            if current_max_id > committed_id:
+                self.logger.warning(
+                    f"Удаление строк, вставленных после контрольной точки: {table_name}, {self.id_field_name} > "
+                    f"{committed_id}"
+                )
+                self.client.execute(
+                    query=f"ALTER TABLE {table_name} DELETE WHERE {self.id_field_name} > {committed_id}",
+                    settings={"mutations_sync": 1},
+                )
+
+    def _checkpoint_tables(self) -> List[str]:
+        return [
+            self.provider_table_name,
+            self.storage_table_name,
+            self.product_table_name,
+            self.delivery_table_name,
+            self.delivery_products_line_table_name,
+            self.invoice_table_name,
+            self.invoice_products_line_table_name,
+        ]
+
+    def _checkpoint_settings(self) -> Dict[str, Any]:
+        """Settings a run can only be resumed with, other ones would generate different chunks."""
+        return {
+            "seed": self.seed,
+            "chunk_size": self.chunk_size,
+            "provider_count": self.provider_count,
+            "storage_count": self.storage_count,
+            "product_count": self.product_count,
+            "delivery_count": self.delivery_count,
+            "delivery_products_line_count": self.delivery_products_line_count,
+            "invoice_product_line_count": self.invoice_product_line_count,
+            "tables": self._checkpoint_tables(),
+        }
+
+    def iter_stages(self) -> List[Tuple[str, List[Iterator[Tuple[str, Dict[str, np.ndarray]]]]]]:
+        """
+        Bulk generation as stages of (table name, columns) chunk iterators.
+
+        A stage reads the IDs inserted by the previous one, so its chunks must be inserted before the next
+        stage is started. Chunks are booked in the stock ledger when they are generated.
+        """
+        return [
+            (
+                "Providers, storages and products",
+                [
+                    self.iter_entity_chunks(
+                        self.provider_table_name, self.provider_count, self.generate_provider_columns
+                    ),
+                    self.iter_entity_chunks(self.storage_table_name, self.storage_count, self.generate_storage_columns),
+                    self.iter_entity_chunks(self.product_table_name, self.product_count, self.generate_product_columns),
+                ],
+            ),
+            (
+                "Deliveries",
+                [
+                    self.iter_entity_chunks(
+                        self.delivery_table_name, self.delivery_count, self.generate_delivery_columns
+                    )
+                ],
+            ),
+            (
+                "Delivery_product_lines",
+                [
+                    self.iter_entity_chunks(
+                        self.delivery_products_line_table_name,
+                        self.delivery_products_line_count,
+                        self.generate_delivery_product_line_columns,
+                    )
+                ],
+            ),
+            ("Invoices", [self.iter_invoice_chunks()]),
+        ]
+
+    def iter_entity_chunks(
+        self, table_name: str, count: int, generate_columns: Callable[[int, Sampler], Dict[str, np.ndarray]]
+    ) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        for size, sampler in self._chunk_sizes(count, table_name):
+            columns = generate_columns(size, sampler)
+            self._update_stock_ledger(columns, table_name)
+            yield table_name, columns
+
+    def iter_invoice_chunks(self) -> Iterator[Tuple[str, Dict[str, np.ndarray]]]:
+        for size, sampler in self._chunk_sizes(self.invoice_product_line_count, self.invoice_table_name):
+            invoices, invoice_product_lines = self.generate_invoice__invoice_product_line_columns(size, sampler)
+            self._book_invoices(invoices, invoice_product_lines)
+            yield self.invoice_table_name, invoices
+            yield self.invoice_products_line_table_name, invoice_product_lines
 
-        delivery_quantity_sum_by_storage_id_query = f"""SELECT 
-	StorageID, 
-	sum(Quantity) AS QuantitySum, 
-	min(DeliveryDateTime) AS DeliveryDateTimeMin 
+    def insert_invoice_chunk(self, count: int, sampler: Optional[Sampler] = None) -> int:
+        """Generates and inserts up to 'count' invoices with their lines, then books them in the stock ledger."""
+        invoices, invoice_product_lines = self.generate_invoice__invoice_product_line_columns(count, sampler)
+        self._insert_columns(invoices, self.invoice_table_name)
+        self._insert_columns(invoice_product_lines, self.invoice_products_line_table_name)
+        self._book_invoices(invoices, invoice_product_lines)
+        return len(invoices[self.id_field_name])
+
+    def _chunk_sizes(self, count: int, table_name: str) -> Iterator[Tuple[int, Sampler]]:
+        """Chunk sizes with a sampler substream per (table, chunk number), so chunks are reproducible on their own."""
+        table_key = zlib.crc32(table_name.encode())
+        for number, start in enumerate(range(0, count, self.chunk_size)):
+            if number < self.completed_chunks.get(table_name, 0):
+                continue
+            # runs appending to a finished one get streams of their own
+            key = (table_key, number) if not self.run_number else (table_key, number, self.run_number)
+            yield min(self.chunk_size, count - start), self.sampler.substream(*key)
+
+    def _update_stock_ledger(self, columns: Dict[str, np.ndarray], table_name: str) -> None:
+        if self.stock_ledger is None:
+            return
+        if table_name == self.delivery_table_name:
+            self.stock_ledger.add_deliveries(
+                columns[self.id_field_name],
+                columns[self.delivery_storage_id_field_name],
+                columns[self.delivery_delivery_date_time_field_name],
+            )
+        elif table_name == self.delivery_products_line_table_name:
+            self.stock_ledger.add_delivery_lines(
+                columns[self.delivery_products_line_product_id_field_name],
+                columns[self.delivery_products_line_delivery_id_field_name],
+                columns[self.delivery_products_line_quantity_field_name],
+            )
+
+    def _book_invoices(self, invoices: Dict[str, np.ndarray], invoice_product_lines: Dict[str, np.ndarray]) -> None:
+        self.get_stock_ledger().add_invoiced(
+            invoice_product_lines[self.invoice_products_line_product_id_field_name],
+            invoices[self.invoice_storage_id_field_name],
+            invoice_product_lines[self.invoice_products_line_quantity_field_name],
+        )
+
+    def _generate_id_block(self, table_name: str, count: int) -> np.ndarray:
+        return self.id_allocator.allocate(table_name, count, self.id_field_name)
+
+    def _load_stock_ledger(self) -> StockLedger:
+        """
+        Seeds the ledger with deliveries and per (product, storage) aggregates, in three queries. With
+        'stock_product_partition' only the deliveries and invoices with lines of the partition's products are read.
+        """
+        product_filter = delivery_filter = invoice_filter = ""
+        if self.stock_product_partition is not None:
+            partition, partitions_count = self.stock_product_partition
+            product_filter = f"WHERE ProductID % {partitions_count} == {partition}"
+            delivery_filter = f"""WHERE {self.id_field_name} IN (
+    SELECT {self.delivery_products_line_delivery_id_field_name}
+    FROM {self.delivery_products_line_table_name}
+    WHERE {self.delivery_products_line_product_id_field_name} % {partitions_count} == {partition}
+)"""
+            invoice_filter = f"""WHERE {self.id_field_name} IN (
+    SELECT {self.invoice_products_line_invoice_id_field_name}
+    FROM {self.invoice_products_line_table_name}
+    WHERE {self.invoice_products_line_product_id_field_name} % {partitions_count} == {partition}
+)"""
+        select_delivery_query = f"""SELECT
+    {self.id_field_name} AS ID,
+    {self.delivery_storage_id_field_name} AS StorageID,
+    {self.delivery_delivery_date_time_field_name} AS DeliveryDateTime
+FROM {self.delivery_table_name}
+{delivery_filter}"""
+        delivery_quantity_query = f"""SELECT
+    ProductID,
+    StorageID,
+    count() AS LinesCount,
+    sum(Quantity) AS QuantitySum,
+    min(DeliveryDateTime) AS DeliveryDateTimeMin
 FROM(
-	SELECT 
-	    {self.delivery_products_line_quantity_field_name} AS Quantity, 
-	    {self.delivery_products_line_delivery_id_field_name} AS DeliveryID
-	FROM {self.delivery_products_line_table_name}
-	WHERE {self.delivery_products_line_product_id_field_name}  == {product}
+    SELECT
+        {self.delivery_products_line_product_id_field_name} AS ProductID,
+        {self.delivery_products_line_quantity_field_name} AS Quantity,
+        {self.delivery_products_line_delivery_id_field_name} AS DeliveryID
+    FROM {self.delivery_products_line_table_name}
+    {product_filter}
 ) AS Main
-LEFT JOIN 
+LEFT JOIN
 (
-	SELECT 
-	    {self.id_field_name} AS ID, 
-	    {self.delivery_storage_id_field_name} AS StorageID, 
-	    {self.delivery_delivery_date_time_field_name} AS DeliveryDateTime 
-	FROM {self.delivery_table_name}
+    SELECT
+        {self.id_field_name} AS ID,
+        {self.delivery_storage_id_field_name} AS StorageID,
+        {self.delivery_delivery_date_time_field_name} AS DeliveryDateTime
+    FROM {self.delivery_table_name}
+    {delivery_filter}
 ) AS Delivery
 ON Main.DeliveryID == Delivery.ID
-GROUP BY StorageID;"""
+GROUP BY ProductID, StorageID;"""
 
-        invoice_quantity_sum_by_storage_id_query = f"""SELECT 
-	StorageID, 
-	sum(Quantity) AS QuantitySum 
+        invoice_quantity_query = f"""SELECT
+    ProductID,
+    StorageID,
+    sum(Quantity) AS QuantitySum
 FROM(
-	SELECT 
-	    {self.invoice_products_line_quantity_field_name} AS Quantity, 
-	    {self.invoice_products_line_invoice_id_field_name} AS InvoiceID 
-	FROM {self.invoice_products_line_table_name}
-	WHERE {self.invoice_products_line_product_id_field_name}  == {product}
+    SELECT
+        {self.invoice_products_line_product_id_field_name} AS ProductID,
+        {self.invoice_products_line_quantity_field_name} AS Quantity,
+        {self.invoice_products_line_invoice_id_field_name} AS InvoiceID
+    FROM {self.invoice_products_line_table_name}
+    {product_filter}
 ) AS Main
-LEFT JOIN 
+LEFT JOIN
 (
-	SELECT 
-	    {self.id_field_name} AS ID,
-	    {self.invoice_storage_id_field_name} AS StorageID 
-	FROM {self.invoice_table_name}
+    SELECT
+        {self.id_field_name} AS ID,
+        {self.invoice_storage_id_field_name} AS StorageID
+    FROM {self.invoice_table_name}
+    {invoice_filter}
 ) AS Invoice
 ON Main.InvoiceID == Invoice.ID
-GROUP BY StorageID;"""
-        delivery_quantity = self.client.query_dataframe(query=delivery_quantity_sum_by_storage_id_query)
-        invoice_quantity = self.client.query_dataframe(query=invoice_quantity_sum_by_storage_id_query)
-        if invoice_quantity.empty:
-            max_value = delivery_quantity.sort_values("QuantitySum", ascending=False).iloc[0, :]
-            quantity = self.generate_random_uint_value(min_value=1, max_value=int(max_value["QuantitySum"] * 1.5))
-            if quantity > int(max_value["QuantitySum"]):
-                if self.logger:
-                    self.logger.warning(
-                        f"Попытка сделать заказ большего количества чем есть, отказано. {quantity} > {int(max_value['QuantitySum'])}"
-                    )
-                return
-        else:
-            merged = pd.merge(delivery_quantity, invoice_quantity, on="StorageID", suffixes=("_x", "_y"))
-            merged["QuantityDiff"] = merged["QuantitySum_x"] - merged["QuantitySum_y"]
-            max_value = merged.sort_values("QuantityDiff", ascending=False).iloc[0, :]
-            if int(max_value["QuantityDiff"]) < 0:
-                if self.logger:
-                    self.logger.error("Ошибка оформления заказа")
-                return
-            if int(max_value["QuantityDiff"]) == 1:
-                quantity = 1
-            else:
-                quantity = self.generate_random_uint_value(min_value=1, max_value=int(max_value["QuantityDiff"] * 1.5))
-                if quantity > int(max_value["QuantityDiff"]):
-                    if self.logger:
-                        self.logger.warning(
-                            f"Попытка сделать заказ большего количества чем есть, отказано. {quantity} > {int(max_value['QuantityDiff'])}"
-                        )
-                    return
-        storage_id = int(max_value["StorageID"])
-        min_datetime = pd.to_datetime(max_value["DeliveryDateTimeMin"]).strftime(self.DATETIME_FORMAT)
-        invoice_datetime = self.generate_random_datetime(min_value=min_datetime, time_format=self.DATETIME_FORMAT)
-        invoice = Invoice(ID=new_invoice_id, InvoiceDateTime=invoice_datetime, StorageID=storage_id)
-        invoice_product_line = InvoiceProductsLine(
-            ID=new_id, ProductID=product, Quantity=quantity, InvoiceID=new_invoice_id
+GROUP BY ProductID, StorageID;"""
+        deliveries = self.client.query_dataframe(query=select_delivery_query)
+        delivery_quantity = self.client.query_dataframe(query=delivery_quantity_query)
+        invoice_quantity = self.client.query_dataframe(query=invoice_quantity_query)
+
+        stock_ledger = StockLedger()
+        stock_ledger.add_deliveries(deliveries["ID"], deliveries["StorageID"], deliveries["DeliveryDateTime"])
+        stock_ledger.add_delivered(
+            delivery_quantity["ProductID"],
+            delivery_quantity["StorageID"],
+            delivery_quantity["QuantitySum"],
+            delivery_quantity["DeliveryDateTimeMin"],
+            delivery_quantity["LinesCount"],
+        )
+        stock_ledger.add_invoiced(
+            invoice_quantity["ProductID"], invoice_quantity["StorageID"], invoice_quantity["QuantitySum"]
         )
+        return stock_ledger
 
-        if to_insert:
-            self._insert_record(asdict(invoice), self.invoice_table_name)
-            self._insert_record(asdict(invoice_product_line), self.invoice_products_line_table_name)
+    def _sample_datetimes(
+        self,
+        sampler: Sampler,
+        count: int,
+        min_value: Any = "2022-01-01 00:00:00",
+        max_value: Any = "2022-12-31 00:00:00",
+    ) -> np.ndarray:
+        if self.seasonal_datetimes:
+            return sampler.seasonal_datetimes(min_value, max_value, size=count)
+        return sampler.datetimes(min_value, max_value, size=count)
 
-        return invoice_product_line, invoice
+    @staticmethod
+    def _format_names(prefixes: np.ndarray, numbers: np.ndarray) -> np.ndarray:
+        return np.array([f"{prefix}_{number}" for prefix, number in zip(prefixes, numbers)], dtype=object)
 
-    def execute(self) -> None:
-        for _ in range(self.provider_count):
-            self.generate_provider_row()
-        self.logger.info("Providers successfully inserted.")
-        for _ in range(self.storage_count):
-            self.generate_storage_row()
-        self.logger.info("Storages successfully inserted.")
-        for _ in range(self.delivery_count):
-            self.generate_delivery_row()
-        self.logger.info("Deliveries successfully inserted.")
-        for _ in range(self.product_count):
-            self.generate_product_row()
-        self.logger.info("Products successfully inserted.")
-        for _ in range(self.delivery_products_line_count):
-            self.generate_delivery_product_line_row()
-        self.logger.info("Delivery_product_lines successfully inserted.")
-        for _ in range(self.invoice_product_line_count):
-            self.generate_invoice__invoice_product_line_rows()
-        self.logger.info("Invoices successfully inserted.")
+    def _insert_columns(
+        self, columns: Dict[str, np.ndarray], table_name: str, client: Optional[Client] = None
+    ) -> None:
+        if not len(columns[self.id_field_name]):
+            return
+        blocks = self.layout.get(table_name).arrange(columns) if self.layout is not None else [columns]
+        for block in blocks:
+            if self.sink is not None:
+                self.sink.write(table_name, block)
+            else:
+                client = client if client is not None else self.client
+                client.insert_dataframe(
+                    query=self.insert_query.format(table=table_name),
+                    dataframe=DataFrame(block, copy=False),
+                    settings={"use_numpy": True},
+                )
+        self.fk_cache.add_rows(table_name, columns)
+
+    def insert_batch(self, batch: RecordBatch) -> None:
+        """Inserts a columnar batch (or writes it to the sink), e.g. rows collected with 'RecordBatch.from_rows'."""
+        self._insert_columns(self._cast_columns(batch.table_name, batch.columns), batch.table_name)
+
+    def _cast_columns(self, table_name: str, columns: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """Columns in the exact dtypes of the table schema, so out of range values fail here and not on insert."""
+        schema = self.schemas.get(table_name)
+        return schema.cast(columns) if schema is not None else columns
 
     def _insert_record(self, record: Dict[str, Any], table_name: str) -> None:
+        columns = self._cast_columns(table_name, {name: [value] for name, value in record.items()})
         self.client.insert_dataframe(
             query=self.insert_query.format(table=table_name),
-            dataframe=DataFrame.from_records(data=[record]),
+            dataframe=DataFrame(columns, copy=False),
             settings={"use_numpy": True},
         )
+        self.fk_cache.add_rows(table_name, columns)
@@ -0,0 +1,208 @@
+import gzip
+import io
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+from pandas import DataFrame
+
+from lib.schema import CLICKHOUSE_TYPES, ColumnSpec
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+
+class FileSink:
+    extension = ""
+
+    def __init__(
+        self,
+        path: str,
+        partition_rows: int = 1000000,
+        column_types: Optional[Dict[str, Dict[str, str]]] = None,
+        buffer_size: int = 8 * 1024 * 1024,
+    ):
+        """
+        Writes generated column chunks to per-table files instead of clickhouse.
+
+        Every table gets its own directory under 'path' with files '<table>.<partition>.<extension>',
+        a new partition is started once the current one holds 'partition_rows' rows. Files are written
+        through a buffer of 'buffer_size' bytes. Use it as a context manager or call 'close'.
+
+        :param path: output directory
+        :param partition_rows: maximum quantity of rows per file
+        :param column_types: clickhouse types per table and column, by default derived from column dtypes
+        :param buffer_size: write buffer size in bytes
+        """
+        if partition_rows < 1:
+            raise ValueError("partition_rows must be positive")
+        self.path = path
+        self.partition_rows = partition_rows
+        self.column_types = column_types or {}
+        self.buffer_size = buffer_size
+
+        self.written_rows: Dict[str, int] = {}
+        self._files: Dict[str, Any] = {}
+        self._partitions: Dict[str, int] = {}
+        self._partition_rows: Dict[str, int] = {}
+
+    def __enter__(self) -> "FileSink":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def write(self, table_name: str, columns: Dict[str, np.ndarray]) -> None:
+        """Appends a chunk to the table, splitting it at partition boundaries."""
+        rows = len(next(iter(columns.values()), ()))
+        start = 0
+        while start < rows:
+            if self._partition_rows.get(table_name, self.partition_rows) >= self.partition_rows:
+                self._rotate(table_name)
+            stop = min(rows, start + self.partition_rows - self._partition_rows[table_name])
+            part = {name: column[start:stop] for name, column in columns.items()} if start or stop < rows else columns
+            self._write(self._files[table_name], table_name, part)
+            self._partition_rows[table_name] += stop - start
+            self.written_rows[table_name] = self.written_rows.get(table_name, 0) + stop - start
+            start = stop
+
+    def close(self) -> None:
+        files, self._files = self._files, {}
+        for handle in files.values():
+            self._close(handle)
+
+    def get_column_type(self, table_name: str, column_name: str, column: np.ndarray) -> str:
+        column_type = self.column_types.get(table_name, {}).get(column_name)
+        if column_type is not None:
+            return column_type
+        if column.dtype.kind == "M":
+            return "DateTime"
+        return CLICKHOUSE_TYPES[column.dtype]
+
+    def cast(self, table_name: str, column_name: str, column: np.ndarray) -> np.ndarray:
+        """Column in the exact dtype of its clickhouse type, range checked (see 'ColumnSpec.cast')."""
+        column_type = self.get_column_type(table_name, column_name, column)
+        return ColumnSpec(name=column_name, type=column_type).cast(column, table_name)
+
+    def _rotate(self, table_name: str) -> None:
+        partition = 0
+        if table_name in self._files:
+            self._close(self._files.pop(table_name))
+            partition = self._partitions[table_name] + 1
+        self._partitions[table_name] = partition
+        directory = os.path.join(self.path, table_name)
+        os.makedirs(directory, exist_ok=True)
+        file_path = os.path.join(directory, f"{table_name}.{partition:05d}.{self.extension}")
+        self._files[table_name] = self._open(file_path)
+        self._partition_rows[table_name] = 0
+
+    def _open(self, file_path: str) -> Any:
+        raise NotImplementedError
+
+    def _write(self, handle: Any, table_name: str, columns: Dict[str, np.ndarray]) -> None:
+        raise NotImplementedError
+
+    def _close(self, handle: Any) -> None:
+        handle.close()
+
+
+class CsvFileSink(FileSink):
+    extension = "csv.gz"
+
+    def __init__(self, path: str, *args, compresslevel: int = 1, **kwargs):
+        """
+        Gzip compressed CSV with a header line in every file, loadable with 'FORMAT CSVWithNames'.
+
+        :param compresslevel: gzip compression level
+        """
+        super().__init__(path, *args, **kwargs)
+        self.compresslevel = compresslevel
+
+    def _open(self, file_path: str) -> Any:
+        return io.BufferedWriter(gzip.GzipFile(file_path, "wb", compresslevel=self.compresslevel), self.buffer_size)
+
+    def _write(self, handle: Any, table_name: str, columns: Dict[str, np.ndarray]) -> None:
+        frame = DataFrame({name: self.cast(table_name, name, column) for name, column in columns.items()}, copy=False)
+        handle.write(frame.to_csv(index=False, header=handle.tell() == 0).encode())
+
+
+class NativeFileSink(FileSink):
+    extension = "native.gz"
+
+    def __init__(self, path: str, *args, compresslevel: int = 1, **kwargs):
+        """
+        Gzip compressed clickhouse Native format, one block per chunk, loadable with 'FORMAT Native'.
+
+        :param compresslevel: gzip compression level
+        """
+        super().__init__(path, *args, **kwargs)
+        self.compresslevel = compresslevel
+
+    def _open(self, file_path: str) -> Any:
+        return io.BufferedWriter(gzip.GzipFile(file_path, "wb", compresslevel=self.compresslevel), self.buffer_size)
+
+    def _write(self, handle: Any, table_name: str, columns: Dict[str, np.ndarray]) -> None:
+        rows = len(next(iter(columns.values())))
+        handle.write(_var_uint(len(columns)) + _var_uint(rows))
+        for name, column in columns.items():
+            column_type = self.get_column_type(table_name, name, column)
+            handle.write(_string(name.encode()) + _string(column_type.encode()))
+            column = self.cast(table_name, name, column)
+            if column_type == "String":
+                handle.write(b"".join(_string(str(value).encode()) for value in column))
+            elif column_type == "DateTime":
+                handle.write(column.astype(np.int64).astype("<u4").tobytes())
+            else:
+                handle.write(column.astype(column.dtype.newbyteorder("<"), copy=False).tobytes())
+
+
+class ParquetFileSink(FileSink):
+    extension = "parquet"
+
+    def __init__(self, path: str, *args, compression: str = "zstd", **kwargs):
+        """
+        Parquet files with a row group per chunk, loadable with 'FORMAT Parquet'. Requires 'pyarrow'.
+
+        :param compression: parquet compression codec
+        """
+        if pyarrow is None:
+            raise ImportError("ParquetFileSink requires 'pyarrow', install it with 'pip install pyarrow'")
+        super().__init__(path, *args, **kwargs)
+        self.compression = compression
+
+    def _open(self, file_path: str) -> Any:
+        # the schema is known only with the first chunk, the writer is opened lazily
+        return {"path": file_path, "writer": None}
+
+    def _write(self, handle: Any, table_name: str, columns: Dict[str, np.ndarray]) -> None:
+        table = pyarrow.Table.from_pydict(
+            {name: pyarrow.array(self.cast(table_name, name, column)) for name, column in columns.items()}
+        )
+        if handle["writer"] is None:
+            handle["writer"] = pyarrow.parquet.ParquetWriter(
+                handle["path"], table.schema, compression=self.compression
+            )
+        handle["writer"].write_table(table)
+
+    def _close(self, handle: Any) -> None:
+        if handle["writer"] is not None:
+            handle["writer"].close()
+
+
+FILE_SINKS = {"csv": CsvFileSink, "native": NativeFileSink, "parquet": ParquetFileSink}
+
+
+def _var_uint(value: int) -> bytes:
+    result = bytearray()
+    while value >= 0x80:
+        result.append(value & 0x7F | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def _string(value: bytes) -> bytes:
+    return _var_uint(len(value)) + value
@@ -0,0 +1,108 @@
+import fcntl
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Iterator
+
+import numpy as np
+from clickhouse_driver import Client
+
+
+class IdAllocator:
+    def __init__(
+        self,
+        client: Optional[Client] = None,
+        id_field_name: str = "ID",
+        block_size: int = 10000,
+        reservation_path: Optional[str] = None,
+    ):
+        """
+        Client-side autoincrement for UInt32 ID columns.
+
+        The high-water mark of every table is read with a single 'SELECT max(ID)' on first use, after that
+        IDs are handed out from memory. IDs are reserved in blocks of 'block_size', so several generators
+        sharing one allocator, or several processes sharing one 'reservation_path', get disjoint ranges.
+
+        :param client: clickhouse connection used to read high-water marks, None to start every table from 1
+        :param id_field_name: ID field name for entities
+        :param block_size: minimal quantity of IDs reserved at once
+        :param reservation_path: JSON file with high-water marks shared by processes (guarded by flock)
+        """
+        self.client = client
+        self.id_field_name = id_field_name
+        self.block_size = block_size
+        self.reservation_path = reservation_path
+
+        self.high_water_marks: Dict[str, int] = {}
+        self.free_ranges: Dict[str, List[List[int]]] = {}
+        self._lock = threading.Lock()
+
+    def next_id(self, table_name: str, id_field_name: Optional[str] = None) -> int:
+        return int(self.allocate(table_name, 1, id_field_name)[0])
+
+    def allocate(self, table_name: str, count: int, id_field_name: Optional[str] = None) -> np.ndarray:
+        """Returns 'count' unused IDs in ascending order, reserving new blocks when needed."""
+        blocks = []
+        with self._lock:
+            ranges = self.free_ranges.setdefault(table_name, [])
+            while count > 0:
+                if not ranges:
+                    ranges.append(list(self._reserve(table_name, max(count, self.block_size), id_field_name)))
+                current = ranges[0]
+                stop = min(current[0] + count, current[1])
+                blocks.append(np.arange(current[0], stop, dtype=np.uint32))
+                count -= stop - current[0]
+                current[0] = stop
+                if current[0] == current[1]:
+                    ranges.pop(0)
+        if not blocks:
+            return np.empty(0, dtype=np.uint32)
+        return np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+
+    def reserve(self, table_name: str, count: int, id_field_name: Optional[str] = None) -> Tuple[int, int]:
+        """Reserves 'count' IDs past the high-water mark and returns them as a [start, stop) range."""
+        with self._lock:
+            return self._reserve(table_name, count, id_field_name)
+
+    def add_range(self, table_name: str, start: int, stop: int) -> None:
+        """Hands a pre-assigned [start, stop) range to this allocator, e.g. one reserved by a parent process."""
+        with self._lock:
+            self.free_ranges.setdefault(table_name, []).append([start, stop])
+            self.high_water_marks[table_name] = max(self.high_water_marks.get(table_name, 0), stop - 1)
+
+    def load_high_water_mark(self, table_name: str, id_field_name: Optional[str] = None) -> int:
+        if self.client is None:
+            return 0
+        query = f"SELECT max({id_field_name or self.id_field_name}) FROM {table_name}"
+        current_max_id = self.client.execute(query=query)[0][0]
+        return current_max_id or 0
+
+    def _reserve(self, table_name: str, count: int, id_field_name: Optional[str] = None) -> Tuple[int, int]:
+        if table_name not in self.high_water_marks:
+            self.high_water_marks[table_name] = self.load_high_water_mark(table_name, id_field_name)
+        if self.reservation_path is None:
+            start = self.high_water_marks[table_name] + 1
+        else:
+            with self._locked_reservations() as reservations:
+                start = max(reservations.get(table_name, 0), self.high_water_marks[table_name]) + 1
+                reservations[table_name] = start + count - 1
+        self.high_water_marks[table_name] = start + count - 1
+        return start, start + count
+
+    @contextmanager
+    def _locked_reservations(self) -> Iterator[Dict[str, int]]:
+        with open(self.reservation_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                content = f.read()
+                reservations = json.loads(content) if content else {}
+                yield reservations
+                f.seek(0)
+                f.truncate()
+                json.dump(reservations, f)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,141 @@
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+from lib.samplers import Sampler
+
+
+class _CacheEntry:
+    def __init__(self, values: np.ndarray, server_rows: Optional[int]):
+        self.values = values
+        self.size = len(values)
+        self.is_sorted = True
+        self.server_rows = server_rows
+        self.loaded_at = time.monotonic()
+        self.is_stale = False
+
+    def append(self, values: np.ndarray) -> None:
+        if not len(values):
+            return
+        if self.size + len(values) > len(self.values):
+            # amortized growth, appending a row at a time must not copy the whole column
+            buffer = np.empty(max(self.size + len(values), 2 * len(self.values), 1024), dtype=self.values.dtype)
+            buffer[: self.size] = self.values[: self.size]
+            self.values = buffer
+        if self.is_sorted and (
+            (self.size and values[0] < self.values[self.size - 1]) or np.any(values[1:] < values[:-1])
+        ):
+            self.is_sorted = False
+        self.values[self.size : self.size + len(values)] = values
+        self.size += len(values)
+        if self.server_rows is not None:
+            self.server_rows += len(values)
+
+    def view(self) -> np.ndarray:
+        if not self.is_sorted:
+            self.values[: self.size].sort(kind="stable")
+            self.is_sorted = True
+        return self.values[: self.size]
+
+
+class ForeignKeyCache:
+    def __init__(
+        self,
+        client: Any = None,
+        ttl: Optional[float] = None,
+        select_query: str = "SELECT {id_field_name} FROM {table}",
+        count_query: str = "SELECT count() FROM {table}",
+    ):
+        """
+        Values of referenced columns (IDs of parent tables) kept in memory as sorted NumPy arrays.
+
+        A column is read from clickhouse on first use and then updated in place with 'add_rows' by the
+        generator that inserts into its table. Once 'ttl' seconds passed since the last check, a cheap
+        'count_query' compares the table's row count with the cached one (the version), the column is
+        reloaded only if they differ, e.g. after another writer inserted. 'invalidate' forces a reload.
+        Without a client nothing is loaded, tracked columns hold only the values added by the generator.
+
+        :param client: clickhouse connection or hook, None to work without a server
+        :param ttl: seconds between version checks, None to trust the cache forever
+        :param select_query: query to select a column, formatted with 'id_field_name' and 'table'
+        :param count_query: query to count rows of a table, formatted with 'table'
+        """
+        self.client = client
+        self.ttl = ttl
+        self.select_query = select_query
+        self.count_query = count_query
+        self.entries: Dict[Tuple[str, str], _CacheEntry] = {}
+        self.tracked: Dict[str, set] = {}
+        self._lock = threading.Lock()
+
+    def track(self, table_name: str, field_name: str = "ID") -> None:
+        """Declares a referenced column, without a client its values are collected from 'add_rows' from now on."""
+        with self._lock:
+            self.tracked.setdefault(table_name, set()).add(field_name)
+            if self.client is None:
+                self.entries.setdefault((table_name, field_name), _CacheEntry(np.empty(0, dtype=np.uint32), None))
+
+    def get(self, table_name: str, field_name: str = "ID") -> np.ndarray:
+        """Sorted values of the column, the array must not be modified and is valid until the next 'add_rows'."""
+        with self._lock:
+            entry = self.entries.get((table_name, field_name))
+            if entry is None or self._is_outdated(entry, table_name):
+                entry = self.entries[table_name, field_name] = self._load(table_name, field_name)
+            return entry.view()
+
+    def sample(
+        self, table_name: str, size: int, sampler: Sampler, field_name: str = "ID"
+    ) -> np.ndarray:
+        """'size' values of the column drawn uniformly with replacement, a value repeated in the column is likelier."""
+        values = self.get(table_name, field_name)
+        if not len(values):
+            raise ValueError(f"No {field_name} values in {table_name} to reference")
+        return sampler.choice(values, size=size)
+
+    def add_rows(self, table_name: str, columns: Dict[str, Any]) -> None:
+        """Appends inserted rows to the cached columns of the table, columns not loaded yet are skipped."""
+        with self._lock:
+            for field_name in self.tracked.get(table_name, ()):
+                entry = self.entries.get((table_name, field_name))
+                if entry is not None and field_name in columns:
+                    entry.append(np.asarray(columns[field_name]))
+
+    def set(self, table_name: str, values: np.ndarray, field_name: str = "ID") -> None:
+        """Installs the known values of the column, e.g. restored from a checkpoint, instead of reading them."""
+        values = np.sort(np.asarray(values), kind="stable")
+        with self._lock:
+            self.entries[table_name, field_name] = _CacheEntry(values, len(values) if self.client is not None else None)
+
+    def loaded(self) -> Dict[Tuple[str, str], np.ndarray]:
+        """Copies of all columns held in memory, by (table, field)."""
+        with self._lock:
+            return {key: entry.view().copy() for key, entry in self.entries.items()}
+
+    def invalidate(self, table_name: Optional[str] = None) -> None:
+        """Makes the next 'get' reload the table's columns (all tables if None)."""
+        if self.client is None:
+            return
+        with self._lock:
+            for (entry_table_name, _), entry in self.entries.items():
+                if table_name is None or entry_table_name == table_name:
+                    entry.is_stale = True
+
+    def _is_outdated(self, entry: _CacheEntry, table_name: str) -> bool:
+        if self.client is None:
+            return False
+        if entry.is_stale:
+            return True
+        if self.ttl is None or time.monotonic() - entry.loaded_at < self.ttl:
+            return False
+        entry.loaded_at = time.monotonic()
+        return self.client.execute(query=self.count_query.format(table=table_name))[0][0] != entry.server_rows
+
+    def _load(self, table_name: str, field_name: str) -> _CacheEntry:
+        if self.client is None:
+            return _CacheEntry(np.empty(0, dtype=np.uint32), None)
+        query = self.select_query.format(id_field_name=field_name, table=table_name)
+        # NumPy mode reads the column as one array instead of a Python int per row
+        values = self.client.query_dataframe(query, settings={"use_numpy": True})[field_name].to_numpy()
+        return _CacheEntry(np.sort(values, kind="stable"), len(values))
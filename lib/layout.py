@@ -0,0 +1,134 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from lib.schema import TableSchema
+
+
+@dataclass(frozen=True)
+class MonthPartition:
+    """Partition per month of a DateTime column."""
+
+    column: str
+
+    @property
+    def expression(self) -> str:
+        return f"toYYYYMM({self.column})"
+
+    def keys(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.asarray(columns[self.column], dtype="datetime64[s]").astype("datetime64[M]").astype(np.int64)
+
+
+@dataclass(frozen=True)
+class ModuloPartition:
+    """'partitions' partitions by remainder of an integer column, e.g. of 'ProductID'."""
+
+    column: str
+    partitions: int
+
+    @property
+    def expression(self) -> str:
+        return f"{self.column} % {self.partitions}"
+
+    def keys(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        return np.asarray(columns[self.column]).astype(np.int64) % self.partitions
+
+
+@dataclass(frozen=True)
+class TableLayout:
+    order_by: Tuple[str, ...] = ("ID",)
+    partition_by: Optional[object] = None
+    # (name, query) pairs, e.g. ("by_delivery", "SELECT * ORDER BY DeliveryID")
+    projections: Tuple[Tuple[str, str], ...] = ()
+    index_granularity: int = 8192
+
+    def arrange(self, columns: Dict[str, np.ndarray]) -> List[Dict[str, np.ndarray]]:
+        """
+        Splits a chunk into one block per partition, each sorted by 'order_by', in partition order.
+        Such a block becomes exactly one part, already in sorting key order, when inserted.
+        """
+        keys = [_sort_key(columns[name]) for name in reversed(self.order_by)]
+        partitions = self.partition_by.keys(columns) if self.partition_by is not None else None
+        if partitions is not None:
+            keys.append(partitions)
+        order = np.lexsort(keys)
+        if partitions is None:
+            return [{name: column[order] for name, column in columns.items()}]
+        partitions = partitions[order]
+        bounds = np.concatenate(([0], np.flatnonzero(partitions[1:] != partitions[:-1]) + 1, [len(order)]))
+        return [
+            {name: column[order[start:stop]] for name, column in columns.items()}
+            for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist())
+        ]
+
+    def render(self, schema: TableSchema) -> str:
+        """'CREATE TABLE' query of the table with this layout."""
+        definitions = [f"    `{column.name}` {column.type}" for column in schema.columns]
+        definitions += [f"    PROJECTION {name} ({query})" for name, query in self.projections]
+        clauses = ["ENGINE = MergeTree"]
+        if self.partition_by is not None:
+            clauses.append(f"PARTITION BY {self.partition_by.expression}")
+        order_by = self.order_by[0] if len(self.order_by) == 1 else f"({', '.join(self.order_by)})"
+        clauses.append(f"ORDER BY {order_by}")
+        clauses.append(f"SETTINGS index_granularity = {self.index_granularity}")
+        body = ",\n".join(definitions)
+        return f"CREATE TABLE IF NOT EXISTS {schema.name}\n(\n{body}\n)\n" + "\n".join(clauses) + ";"
+
+
+@dataclass(frozen=True)
+class LayoutProfile:
+    name: str
+    tables: Dict[str, TableLayout] = field(default_factory=dict)
+
+    def get(self, table_name: str) -> TableLayout:
+        return self.tables.get(table_name, TableLayout())
+
+    def render(self, schemas: Dict[str, TableSchema]) -> Dict[str, str]:
+        """'CREATE TABLE' queries of all tables, keyed by table name."""
+        return {table_name: self.get(table_name).render(schema) for table_name, schema in schemas.items()}
+
+
+LAYOUT_PROFILES = {
+    # the DDL of queries/*.sql
+    "default": LayoutProfile("default"),
+    # monthly partitions of deliveries and invoices, lines sorted by product as the stock queries filter by it
+    "product_time": LayoutProfile(
+        "product_time",
+        {
+            "shop.delivery": TableLayout(
+                order_by=("StorageID", "DeliveryDateTime", "ID"), partition_by=MonthPartition("DeliveryDateTime")
+            ),
+            "shop.delivery_products_line": TableLayout(order_by=("ProductID", "DeliveryID", "ID")),
+            "shop.invoice": TableLayout(
+                order_by=("StorageID", "InvoiceDateTime", "ID"), partition_by=MonthPartition("InvoiceDateTime")
+            ),
+            "shop.invoice_products_line": TableLayout(order_by=("ProductID", "InvoiceID", "ID")),
+        },
+    ),
+}
+# same as "product_time", plus projections sorted by the join keys of the line tables
+LAYOUT_PROFILES["product_time_projections"] = LayoutProfile(
+    "product_time_projections",
+    dict(
+        LAYOUT_PROFILES["product_time"].tables,
+        **{
+            "shop.delivery_products_line": TableLayout(
+                order_by=("ProductID", "DeliveryID", "ID"),
+                projections=(("by_delivery", "SELECT * ORDER BY DeliveryID"),),
+            ),
+            "shop.invoice_products_line": TableLayout(
+                order_by=("ProductID", "InvoiceID", "ID"),
+                projections=(("by_invoice", "SELECT * ORDER BY InvoiceID"),),
+            ),
+        },
+    ),
+)
+
+
+def _sort_key(column: np.ndarray) -> np.ndarray:
+    # lexsort needs comparable arrays, strings are sorted by their rank
+    column = np.asarray(column)
+    if column.dtype.kind == "O":
+        return np.unique(column.astype(str), return_inverse=True)[1]
+    return column
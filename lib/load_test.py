@@ -0,0 +1,345 @@
+import asyncio
+import logging
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from lib.async_generator import AsyncClickhouseNativeHook
+from lib.clickhouse_hook import ClickhouseNativeHook
+from lib.samplers import Sampler
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+@dataclass(frozen=True)
+class ParameterSpace:
+    """Values the query parameters are drawn from: ID ranges of the tables and the time span of the data."""
+
+    id_ranges: Dict[str, Tuple[int, int]]
+    min_datetime: np.datetime64
+    max_datetime: np.datetime64
+
+    @classmethod
+    def load(cls, hook: ClickhouseNativeHook, database: str = "shop") -> "ParameterSpace":
+        """Reads the ID range of every table and the delivery time span, the generator allocates IDs densely."""
+        id_ranges = {}
+        for table in ("provider", "storage", "product", "delivery", "invoice"):
+            min_id, max_id = hook.execute(f"SELECT min(ID), max(ID) FROM {database}.{table}", log_query=False)[0]
+            id_ranges[table] = (int(min_id), int(max_id))
+        min_datetime, max_datetime = hook.execute(
+            f"SELECT min(DeliveryDateTime), max(DeliveryDateTime) FROM {database}.delivery", log_query=False
+        )[0]
+        return cls(id_ranges, np.datetime64(min_datetime, "s"), np.datetime64(max_datetime, "s"))
+
+    def sample_id(self, sampler: Sampler, table: str, zipf_exponent: Optional[float] = None) -> int:
+        """Uniform ID of 'table', or skewed to the lowest IDs with 'zipf_exponent' (hot rows)."""
+        min_id, max_id = self.id_ranges[table]
+        if zipf_exponent is not None:
+            return min_id + int(sampler.zipf_indices(max_id - min_id + 1, size=1, exponent=zipf_exponent)[0])
+        return int(sampler.integers(min_id, max_id + 1, size=1)[0])
+
+    def sample_month(self, sampler: Sampler) -> Tuple[datetime, datetime]:
+        """[start, end) of a calendar month within the data's time span."""
+        start = sampler.datetimes(self.min_datetime, self.max_datetime + np.timedelta64(1, "s"), size=1)[0]
+        month = start.astype("datetime64[M]")
+        return _to_datetime(month), _to_datetime(month + np.timedelta64(1, "M"))
+
+
+@dataclass(frozen=True)
+class QueryTemplate:
+    """A query of the workload mix, 'params' draws its '%(name)s' parameters (substituted by the driver)."""
+
+    name: str
+    query: str
+    weight: float = 1.0
+    params: Optional[Callable[[Sampler, ParameterSpace], Dict[str, Any]]] = None
+
+
+SHOP_QUERIES = [
+    QueryTemplate(
+        name="product_card",
+        query="SELECT ID, Name, Code FROM shop.product WHERE ID = %(product_id)s",
+        weight=10,
+        params=lambda sampler, space: {"product_id": space.sample_id(sampler, "product", zipf_exponent=1.1)},
+    ),
+    QueryTemplate(
+        name="stock_per_storage",
+        query="""SELECT
+    Delivered.ProductID AS ProductID,
+    toInt64(Delivered.Quantity) - toInt64(Invoiced.Quantity) AS Stock
+FROM
+(
+    SELECT l.ProductID AS ProductID, sum(l.Quantity) AS Quantity
+    FROM shop.delivery_products_line AS l
+    INNER JOIN shop.delivery AS d ON l.DeliveryID = d.ID
+    WHERE d.StorageID = %(storage_id)s
+    GROUP BY ProductID
+) AS Delivered
+LEFT JOIN
+(
+    SELECT l.ProductID AS ProductID, sum(l.Quantity) AS Quantity
+    FROM shop.invoice_products_line AS l
+    INNER JOIN shop.invoice AS i ON l.InvoiceID = i.ID
+    WHERE i.StorageID = %(storage_id)s
+    GROUP BY ProductID
+) AS Invoiced
+ON Delivered.ProductID = Invoiced.ProductID
+ORDER BY ProductID""",
+        weight=3,
+        params=lambda sampler, space: {"storage_id": space.sample_id(sampler, "storage")},
+    ),
+    QueryTemplate(
+        name="deliveries_per_provider_month",
+        query="""SELECT toStartOfMonth(DeliveryDateTime) AS Month, count() AS Deliveries
+FROM shop.delivery
+WHERE ProviderID = %(provider_id)s
+GROUP BY Month
+ORDER BY Month""",
+        weight=3,
+        params=lambda sampler, space: {"provider_id": space.sample_id(sampler, "provider")},
+    ),
+    QueryTemplate(
+        name="top_products",
+        query="""SELECT l.ProductID AS ProductID, sum(l.Quantity) AS Sold, count() AS Lines
+FROM shop.invoice_products_line AS l
+INNER JOIN shop.invoice AS i ON l.InvoiceID = i.ID
+WHERE i.InvoiceDateTime >= %(start)s AND i.InvoiceDateTime < %(end)s
+GROUP BY ProductID
+ORDER BY Sold DESC, ProductID
+LIMIT 10""",
+        weight=2,
+        params=lambda sampler, space: dict(zip(("start", "end"), space.sample_month(sampler))),
+    ),
+    QueryTemplate(
+        name="storage_sales_per_month",
+        query="""SELECT toYYYYMM(i.InvoiceDateTime) AS Month, count() AS Lines, sum(l.Quantity) AS Sold
+FROM shop.invoice_products_line AS l
+INNER JOIN shop.invoice AS i ON l.InvoiceID = i.ID
+WHERE i.StorageID = %(storage_id)s
+GROUP BY Month
+ORDER BY Month""",
+        weight=1,
+        params=lambda sampler, space: {"storage_id": space.sample_id(sampler, "storage")},
+    ),
+]
+
+
+class QueryStats:
+    def __init__(self, name: str):
+        """Latencies (from the scheduled start, queueing included), service times and errors of one query."""
+        self.name = name
+        self.latencies: List[float] = []
+        self.service_times: List[float] = []
+        self.rows = 0
+        self.errors: Counter = Counter()
+
+    @property
+    def requests(self) -> int:
+        return len(self.latencies) + sum(self.errors.values())
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors.values()) / self.requests if self.requests else 0.0
+
+    def add(self, other: "QueryStats") -> None:
+        self.latencies += other.latencies
+        self.service_times += other.service_times
+        self.rows += other.rows
+        self.errors.update(other.errors)
+
+    def to_dict(self, seconds: float) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "qps": self.requests / seconds if seconds else 0.0,
+            "rows": self.rows,
+            "errors": sum(self.errors.values()),
+            "error_rate": self.error_rate,
+            "error_kinds": dict(self.errors),
+            "latency": _summarize(self.latencies),
+            "service_time": _summarize(self.service_times),
+        }
+
+
+@dataclass
+class LoadTestReport:
+    target_qps: float
+    seconds: float
+    # the latest a request was sent after its scheduled time, large values mean the client can't keep up
+    max_schedule_lag: float
+    queries: Dict[str, QueryStats]
+
+    @property
+    def total(self) -> QueryStats:
+        total = QueryStats("total")
+        for stats in self.queries.values():
+            total.add(stats)
+        return total
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "target_qps": self.target_qps,
+            "seconds": self.seconds,
+            "max_schedule_lag": self.max_schedule_lag,
+            "total": self.total.to_dict(self.seconds),
+            "queries": {name: stats.to_dict(self.seconds) for name, stats in self.queries.items()},
+        }
+
+
+class LoadTest:
+    def __init__(
+        self,
+        hook: ClickhouseNativeHook,
+        queries: Sequence[QueryTemplate] = tuple(SHOP_QUERIES),
+        qps: float = 10.0,
+        duration: float = 60.0,
+        concurrency: int = 8,
+        arrivals: str = "poisson",
+        timeout: Optional[float] = None,
+        seed: Any = None,
+        parameter_space: Optional[ParameterSpace] = None,
+        logger: Any = None,
+    ):
+        """
+        Open-loop read workload: requests are sent on a fixed schedule of 'qps' per second for 'duration'
+        seconds, whether or not earlier ones have finished, with each request picking a query of the mix by
+        weight and drawing its parameters. Up to 'concurrency' requests run at once on the hook's
+        connections, the others wait for a free slot. Latency is measured from the scheduled start, so a
+        saturated server shows up as growing latency instead of a silently lower request rate.
+
+        Works with any 'ClickhouseNativeHook', including a 'StandInHook' holding generated data.
+
+        :param hook: hook to query, its 'pool_size' should be at least 'concurrency'
+        :param queries: the query mix
+        :param qps: target requests per second
+        :param duration: seconds of sending requests, the last ones are awaited after it
+        :param concurrency: maximum quantity of requests running at once
+        :param arrivals: "poisson" for exponential gaps between requests, "uniform" for equal gaps
+        :param timeout: seconds after which a request counts as a 'TimeoutError', None to wait forever
+        :param seed: seed of the schedule, the query choice and the parameters
+        :param parameter_space: parameter values, read from the tables with 'ParameterSpace.load' if None
+        """
+        if qps <= 0 or duration <= 0 or concurrency < 1:
+            raise ValueError("qps, duration and concurrency must be positive")
+        if arrivals not in ("poisson", "uniform"):
+            raise ValueError(f"arrivals must be 'poisson' or 'uniform', got {arrivals!r}")
+        if not queries or any(query.weight < 0 for query in queries) or not sum(query.weight for query in queries):
+            raise ValueError("queries need non-negative weights with a positive sum")
+        self.hook = hook
+        self.queries = list(queries)
+        self.qps = qps
+        self.duration = duration
+        self.concurrency = concurrency
+        self.arrivals = arrivals
+        self.timeout = timeout
+        self.sampler = Sampler(seed)
+        self.parameter_space = parameter_space
+        self.logger = logger if logger is not None else logging.getLogger()
+
+    def run(self) -> LoadTestReport:
+        """Blocking entry point."""
+        return asyncio.run(self.run_async())
+
+    async def run_async(self) -> LoadTestReport:
+        if self.parameter_space is None:
+            self.parameter_space = ParameterSpace.load(self.hook)
+        offsets, choices = self._schedule()
+        stats = {query.name: QueryStats(query.name) for query in self.queries}
+        async_hook = AsyncClickhouseNativeHook(self.hook, max_workers=self.concurrency)
+        slots = asyncio.Semaphore(self.concurrency)
+        loop = asyncio.get_running_loop()
+        pending = set()
+        max_schedule_lag = 0.0
+        started = loop.time()
+        try:
+            for offset, choice in zip(offsets, choices):
+                scheduled = started + offset
+                delay = scheduled - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                max_schedule_lag = max(max_schedule_lag, loop.time() - scheduled)
+                query = self.queries[choice]
+                params = query.params(self.sampler, self.parameter_space) if query.params is not None else None
+                task = asyncio.create_task(self._request(async_hook, query, params, scheduled, slots, stats))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            await asyncio.gather(*pending)
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            # requests abandoned after 'timeout' still hold executor threads, they are not waited for
+            async_hook.close(wait=False)
+        report = LoadTestReport(self.qps, loop.time() - started, max_schedule_lag, stats)
+        self._log(report)
+        return report
+
+    def _schedule(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Send offsets in seconds from the start and the chosen query of every request."""
+        count = max(int(self.qps * self.duration), 1)
+        if self.arrivals == "poisson":
+            offsets = np.cumsum(self.sampler.rng.exponential(1 / self.qps, size=count))
+            offsets = offsets[offsets < self.duration]
+        else:
+            offsets = np.arange(count) / self.qps
+        weights = np.array([query.weight for query in self.queries], dtype=np.float64)
+        choices = self.sampler.choice(len(self.queries), size=len(offsets), p=weights / weights.sum())
+        return offsets, choices
+
+    async def _request(
+        self,
+        async_hook: AsyncClickhouseNativeHook,
+        query: QueryTemplate,
+        params: Optional[Dict[str, Any]],
+        scheduled: float,
+        slots: asyncio.Semaphore,
+        stats: Dict[str, QueryStats],
+    ) -> None:
+        loop = asyncio.get_running_loop()
+        query_stats = stats[query.name]
+        async with slots:
+            started = loop.time()
+            try:
+                request = async_hook.execute(query.query, params=params, log_query=False)
+                rows = await (asyncio.wait_for(request, self.timeout) if self.timeout is not None else request)
+            except asyncio.TimeoutError:
+                query_stats.errors["TimeoutError"] += 1
+                return
+            except Exception as e:
+                code = getattr(e, "code", None)
+                query_stats.errors[type(e).__name__ if code is None else f"{type(e).__name__} {code}"] += 1
+                return
+        finished = loop.time()
+        query_stats.latencies.append(finished - scheduled)
+        query_stats.service_times.append(finished - started)
+        query_stats.rows += len(rows)
+
+    def _log(self, report: LoadTestReport) -> None:
+        for name, stats in list(report.queries.items()) + [("total", report.total)]:
+            summary = stats.to_dict(report.seconds)
+            latency = summary["latency"]
+            self.logger.info(
+                f"{name}: {summary['requests']} requests, {summary['qps']:.1f} qps, "
+                f"{summary['error_rate']:.2%} errors, latency p50 {latency['p50']:.4f}s p95 {latency['p95']:.4f}s "
+                f"p99 {latency['p99']:.4f}s max {latency['max']:.4f}s"
+            )
+            if stats.errors:
+                self.logger.warning(f"Ошибки запроса {name}: {dict(stats.errors)}")
+        if report.max_schedule_lag > 0.1:
+            self.logger.warning(
+                f"Запросы отправлялись с опозданием до {report.max_schedule_lag:.2f} с, целевой QPS не достигнут"
+            )
+
+
+def _summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return dict({f"p{percentile}": 0.0 for percentile in PERCENTILES}, mean=0.0, max=0.0)
+    array = np.asarray(values)
+    summary = {f"p{percentile}": float(np.percentile(array, percentile)) for percentile in PERCENTILES}
+    return dict(summary, mean=float(array.mean()), max=float(array.max()))
+
+
+def _to_datetime(value: np.datetime64) -> datetime:
+    return value.astype("datetime64[s]").astype(datetime)
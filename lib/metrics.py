@@ -0,0 +1,257 @@
+import json
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# seconds, upper bounds of latency histogram buckets
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+OTHER_TEMPLATE = "<other>"
+
+_STRING_LITERAL = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def query_template(query: str) -> str:
+    """Query with literals replaced by '?' and whitespace collapsed, to group queries differing only by values."""
+    template = _STRING_LITERAL.sub("?", query)
+    template = _NUMBER_LITERAL.sub("?", template)
+    template = _IN_LIST.sub("(?)", template)
+    return _WHITESPACE.sub(" ", template).strip().rstrip(";")
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """Per bucket counts, 'counts[i]' holds observations in (buckets[i - 1], buckets[i]], the last one overflows."""
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the 'q' quantile, 'inf' for the overflow bucket."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "buckets": list(self.buckets),
+            "counts": self.counts,
+            "sum": self.sum,
+            "count": self.count,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+        }
+
+
+class OperationStats:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.latency = Histogram(buckets)
+        self.errors = 0
+        self.rows = 0
+        self.bytes = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"latency": self.latency.to_dict(), "errors": self.errors, "rows": self.rows, "bytes": self.bytes}
+
+
+class Metrics:
+    def __init__(self, max_templates: int = 1000, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Thread-safe registry of clickhouse calls and generator stage timings.
+
+        Calls are grouped by (operation, query template), see 'query_template'. Past 'max_templates' distinct
+        templates new ones are counted under '<other>', so ad hoc queries can't grow the registry unbounded.
+
+        :param max_templates: maximum quantity of distinct query templates
+        :param buckets: upper bounds of latency histogram buckets, in seconds
+        """
+        self.max_templates = max_templates
+        self.buckets = buckets
+        self.operations: Dict[Tuple[str, str], OperationStats] = {}
+        self.stages: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(
+        self, operation: str, query: str, seconds: float, rows: int = 0, nbytes: int = 0, error: bool = False
+    ) -> None:
+        template = query_template(query)
+        with self._lock:
+            stats = self.operations.get((operation, template))
+            if stats is None:
+                if len(self.operations) >= self.max_templates:
+                    template = OTHER_TEMPLATE
+                stats = self.operations.setdefault((operation, template), OperationStats(self.buckets))
+            stats.latency.observe(seconds)
+            stats.rows += rows
+            stats.bytes += nbytes
+            stats.errors += error
+
+    @contextmanager
+    def stage(self, stage_name: str) -> Iterator[None]:
+        """Adds the time spent in the block to the stage."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                stage = self.stages.setdefault(stage_name, [0, 0.0])
+                stage[0] += 1
+                stage[1] += seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "operations": [
+                    dict(operation=operation, template=template, **stats.to_dict())
+                    for (operation, template), stats in self.operations.items()
+                ],
+                "stages": {name: {"runs": runs, "seconds": seconds} for name, (runs, seconds) in self.stages.items()},
+            }
+
+
+class InstrumentedClient:
+    def __init__(self, client: Any, metrics: Metrics):
+        """Proxy for a clickhouse 'Client' recording every execute, query_dataframe and insert_dataframe call."""
+        self.client = client
+        self.metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.client, name)
+
+    def execute(self, query: str, *args, **kwargs) -> Any:
+        return record_call(
+            self.metrics, "execute", query, self.client, None, self.client.execute, query, *args, **kwargs
+        )
+
+    def query_dataframe(self, query: str, *args, **kwargs) -> Any:
+        func = self.client.query_dataframe
+        return record_call(self.metrics, "query_dataframe", query, self.client, None, func, query, *args, **kwargs)
+
+    def insert_dataframe(self, query: str, dataframe: Any, *args, **kwargs) -> Any:
+        return record_call(
+            self.metrics,
+            "insert_dataframe",
+            query,
+            self.client,
+            dataframe,
+            self.client.insert_dataframe,
+            query,
+            dataframe,
+            *args,
+            **kwargs,
+        )
+
+
+def record_call(
+    metrics: Metrics,
+    operation: str,
+    query: str,
+    client: Any,
+    dataframe: Any,
+    func: Callable[..., Any],
+    *args,
+    **kwargs,
+) -> Any:
+    """Calls 'func' and records it, the size is taken from 'dataframe' for inserts and from the result otherwise."""
+    started = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    except BaseException:
+        metrics.record(operation, query, time.perf_counter() - started, error=True)
+        raise
+    size = result_size(client, dataframe if dataframe is not None else result)
+    metrics.record(operation, query, time.perf_counter() - started, *size)
+    return result
+
+
+def result_size(client: Any, result: Any) -> Tuple[int, int]:
+    """Rows and bytes of a call result: a DataFrame's own size, otherwise the rows and bytes the server reported."""
+    if hasattr(result, "memory_usage"):
+        return len(result), int(result.memory_usage(index=False).sum())
+    progress = getattr(getattr(client, "last_query", None), "progress", None)
+    nbytes = progress.bytes + progress.written_bytes if progress is not None else 0
+    return (len(result) if isinstance(result, list) else 0), nbytes
+
+
+class JsonExporter:
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, metrics: Metrics) -> None:
+        _write_atomic(self.path, json.dumps(metrics.to_dict(), indent=2))
+
+
+class PrometheusTextExporter:
+    def __init__(self, path: str, prefix: str = "shop_generator"):
+        """Writes metrics in Prometheus text format, for the node_exporter textfile collector."""
+        self.path = path
+        self.prefix = prefix
+
+    def export(self, metrics: Metrics) -> None:
+        _write_atomic(self.path, self.render(metrics))
+
+    def render(self, metrics: Metrics) -> str:
+        data = metrics.to_dict()
+        name = f"{self.prefix}_clickhouse_call_duration_seconds"
+        lines = [f"# HELP {name} Latency of clickhouse calls.", f"# TYPE {name} histogram"]
+        counters = {"rows": [], "bytes": [], "errors": []}
+        for operation in data["operations"]:
+            labels = f'operation="{_escape(operation["operation"])}",template="{_escape(operation["template"])}"'
+            latency, cumulative = operation["latency"], 0
+            for bound, count in zip(latency["buckets"] + ["+Inf"], latency["counts"]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {latency['sum']}")
+            lines.append(f"{name}_count{{{labels}}} {latency['count']}")
+            for counter, values in counters.items():
+                values.append(f"{self.prefix}_clickhouse_{counter}_total{{{labels}}} {operation[counter]}")
+        for counter, values in counters.items():
+            lines += [f"# TYPE {self.prefix}_clickhouse_{counter}_total counter"] + values
+        lines.append(f"# TYPE {self.prefix}_stage_duration_seconds_total counter")
+        lines += [
+            f'{self.prefix}_stage_duration_seconds_total{{stage="{_escape(stage)}"}} {values["seconds"]}'
+            for stage, values in data["stages"].items()
+        ]
+        lines.append(f"# TYPE {self.prefix}_stage_runs_total counter")
+        lines += [
+            f'{self.prefix}_stage_runs_total{{stage="{_escape(stage)}"}} {values["runs"]}'
+            for stage, values in data["stages"].items()
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _write_atomic(path: str, content: str) -> None:
+    # scrapers must never see a half written file
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as f:
+        f.write(content)
+    os.replace(temporary_path, path)
+
+
+def maybe_stage(metrics: Optional[Metrics], stage_name: str) -> Any:
+    """'metrics.stage' when instrumentation is enabled, a no-op context otherwise."""
+    return metrics.stage(stage_name) if metrics is not None else nullcontext()
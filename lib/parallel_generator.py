@@ -0,0 +1,227 @@
+import copy
+import logging
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from lib.clickhouse_hook import ClickhouseNativeHook
+from lib.data_generator import ShopDataGenerator
+from lib.id_allocator import IdAllocator
+from lib.unique_values import UniqueValueAllocator
+
+
+@dataclass
+class ShardTask:
+    table_name: str
+    key: Tuple[int, ...]
+    count: int
+    id_ranges: Dict[str, Tuple[int, int]]
+    unique_allocators: Dict[Tuple[str, str], UniqueValueAllocator] = field(default_factory=dict)
+    product_partition: Optional[Tuple[int, int]] = None
+
+
+_worker_generator: Optional[ShopDataGenerator] = None
+
+
+def _init_worker(hook: ClickhouseNativeHook, generator_kwargs: Dict[str, Any]) -> None:
+    global _worker_generator
+    _worker_generator = ShopDataGenerator(clickhouse_connection=hook.get_connection(), **generator_kwargs)
+
+
+def _run_shard(task: ShardTask) -> int:
+    """Generates and inserts one shard in a worker process, returns the quantity of inserted rows."""
+    generator = _worker_generator
+    generator.id_allocator = IdAllocator()
+    for table_name, (start, stop) in task.id_ranges.items():
+        generator.id_allocator.add_range(table_name, start, stop)
+    generator.unique_allocators.update(task.unique_allocators)
+
+    if task.product_partition is not None:
+        generator.stock_product_partition = task.product_partition
+        generator.stock_ledger = None
+        inserted = 0
+        for size, number in _split(task.count, generator.chunk_size):
+            inserted += generator.insert_invoice_chunk(size, generator.sampler.substream(*task.key, number))
+        return inserted
+
+    generate_columns = {
+        generator.provider_table_name: generator.generate_provider_columns,
+        generator.storage_table_name: generator.generate_storage_columns,
+        generator.product_table_name: generator.generate_product_columns,
+        generator.delivery_table_name: generator.generate_delivery_columns,
+        generator.delivery_products_line_table_name: generator.generate_delivery_product_line_columns,
+    }[task.table_name]
+    columns = generate_columns(task.count, generator.sampler.substream(*task.key))
+    generator._insert_columns(columns, task.table_name)
+    return task.count
+
+
+def _split(count: int, size: int) -> List[Tuple[int, int]]:
+    return [(min(size, count - start), number) for number, start in enumerate(range(0, count, size))]
+
+
+class ParallelShopDataGenerator:
+    def __init__(
+        self,
+        hook: ClickhouseNativeHook,
+        workers: Optional[int] = None,
+        shard_size: int = 100000,
+        invoice_partitions: int = 64,
+        seed: int = 0,
+        logger: Any = None,
+        **generator_kwargs,
+    ):
+        """
+        Runs 'ShopDataGenerator' bulk mode on a process pool.
+
+        Every entity is split into shards of 'shard_size' rows. The parent process reserves ID ranges and
+        unique value positions for every shard, and every shard draws from the sampler substream of its
+        (table, shard number) key, so the data for a given 'seed' does not depend on the worker count.
+        Invoices are split by 'ProductID % invoice_partitions', each partition keeps its own stock ledger.
+        Stages run in dependency order: providers, storages and products, then deliveries, delivery lines
+        and invoices. Each worker opens its own connection through 'hook', a single worker runs the same shards
+        in this process without a pool. The data differs from 'ShopDataGenerator.execute_bulk' with the same seed.
+
+        :param hook: hook used to open a connection in every worker
+        :param workers: process quantity, 'os.cpu_count()' by default
+        :param shard_size: rows per shard, also used as insert chunk size
+        :param invoice_partitions: quantity of independent invoice partitions
+        :param seed: seed of the generation
+        :param generator_kwargs: 'ShopDataGenerator' parameters (entity counts, table and field names)
+        """
+        self.hook = hook
+        self.workers = workers or os.cpu_count()
+        self.shard_size = shard_size
+        self.invoice_partitions = invoice_partitions
+        self.generator_kwargs = dict(generator_kwargs, chunk_size=shard_size, seed=seed)
+        self.logger = logger if logger is not None else logging.getLogger()
+        self.generator = ShopDataGenerator(
+            clickhouse_connection=hook.get_connection(), logger=self.logger, **self.generator_kwargs
+        )
+
+    def execute(self) -> None:
+        self.generator.check_unique_capacity()
+        if self.workers == 1:
+            _init_worker(self.hook, self.generator_kwargs)
+            self._run_stages(map)
+            return
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_worker, initargs=(self.hook, self.generator_kwargs)
+        ) as pool:
+            self._run_stages(pool.map)
+
+    def _run_stages(self, map_tasks: Callable[..., Iterable[int]]) -> None:
+        generator = self.generator
+        self._run_stage(
+            map_tasks,
+            self._shard_tasks(
+                generator.provider_table_name,
+                generator.provider_count,
+                [(generator.provider_table_name, generator.provider_name_field_name)],
+            )
+            + self._shard_tasks(
+                generator.storage_table_name,
+                generator.storage_count,
+                [
+                    (generator.storage_table_name, generator.storage_name_field_name),
+                    (generator.storage_table_name, generator.storage_address_field_name),
+                ],
+            )
+            + self._shard_tasks(
+                generator.product_table_name,
+                generator.product_count,
+                [(generator.product_table_name, generator.product_code_field_name)],
+            ),
+        )
+        self.logger.info("Providers, storages and products successfully inserted.")
+        self._run_stage(map_tasks, self._shard_tasks(generator.delivery_table_name, generator.delivery_count))
+        self.logger.info("Deliveries successfully inserted.")
+        self._run_stage(
+            map_tasks,
+            self._shard_tasks(generator.delivery_products_line_table_name, generator.delivery_products_line_count),
+        )
+        self.logger.info("Delivery_product_lines successfully inserted.")
+        self._run_stage(map_tasks, self._invoice_tasks())
+        self.logger.info("Invoices successfully inserted.")
+
+    @staticmethod
+    def _run_stage(map_tasks: Callable[..., Iterable[int]], tasks: List[ShardTask]) -> int:
+        """Runs the tasks with 'map' or 'ProcessPoolExecutor.map', returns the quantity of inserted rows."""
+        return sum(map_tasks(_run_shard, tasks))
+
+    def _shard_tasks(
+        self, table_name: str, count: int, unique_keys: List[Tuple[str, str]] = ()
+    ) -> List[ShardTask]:
+        tasks = []
+        if not count:
+            return tasks
+        start, _ = self.generator.id_allocator.reserve(table_name, count, self.generator.id_field_name)
+        table_key = zlib.crc32(table_name.encode())
+        for size, number in _split(count, self.shard_size):
+            first_id = start + number * self.shard_size
+            unique_allocators = {}
+            for unique_key in unique_keys:
+                allocator = self.generator.get_unique_allocator(*unique_key)
+                unique_allocators[unique_key] = copy.copy(allocator)
+                allocator.allocate_indices(size)
+            tasks.append(
+                ShardTask(
+                    table_name=table_name,
+                    key=(table_key, number),
+                    count=size,
+                    id_ranges={table_name: (first_id, first_id + size)},
+                    unique_allocators=unique_allocators,
+                )
+            )
+        return tasks
+
+    def _invoice_tasks(self) -> List[ShardTask]:
+        """One task per product partition, attempts are split in proportion to the partition's delivery lines."""
+        generator = self.generator
+        query = f"""SELECT
+    {generator.delivery_products_line_product_id_field_name} % {self.invoice_partitions} AS Partition,
+    count() AS LinesCount
+FROM {generator.delivery_products_line_table_name}
+GROUP BY Partition"""
+        lines_count = np.zeros(self.invoice_partitions, dtype=np.int64)
+        for partition, count in generator.client.execute(query=query):
+            lines_count[partition] = count
+        if not lines_count.sum():
+            return []
+
+        shares = generator.invoice_product_line_count * lines_count / lines_count.sum()
+        attempts = np.floor(shares).astype(np.int64)
+        remainder = generator.invoice_product_line_count - attempts.sum()
+        attempts[np.argsort(attempts - shares, kind="stable")[:remainder]] += 1
+
+        invoice_start, _ = generator.id_allocator.reserve(
+            generator.invoice_table_name, generator.invoice_product_line_count, generator.id_field_name
+        )
+        line_start, _ = generator.id_allocator.reserve(
+            generator.invoice_products_line_table_name, generator.invoice_product_line_count, generator.id_field_name
+        )
+        table_key = zlib.crc32(generator.invoice_table_name.encode())
+        tasks, offset = [], 0
+        for partition, count in enumerate(attempts.tolist()):
+            if count:
+                tasks.append(
+                    ShardTask(
+                        table_name=generator.invoice_table_name,
+                        key=(table_key, partition),
+                        count=count,
+                        id_ranges={
+                            generator.invoice_table_name: (invoice_start + offset, invoice_start + offset + count),
+                            generator.invoice_products_line_table_name: (
+                                line_start + offset,
+                                line_start + offset + count,
+                            ),
+                        },
+                        product_partition=(partition, self.invoice_partitions),
+                    )
+                )
+            offset += count
+        return tasks
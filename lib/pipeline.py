@@ -0,0 +1,134 @@
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from lib.clickhouse_hook import ClickhouseNativeHook
+from lib.data_generator import ShopDataGenerator
+from lib.metrics import maybe_stage
+
+Chunk = Tuple[str, Dict[str, np.ndarray]]
+
+# rough size of a python string referenced from an object column
+OBJECT_ITEM_BYTES = 64
+
+
+def chunk_nbytes(columns: Dict[str, np.ndarray]) -> int:
+    return sum(
+        column.nbytes + (len(column) * OBJECT_ITEM_BYTES if column.dtype == object else 0)
+        for column in columns.values()
+    )
+
+
+class MemoryBudget:
+    def __init__(self, limit_bytes: int):
+        """Byte semaphore: 'acquire' blocks while chunks in flight would exceed 'limit_bytes'."""
+        self.limit_bytes = limit_bytes
+        self.used_bytes = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int, should_stop: Callable[[], bool] = lambda: False) -> None:
+        with self._condition:
+            # a single chunk larger than the limit is let through alone to avoid a deadlock
+            while self.used_bytes and self.used_bytes + size > self.limit_bytes and not should_stop():
+                self._condition.wait(timeout=0.1)
+            self.used_bytes += size
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self.used_bytes -= size
+            self._condition.notify_all()
+
+
+class StreamingPipeline:
+    def __init__(
+        self,
+        generator: ShopDataGenerator,
+        hook: ClickhouseNativeHook,
+        memory_limit_bytes: int = 256 * 1024 * 1024,
+        insert_threads: int = 1,
+        logger: Any = None,
+    ):
+        """
+        Streams 'ShopDataGenerator' bulk output into clickhouse with bounded memory.
+
+        Every entity is a generator of column chunks. Chunks go through a bounded queue to insert threads,
+        which insert them through 'hook' (its pool, metrics and result cache), so the next chunk is generated
+        while the previous one is on the wire. The producer blocks while the chunks in flight exceed
+        'memory_limit_bytes'. Stages are separated by a barrier, because the next stage reads the IDs inserted
+        by the previous one.
+
+        :param generator: configured generator, its 'chunk_size' is the size of a streamed chunk
+        :param hook: hook inserting the chunks, its pool should hold 'insert_threads' connections
+        :param memory_limit_bytes: ceiling for generated chunks waiting for or being inserted
+        :param insert_threads: quantity of concurrent insert threads
+        """
+        self.generator = generator
+        self.hook = hook
+        self.budget = MemoryBudget(memory_limit_bytes)
+        self.insert_threads = insert_threads
+        self.logger = logger if logger is not None else logging.getLogger()
+
+        self.inserted_rows: Dict[str, int] = {}
+        self._queue: "queue.Queue[Optional[Tuple[Chunk, int]]]" = queue.Queue(maxsize=2 * insert_threads)
+        self._error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+
+    def run(self) -> Dict[str, int]:
+        """Runs all stages and returns the quantity of inserted rows per table."""
+        self.generator.check_unique_capacity()
+        threads = [threading.Thread(target=self._insert_loop, daemon=True) for _ in range(self.insert_threads)]
+        for thread in threads:
+            thread.start()
+        try:
+            for stage_name, sources in self.generator.iter_stages():
+                with maybe_stage(self.generator.metrics, stage_name):
+                    for source in sources:
+                        for chunk in source:
+                            self._put(chunk)
+                    self._queue.join()
+                    self._raise_error()
+                self.logger.info(f"{stage_name} successfully inserted.")
+        finally:
+            for _ in threads:
+                self._queue.put(None)
+            for thread in threads:
+                thread.join()
+        self._raise_error()
+        return self.inserted_rows
+
+    def _put(self, chunk: Chunk) -> None:
+        size = chunk_nbytes(chunk[1])
+        self.budget.acquire(size, should_stop=lambda: self._error is not None)
+        while True:
+            self._raise_error()
+            try:
+                self._queue.put((chunk, size), timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _insert_loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            (table_name, columns), size = item
+            try:
+                if self._error is None:
+                    self.generator._insert_columns(columns, table_name, client=self.hook)
+                    with self._lock:
+                        rows = len(columns[self.generator.id_field_name])
+                        self.inserted_rows[table_name] = self.inserted_rows.get(table_name, 0) + rows
+            except BaseException as e:
+                self._error = e
+            finally:
+                self.budget.release(size)
+                self._queue.task_done()
+
+    def _raise_error(self) -> None:
+        if self._error is not None:
+            raise RuntimeError("Insert failed, pipeline stopped") from self._error
@@ -0,0 +1,214 @@
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+# string literals and quoted identifiers are kept as they are, only whitespace outside them is collapsed
+_LITERAL_OR_WHITESPACE = re.compile(r"('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`(?:[^`\\]|\\.)*`)|\s+", re.DOTALL)
+_READ_QUERY = re.compile(r"^\s*(?:SELECT|WITH|SHOW|DESCRIBE|DESC|EXISTS)\b", re.IGNORECASE)
+# results change from call to call, never cached
+_VOLATILE_FUNCTION = re.compile(r"\b(?:now|now64|today|yesterday|rand\w*|generateUUIDv4)\s*\(", re.IGNORECASE)
+# tables read through table functions or dictionaries can't be attributed, such queries are never cached
+_UNATTRIBUTED_READ = re.compile(
+    r"\b(?:(?:FROM|JOIN)\s+\w+\s*\(|(?:dictGet\w*|dictHas|joinGet\w*)\s*\()", re.IGNORECASE
+)
+# changes which tables exist, drops all entries
+_SCHEMA_CHANGE = re.compile(r"^\s*(?:CREATE|DROP|RENAME|EXCHANGE|ATTACH|DETACH)\b", re.IGNORECASE)
+_NAME = r"[\w.`\"]+(?![\w.`\"])(?!\s*\()"
+_TABLE = re.compile(
+    rf"\b(?:FROM|JOIN|INTO|TABLE|UPDATE|IN)\s+(?:IF\s+(?:NOT\s+)?EXISTS\s+)?({_NAME})", re.IGNORECASE
+)
+# further tables of a comma join, 'FROM a AS x, b y, c'
+_ALIASED_NAME = rf"{_NAME}(?:\s+(?:AS\s+)?\w+)?"
+_COMMA_JOINED_TABLES = re.compile(rf"\bFROM\s+{_ALIASED_NAME}((?:\s*,\s*{_ALIASED_NAME})+)", re.IGNORECASE)
+
+
+class _Entry:
+    __slots__ = ("value", "tables", "nbytes", "expires_at")
+
+    def __init__(self, value: Any, tables: Set[str], nbytes: int, expires_at: float):
+        self.value = value
+        self.tables = tables
+        self.nbytes = nbytes
+        self.expires_at = expires_at
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: Optional[float] = 60.0, max_entries: int = 10000):
+        """
+        Thread-safe LRU cache of read query results (SELECT, WITH, SHOW, DESCRIBE, EXISTS) for 'ClickhouseNativeHook'.
+
+        Entries are keyed by the operation, the query with whitespace outside string literals collapsed and
+        the call parameters (params, settings, ...), and expire 'ttl' seconds after they were stored. The least
+        recently used entries are evicted beyond 'max_entries' entries or 'max_bytes' of estimated result size,
+        a larger result is not cached. Any other statement run through the hook (INSERT, ALTER, TRUNCATE, ...)
+        drops the entries of the tables it names, or all entries if it names none or is DDL. Queries calling
+        now(), rand() etc., table functions or dictionaries are not cached.
+        Hits return a shallow copy of lists and a copy of DataFrames, callers may modify results as before.
+
+        :param max_bytes: memory budget of cached results in bytes
+        :param ttl: seconds an entry is valid, None to keep entries until evicted or invalidated
+        :param max_entries: maximum quantity of entries
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.nbytes = 0
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._keys_by_table: Dict[str, Set[Hashable]] = {}
+        # bumped by every invalidation, a result loaded across one is not stored
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def call(self, operation: str, query: str, load: Callable[[], Any], *args, **kwargs) -> Any:
+        """Result of 'load' (the hook call of 'operation' with 'query' and the parameters), cached if possible."""
+        if not is_cacheable(query):
+            try:
+                return load()
+            finally:
+                if _SCHEMA_CHANGE.match(query):
+                    self.invalidate()
+                elif not _READ_QUERY.match(query):
+                    self.invalidate(get_tables(query) or None)
+        key = _make_key(operation, query, args, kwargs)
+        if key is None:
+            return load()
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return _copy(entry.value)
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            version = self._version
+        value = load()
+        self._store(key, value, get_tables(query), version)
+        return _copy(value)
+
+    def invalidate(self, tables: Optional[Set[str]] = None) -> None:
+        """Drops the entries reading any of 'tables' (names with or without database), all entries if None."""
+        with self._lock:
+            self._version += 1
+            self.invalidations += 1
+            if tables is None:
+                self._entries.clear()
+                self._keys_by_table.clear()
+                self.nbytes = 0
+                return
+            for table in tables:
+                for key in list(self._keys_by_table.get(_table_key(table), ())):
+                    self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / calls if calls else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.nbytes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _store(self, key: Hashable, value: Any, tables: Set[str], version: int) -> None:
+        nbytes = estimate_size(value)
+        if nbytes > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else float("inf")
+        with self._lock:
+            if version != self._version:
+                # a write invalidated the tables while the result was loading, it may be stale
+                return
+            if key in self._entries:
+                self._remove(key)
+            table_keys = {_table_key(table) for table in tables}
+            self._entries[key] = _Entry(value, table_keys, nbytes, expires_at)
+            self.nbytes += nbytes
+            for table_key in table_keys:
+                self._keys_by_table.setdefault(table_key, set()).add(key)
+            while self._entries and (len(self._entries) > self.max_entries or self.nbytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Hashable) -> None:
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+        for table_key in entry.tables:
+            keys = self._keys_by_table.get(table_key)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._keys_by_table[table_key]
+
+
+def is_cacheable(query: str) -> bool:
+    return (
+        bool(_READ_QUERY.match(query))
+        and not _VOLATILE_FUNCTION.search(query)
+        and not _UNATTRIBUTED_READ.search(query)
+    )
+
+
+def normalize_query(query: str) -> str:
+    """Query with whitespace outside string literals collapsed and no trailing semicolon."""
+    return _LITERAL_OR_WHITESPACE.sub(lambda match: match.group(1) or " ", query).strip().rstrip(";").rstrip()
+
+
+def get_tables(query: str) -> Set[str]:
+    """Tables named after FROM (comma joins included), JOIN, INTO, TABLE, UPDATE or IN, e.g. {'shop.provider'}."""
+    tables = _TABLE.findall(query)
+    for joined in _COMMA_JOINED_TABLES.findall(query):
+        tables.extend(re.findall(rf",\s*({_NAME})", joined))
+    return {table.replace("`", "").replace('"', "") for table in tables}
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory of a result: a DataFrame's deep memory usage or the sizes of rows and their values."""
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(item) for item in value)
+    return sys.getsizeof(value)
+
+
+def _table_key(table: str) -> str:
+    # unqualified, so 'provider' and 'shop.provider' invalidate each other
+    return table.rsplit(".", 1)[-1]
+
+
+def _make_key(operation: str, query: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> Optional[Hashable]:
+    try:
+        key = (operation, normalize_query(query), _freeze(args), _freeze(kwargs))
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _freeze(value: Any) -> Hashable:
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (set, frozenset)):
+        return frozenset(_freeze(item) for item in value)
+    return value
+
+
+def _copy(value: Any) -> Any:
+    if isinstance(value, list):
+        return list(value)
+    if hasattr(value, "copy") and hasattr(value, "memory_usage"):
+        return value.copy()
+    return value
@@ -0,0 +1,94 @@
+from typing import Any, List, Optional, Sequence, Union
+
+import numpy as np
+
+DATETIME_DTYPE = "datetime64[s]"
+SECONDS_IN_DAY = 24 * 60 * 60
+
+# relative order intensity by hour of day and by weekday (Monday first)
+HOURLY_WEIGHTS = np.array(
+    [1, 1, 1, 1, 1, 2, 4, 6, 8, 9, 10, 10, 11, 10, 9, 9, 10, 11, 12, 11, 9, 6, 3, 2], dtype=np.float64
+)
+WEEKDAY_WEIGHTS = np.array([1.0, 1.0, 1.0, 1.05, 1.2, 1.4, 1.1], dtype=np.float64)
+
+
+class Sampler:
+    def __init__(self, seed: Any = None, seed_sequence: Optional[np.random.SeedSequence] = None):
+        """
+        Vectorized random values on top of 'numpy.random.Generator'.
+
+        Every method returns a whole array. 'substream' derives independent generators from a key
+        (e.g. entity and chunk number), so a chunk gets the same values no matter which worker
+        produces it or in which order chunks are generated.
+
+        :param seed: seed for 'numpy.random.SeedSequence'
+        :param seed_sequence: ready seed sequence, takes precedence over 'seed'
+        """
+        self.seed_sequence = seed_sequence if seed_sequence is not None else np.random.SeedSequence(seed)
+        self.rng = np.random.Generator(np.random.PCG64(self.seed_sequence))
+
+    def substream(self, *key: int) -> "Sampler":
+        """Independent sampler determined by this sampler's seed and 'key' only."""
+        seed_sequence = np.random.SeedSequence(
+            self.seed_sequence.entropy, spawn_key=tuple(self.seed_sequence.spawn_key) + tuple(key)
+        )
+        return Sampler(seed_sequence=seed_sequence)
+
+    def spawn(self, count: int) -> List["Sampler"]:
+        return [Sampler(seed_sequence=seed_sequence) for seed_sequence in self.seed_sequence.spawn(count)]
+
+    def integers(self, min_value: Any, max_value: Any, size: int, dtype: Any = np.int64) -> np.ndarray:
+        """Integers in [min_value, max_value), bounds may be arrays."""
+        return self.rng.integers(min_value, max_value, size=size, dtype=dtype)
+
+    def choice(self, values: Union[int, Sequence[Any]], size: int, p: Optional[np.ndarray] = None) -> np.ndarray:
+        """Picks from 'values', or from range(values) for an integer, with optional probabilities 'p'."""
+        return self.rng.choice(values, size=size, p=p)
+
+    def datetimes(
+        self, min_value: Any = "2022-01-01 00:00:00", max_value: Any = "2022-12-31 00:00:00", size: int = 1
+    ) -> np.ndarray:
+        """Uniform 'datetime64[s]' values in [min_value, max_value), bounds may be arrays."""
+        start = np.asarray(min_value, dtype=DATETIME_DTYPE).astype(np.int64)
+        end = np.asarray(max_value, dtype=DATETIME_DTYPE).astype(np.int64)
+        offsets = self.rng.random(size) * np.maximum(end - start, 0)
+        return (start + offsets.astype(np.int64)).astype(DATETIME_DTYPE)
+
+    def zipf_indices(self, count: int, size: int, exponent: float = 1.1) -> np.ndarray:
+        """Indices in [0, count) where index k is drawn with probability proportional to 1 / (k + 1) ** exponent."""
+        cdf = np.cumsum(1.0 / np.arange(1, count + 1, dtype=np.float64) ** exponent)
+        return np.minimum(np.searchsorted(cdf, self.rng.random(size) * cdf[-1], side="right"), count - 1)
+
+    def seasonal_datetimes(
+        self,
+        min_value: Any = "2022-01-01 00:00:00",
+        max_value: Any = "2022-12-31 00:00:00",
+        size: int = 1,
+        yearly_amplitude: float = 0.3,
+        peak_day_of_year: int = 350,
+    ) -> np.ndarray:
+        """
+        'datetime64[s]' values in [min_value, max_value) following weekday, hour of day and yearly seasonality.
+
+        Days are drawn with weights from 'WEEKDAY_WEIGHTS' and a yearly cosine peaking on 'peak_day_of_year',
+        hours with 'HOURLY_WEIGHTS'. With array bounds, values falling out of their own range are replaced
+        by uniform ones.
+        """
+        start = np.asarray(min_value, dtype=DATETIME_DTYPE).astype(np.int64)
+        end = np.asarray(max_value, dtype=DATETIME_DTYPE).astype(np.int64)
+        days = np.arange(int(np.min(start)) // SECONDS_IN_DAY, int(np.max(end)) // SECONDS_IN_DAY + 1, dtype=np.int64)
+        day_of_year = (days.astype("datetime64[D]") - days.astype("datetime64[D]").astype("datetime64[Y]")).astype(
+            np.int64
+        )
+        # 1970-01-01 was Thursday
+        day_weights = WEEKDAY_WEIGHTS[(days + 3) % 7] * (
+            1 + yearly_amplitude * np.cos(2 * np.pi * (day_of_year - peak_day_of_year) / 365.25)
+        )
+        cdf = np.cumsum(day_weights)
+        picked_days = np.minimum(np.searchsorted(cdf, self.rng.random(size) * cdf[-1], side="right"), len(days) - 1)
+        hours = self.rng.choice(24, size=size, p=HOURLY_WEIGHTS / HOURLY_WEIGHTS.sum())
+        values = days[picked_days] * SECONDS_IN_DAY + hours * 3600 + self.rng.integers(0, 3600, size=size)
+
+        outside = (values < start) | (values >= end)
+        uniform = start + (self.rng.random(size) * np.maximum(end - start, 0)).astype(np.int64)
+        return np.where(outside, uniform, values).astype(DATETIME_DTYPE)
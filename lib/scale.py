@@ -0,0 +1,38 @@
+from typing import Dict, Union
+
+# entity counts at scale factor 1
+BULK_COUNTS = {
+    "provider_count": 1000,
+    "storage_count": 200,
+    "product_count": 10000,
+    "delivery_count": 10000,
+    "delivery_products_line_count": 100000,
+    "invoice_product_line_count": 100000,
+}
+SCALE_PRESETS = {
+    "smoke": 0.001,
+    "tiny": 0.01,
+    "small": 0.1,
+    "sf1": 1,
+    "sf10": 10,
+    "sf100": 100,
+    "sf1000": 1000,
+}
+
+
+def parse_scale_factor(value: Union[str, float]) -> float:
+    """Scale factor from a preset name of 'SCALE_PRESETS' or a number."""
+    if value in SCALE_PRESETS:
+        return SCALE_PRESETS[value]
+    try:
+        scale_factor = float(value)
+    except ValueError:
+        raise ValueError(f"Scale factor must be a number or one of {list(SCALE_PRESETS)}, got {value!r}") from None
+    if scale_factor <= 0:
+        raise ValueError(f"Scale factor must be positive, got {value!r}")
+    return scale_factor
+
+
+def scale_counts(scale_factor: float) -> Dict[str, int]:
+    """'ShopDataGenerator' entity counts: 'BULK_COUNTS' times the scale factor, at least one of every entity."""
+    return {name: max(1, round(count * scale_factor)) for name, count in BULK_COUNTS.items()}
@@ -0,0 +1,162 @@
+import os
+import re
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from lib.load_query import load_query
+
+# queries/*.sql of the repository, the DDL the generator writes to
+QUERIES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "queries")
+
+# clickhouse types for generated column dtypes, used when a column has no explicit type
+CLICKHOUSE_TYPES = {
+    np.dtype(np.uint8): "UInt8",
+    np.dtype(np.uint16): "UInt16",
+    np.dtype(np.uint32): "UInt32",
+    np.dtype(np.uint64): "UInt64",
+    np.dtype(np.int8): "Int8",
+    np.dtype(np.int16): "Int16",
+    np.dtype(np.int32): "Int32",
+    np.dtype(np.int64): "Int64",
+    np.dtype(np.float32): "Float32",
+    np.dtype(np.float64): "Float64",
+    np.dtype(object): "String",
+}
+NUMPY_TYPES = {
+    "UInt8": np.uint8,
+    "UInt16": np.uint16,
+    "UInt32": np.uint32,
+    "UInt64": np.uint64,
+    "Int8": np.int8,
+    "Int16": np.int16,
+    "Int32": np.int32,
+    "Int64": np.int64,
+    "Float32": np.float32,
+    "Float64": np.float64,
+}
+# inclusive bounds of time types, as integers of their numpy unit
+TIME_TYPES = {
+    "DateTime": ("datetime64[s]", 0, 2**32 - 1),
+    "Date": ("datetime64[D]", 0, 2**16 - 1),
+}
+
+_CREATE_TABLE = re.compile(
+    r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?([\w.`]+)\s*\((.*)\)\s*ENGINE", re.IGNORECASE | re.DOTALL
+)
+_COLUMN = re.compile(r"`?(\w+)`?\s+(\w+(?:\(.*\))?)", re.DOTALL)
+# table elements of the column list that are not columns, e.g. the projections of 'TableLayout.render'
+_NOT_COLUMN = re.compile(r"(?:PROJECTION|INDEX|CONSTRAINT)\s", re.IGNORECASE)
+
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    name: str
+    type: str
+
+    @property
+    def dtype(self) -> np.dtype:
+        """Exact numpy dtype the 'use_numpy' insert path takes without conversion."""
+        if self.type in NUMPY_TYPES:
+            return np.dtype(NUMPY_TYPES[self.type])
+        if self.type in TIME_TYPES:
+            return np.dtype(TIME_TYPES[self.type][0])
+        if self.type == "String":
+            return np.dtype(object)
+        raise ValueError(f"Unsupported column type {self.type} of {self.name}")
+
+    def cast(self, column: Any, table_name: str = "") -> np.ndarray:
+        """
+        Column in 'dtype'. Integers are range checked before the cast, so a value that does not fit the type
+        raises 'ValueError' instead of wrapping around, and so do values of a kind the type can't hold.
+        """
+        dtype = self.dtype
+        if dtype.kind == "O":
+            return np.asarray(column, dtype=object)
+        if self.type in TIME_TYPES:
+            values = np.asarray(column, dtype=dtype)
+            integers = values.astype(np.int64)
+            low, high = TIME_TYPES[self.type][1:]
+        else:
+            values = np.asarray(column)
+            if values.dtype.kind not in ("biu" if dtype.kind in "iu" else "biuf"):
+                raise ValueError(f"{table_name}.{self.name} of {self.type} can't hold {values.dtype} values")
+            if values.dtype == dtype or dtype.kind == "f":
+                return values.astype(dtype, copy=False)
+            integers, info = values, np.iinfo(dtype)
+            low, high = int(info.min), int(info.max)
+        if len(integers) and (int(integers.min()) < low or int(integers.max()) > high):
+            raise ValueError(
+                f"{table_name}.{self.name} values [{integers.min()}, {integers.max()}] are out of {self.type} range"
+            )
+        return values.astype(dtype, copy=False)
+
+
+@dataclass(frozen=True)
+class TableSchema:
+    name: str
+    columns: List[ColumnSpec]
+
+    @property
+    def column_types(self) -> Dict[str, str]:
+        return {column.name: column.type for column in self.columns}
+
+    def cast(self, columns: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """
+        Columns in table order and in the exact dtypes of their types (see 'ColumnSpec.cast'). Like the driver's
+        insert, columns the table doesn't have are dropped and missing ones are left to the table defaults.
+        """
+        return {
+            column.name: column.cast(columns[column.name], table_name=self.name)
+            for column in self.columns
+            if column.name in columns
+        }
+
+
+def parse_create_table(query: str) -> TableSchema:
+    """Schema of a 'CREATE TABLE' query, column types with parameters (e.g. 'DateTime('UTC')') are kept verbatim."""
+    match = _CREATE_TABLE.search(query)
+    if match is None:
+        raise ValueError("Not a CREATE TABLE query")
+    columns = []
+    for definition in _split_columns(match[2]):
+        if _NOT_COLUMN.match(definition.strip()):
+            continue
+        column = _COLUMN.match(definition.strip())
+        if column is None:
+            raise ValueError(f"Can't parse column definition '{definition.strip()}'")
+        columns.append(ColumnSpec(name=column[1], type=column[2]))
+    return TableSchema(name=match[1].replace("`", ""), columns=columns)
+
+
+def load_schemas(path: str = QUERIES_PATH) -> Dict[str, TableSchema]:
+    """Schemas of all tables created by the '*.sql' files in 'path', keyed by '<database>.<table>'."""
+    schemas = {}
+    for file_name in sorted(os.listdir(path)):
+        if file_name.endswith(".sql"):
+            query = load_query(os.path.join(path, file_name))
+            if _CREATE_TABLE.search(query):
+                schema = parse_create_table(query)
+                schemas[schema.name] = schema
+    return schemas
+
+
+def get_column_types(schemas: Optional[Dict[str, TableSchema]]) -> Dict[str, Dict[str, str]]:
+    """Clickhouse types per table and column, the 'column_types' of 'FileSink'."""
+    return {name: schema.column_types for name, schema in (schemas or {}).items()}
+
+
+def _split_columns(body: str) -> List[str]:
+    # commas inside type parameters, e.g. Decimal(10, 2), don't separate columns
+    definitions, depth, start = [], 0, 0
+    for position, char in enumerate(body):
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == "," and not depth:
+            definitions.append(body[start:position])
+            start = position + 1
+    definitions.append(body[start:])
+    return [definition for definition in definitions if definition.strip()]
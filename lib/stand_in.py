@@ -0,0 +1,1241 @@
+import operator
+import os
+import re
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from clickhouse_driver.errors import ErrorCodes, ServerException
+from clickhouse_driver.protocol import ServerPacketTypes
+
+from lib.clickhouse_hook import ClickhouseNativeHook
+from lib.load_query import load_query
+from lib.schema import CLICKHOUSE_TYPES, QUERIES_PATH, TableSchema, parse_create_table
+
+_TOKEN = re.compile(
+    r"\s+|--[^\n]*|/\*.*?\*/"
+    r"|(?P<string>'(?:[^'\\]|\\.)*')"
+    r"|(?P<number>\d+\.?\d*(?:[eE][-+]?\d+)?)"
+    r"|(?P<name>`[^`]*`|[A-Za-z_]\w*)"
+    r"|(?P<symbol>==|!=|<>|<=|>=|[-+*/%=<>(),.;\[\]])",
+    re.DOTALL,
+)
+_ESCAPES = {"b": "\b", "f": "\f", "r": "\r", "n": "\n", "t": "\t", "0": "\0", "a": "\a", "v": "\v"}
+# words ending an expression, a name after an expression is an alias unless it is one of them
+_CLAUSE_WORDS = {
+    "ALL", "AND", "ANY", "AS", "ASC", "BETWEEN", "BY", "CROSS", "DESC", "FINAL", "FORMAT", "FROM", "FULL", "GROUP",
+    "HAVING", "IN", "INNER", "JOIN", "LEFT", "LIKE", "LIMIT", "NOT", "OFFSET", "ON", "OR", "ORDER", "OUTER",
+    "PREWHERE", "RIGHT", "SETTINGS", "UNION", "USING", "WHERE", "WITH",
+}
+_COMPARISONS = {
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<>": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+_OPERATORS = dict(
+    _COMPARISONS,
+    **{
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "/": operator.truediv,
+        "%": operator.mod,
+        "AND": np.logical_and,
+        "OR": np.logical_or,
+    },
+)
+_AGGREGATES = {"count", "sum", "min", "max", "avg", "any", "uniq", "uniqexact"}
+
+
+class StandInServer:
+    def __init__(self, queries_path: Optional[str] = None):
+        """
+        In-process stand-in for a clickhouse server, tables are kept as NumPy columns in memory.
+
+        Understands the DDL of 'queries/*.sql' (and of 'TableLayout.render', the layout itself is ignored),
+        TRUNCATE, DROP, 'ALTER TABLE ... DELETE WHERE', inserts and a subset of SELECT that covers the queries
+        of the generator and its tools: WITH subqueries, one equi JOIN (INNER or LEFT), WHERE, GROUP BY with
+        count, sum, min, max, avg, any and uniq, HAVING, ORDER BY, LIMIT, IN, arithmetic, comparisons and
+        the date functions toYYYYMM, toStartOfMonth, toDate. Anything else raises 'ServerException' with
+        the code the server would use, e.g. 'ErrorCodes.UNKNOWN_TABLE' or 'ErrorCodes.NOT_IMPLEMENTED'.
+        Values are cast to the exact dtypes of the column types (see 'ColumnSpec.cast') on insert.
+
+        :param queries_path: directory of '*.sql' files to run on start, e.g. 'QUERIES_PATH', None for none
+        """
+        self.databases = {"default"}
+        self.tables: Dict[str, _Table] = {}
+        self._lock = threading.RLock()
+        if queries_path is not None:
+            self.load_queries(queries_path)
+
+    def load_queries(self, path: str = QUERIES_PATH) -> None:
+        """Runs the '*.sql' files of 'path', those creating databases first."""
+        queries = [load_query(os.path.join(path, name)) for name in sorted(os.listdir(path)) if name.endswith(".sql")]
+        queries.sort(key=lambda query: not re.match(r"\s*CREATE\s+DATABASE", query, re.IGNORECASE))
+        for query in queries:
+            self.run(query)
+
+    def client(self, database: str = "default") -> "StandInClient":
+        return StandInClient(self, database)
+
+    def run(self, query: str, database: str = "default", data: Optional[Dict[str, Any]] = None) -> "_Result":
+        """
+        Runs one statement, 'data' holds the {column name: values} of an INSERT without inline VALUES.
+        Statements without a result return an empty '_Result', an INSERT returns one with 'written_rows'.
+        """
+        parser = _Parser(query)
+        if parser.keyword("SELECT", "WITH", peek=True):
+            result = _Executor(self, database).select(parser.select())
+        elif parser.keyword("INSERT"):
+            result = self._insert(parser, database, data)
+        elif parser.keyword("CREATE"):
+            result = self._create(parser, query, database)
+        elif parser.keyword("DROP"):
+            result = self._drop(parser, database)
+        elif parser.keyword("TRUNCATE"):
+            parser.keyword("TABLE")
+            if_exists = parser.keyword("IF") and parser.expect_keyword("EXISTS")
+            table_name = _qualify(parser.name(), database)
+            with self._lock:
+                if table_name in self.tables:
+                    self.tables[table_name].truncate()
+                elif not if_exists:
+                    raise _unknown_table(table_name)
+            result = _Result()
+        elif parser.keyword("ALTER"):
+            result = self._alter(parser, database)
+        elif parser.keyword("EXISTS"):
+            parser.keyword("TABLE")
+            exists = _qualify(parser.name(), database) in self.tables
+            result = _Result(["result"], [np.array([exists], dtype=np.uint8)])
+        elif parser.keyword("SHOW"):
+            parser.expect_keyword("TABLES")
+            if parser.keyword("FROM", "IN"):
+                database = parser.name()
+            names = sorted(name.split(".", 1)[1] for name in self.tables if name.split(".", 1)[0] == database)
+            result = _Result(["name"], [np.array(names, dtype=object)])
+        else:
+            raise ServerException(f"Query is not supported by the stand-in: {query}", ErrorCodes.NOT_IMPLEMENTED)
+        parser.end()
+        return result
+
+    def get_table(self, table_name: str) -> "_Table":
+        with self._lock:
+            table = self.tables.get(table_name)
+        if table is None:
+            raise _unknown_table(table_name)
+        return table
+
+    def _create(self, parser: "_Parser", query: str, database: str) -> "_Result":
+        if parser.keyword("DATABASE"):
+            if_not_exists = parser.keyword("IF") and parser.expect_keyword("NOT") and parser.expect_keyword("EXISTS")
+            name = parser.name()
+            with self._lock:
+                if name in self.databases and not if_not_exists:
+                    raise ServerException(f"Database {name} already exists", ErrorCodes.DATABASE_ALREADY_EXISTS)
+                self.databases.add(name)
+            return _Result()
+        parser.expect_keyword("TABLE")
+        if_not_exists = parser.keyword("IF") and parser.expect_keyword("NOT") and parser.expect_keyword("EXISTS")
+        try:
+            schema = parse_create_table(query)
+        except ValueError as e:
+            raise ServerException(str(e), ErrorCodes.SYNTAX_ERROR)
+        table_name = _qualify(schema.name, database)
+        database = table_name.split(".", 1)[0]
+        with self._lock:
+            if database not in self.databases:
+                raise ServerException(f"Database {database} doesn't exist", ErrorCodes.UNKNOWN_DATABASE)
+            if table_name in self.tables:
+                if not if_not_exists:
+                    raise ServerException(f"Table {table_name} already exists", ErrorCodes.TABLE_ALREADY_EXISTS)
+            else:
+                self.tables[table_name] = _Table(TableSchema(table_name, schema.columns))
+        # the engine, keys and settings are not used
+        parser.position = len(parser.tokens)
+        return _Result()
+
+    def _drop(self, parser: "_Parser", database: str) -> "_Result":
+        is_database = parser.keyword("DATABASE")
+        if not is_database:
+            parser.expect_keyword("TABLE")
+        if_exists = parser.keyword("IF") and parser.expect_keyword("EXISTS")
+        name = parser.name()
+        with self._lock:
+            if is_database:
+                if name not in self.databases and not if_exists:
+                    raise ServerException(f"Database {name} doesn't exist", ErrorCodes.UNKNOWN_DATABASE)
+                self.databases.discard(name)
+                for table_name in [table_name for table_name in self.tables if table_name.startswith(f"{name}.")]:
+                    del self.tables[table_name]
+            elif self.tables.pop(_qualify(name, database), None) is None and not if_exists:
+                raise _unknown_table(_qualify(name, database))
+        return _Result()
+
+    def _alter(self, parser: "_Parser", database: str) -> "_Result":
+        parser.expect_keyword("TABLE")
+        table = self.get_table(_qualify(parser.name(), database))
+        parser.expect_keyword("DELETE")
+        parser.expect_keyword("WHERE")
+        condition = parser.expression()
+        executor = _Executor(self, database)
+
+        def evaluate(columns: Dict[str, np.ndarray]) -> np.ndarray:
+            frame = _Frame.from_table(columns, [table.schema.name])
+            return _as_bool(_broadcast(executor.evaluate(condition, frame, {}), frame.rows))
+
+        # mutations run synchronously, 'mutations_sync' makes no difference
+        table.delete(evaluate)
+        return _Result()
+
+    def _insert(self, parser: "_Parser", database: str, data: Optional[Dict[str, Any]]) -> "_Result":
+        parser.expect_keyword("INTO")
+        parser.keyword("TABLE")
+        table = self.get_table(_qualify(parser.name(), database))
+        names = table.schema.column_types.keys()
+        if parser.symbol("("):
+            names = [parser.name()]
+            while parser.symbol(","):
+                names.append(parser.name())
+            parser.expect_symbol(")")
+        names = list(names)
+        parser.expect_keyword("VALUES")
+        if data is None:
+            rows = []
+            executor, frame = _Executor(self, database), _Frame.one()
+            while parser.symbol("("):
+                rows.append([executor.evaluate(expression, frame, {}) for expression in parser.expressions()])
+                parser.expect_symbol(")")
+                parser.symbol(",")
+            data = {name: [row[position] for row in rows] for position, name in enumerate(names)}
+        return _Result(written_rows=table.insert({name: data[name] for name in names}))
+
+
+class StandInClient:
+    def __init__(self, server: Optional[StandInServer] = None, database: str = "default"):
+        """
+        'clickhouse_driver.Client' surface (execute, execute_iter, query_dataframe, insert_dataframe) over
+        a 'StandInServer', usable as the generator's 'clickhouse_connection' or a 'ClickhouseNativeHook'
+        connection, including 'iter_batches'. Results have the driver's shape: row tuples of Python values,
+        or columns with 'columnar=True', DataFrames are built from NumPy columns as with 'use_numpy'.
+
+        :param server: stand-in server, a new empty one if None
+        :param database: database of unqualified table names
+        """
+        self.server = server if server is not None else StandInServer()
+        self.database = database
+        self.connection = _StandInConnection(self)
+        self._pending_query: Optional[str] = None
+        self._pending_settings: Dict[str, Any] = {}
+
+    def execute(
+        self,
+        query: str,
+        params: Any = None,
+        with_column_types: bool = False,
+        external_tables: Any = None,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict[str, Any]] = None,
+        types_check: bool = False,
+        columnar: bool = False,
+    ) -> Any:
+        if _is_insert(query) and params is not None and not isinstance(params, dict):
+            names, data = self._insert_names(query), {}
+            if columnar:
+                data = dict(zip(names, params))
+            else:
+                rows = list(params)
+                for position, name in enumerate(names):
+                    data[name] = [row[name] if isinstance(row, dict) else row[position] for row in rows]
+            return self.server.run(query, self.database, data).written_rows
+        result = self.server.run(_substitute_params(query, params), self.database)
+        if result.written_rows is not None:
+            return result.written_rows
+        if columnar:
+            use_numpy = (settings or {}).get("use_numpy")
+            rows = [column if use_numpy else tuple(column.tolist()) for column in result.columns]
+        else:
+            rows = list(zip(*(column.tolist() for column in result.columns)))
+        return (rows, result.column_types) if with_column_types else rows
+
+    def execute_iter(self, query: str, params: Any = None, with_column_types: bool = False, **kwargs) -> Iterator[Any]:
+        result = self.execute(query, params, with_column_types=with_column_types, **kwargs)
+        if with_column_types:
+            rows, column_types = result
+            yield column_types
+            yield from rows
+        else:
+            yield from result
+
+    def query_dataframe(
+        self,
+        query: str,
+        params: Any = None,
+        external_tables: Any = None,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict[str, Any]] = None,
+        replace_nonwords: bool = True,
+    ) -> pd.DataFrame:
+        result = self.server.run(_substitute_params(query, params), self.database)
+        names = [re.sub(r"\W", "_", name) for name in result.names] if replace_nonwords else result.names
+        return pd.DataFrame(dict(zip(names, result.columns)), columns=names)
+
+    def insert_dataframe(
+        self,
+        query: str,
+        dataframe: pd.DataFrame,
+        external_tables: Any = None,
+        query_id: Optional[str] = None,
+        settings: Optional[Dict[str, Any]] = None,
+    ) -> int:
+        names = self._insert_names(query)
+        missing = [name for name in names if name not in dataframe.columns]
+        if missing:
+            raise ValueError(f"DataFrame missing required columns: {missing}")
+        return self.server.run(query, self.database, {name: dataframe[name].to_numpy() for name in names}).written_rows
+
+    def disconnect(self) -> None:
+        pass
+
+    @contextmanager
+    def disconnect_on_error(self, query: str, settings: Optional[Dict[str, Any]] = None) -> Iterator[None]:
+        # the part of the driver's packet interface 'iter_column_batches' uses
+        self._pending_settings = settings or {}
+        yield
+
+    def packet_generator(self) -> Iterator["_Packet"]:
+        query, self._pending_query = self._pending_query, None
+        result = self.server.run(query, self.database)
+        block_size = self._pending_settings.get("max_block_size") or 65536
+        # a header block without rows first, as the server sends it
+        yield _Packet(_Block(result.column_types, [column[:0] for column in result.columns]))
+        for start in range(0, result.rows, block_size):
+            columns = [column[start : start + block_size] for column in result.columns]
+            yield _Packet(_Block(result.column_types, columns))
+
+    def _insert_names(self, query: str) -> List[str]:
+        parser = _Parser(query)
+        parser.expect_keyword("INSERT")
+        parser.expect_keyword("INTO")
+        parser.keyword("TABLE")
+        table_name = _qualify(parser.name(), self.database)
+        if parser.symbol("("):
+            names = [parser.name()]
+            while parser.symbol(","):
+                names.append(parser.name())
+            return names
+        return list(self.server.get_table(table_name).schema.column_types)
+
+
+class StandInHook(ClickhouseNativeHook):
+    def __init__(
+        self,
+        server: Optional[StandInServer] = None,
+        database: str = "default",
+        pool_size: int = 4,
+        **kwargs,
+    ):
+        """
+        'ClickhouseNativeHook' whose connections are 'StandInClient's of one 'StandInServer', for runs,
+        benchmarks and tests without a clickhouse server. Pooling, metrics and the result cache work as usual.
+
+        :param server: stand-in server, a new empty one if None
+        :param database: database of unqualified table names
+        :param pool_size: maximum quantity of connections checked out at once
+        :param kwargs: other 'ClickhouseNativeHook' parameters, e.g. metrics
+        """
+        super().__init__(login="default", password="", host="stand-in", pool_size=pool_size, **kwargs)
+        self.server = server if server is not None else StandInServer()
+        self.database = database
+
+    def get_connection(self) -> StandInClient:
+        return StandInClient(self.server, self.database)
+
+
+class _StandInConnection:
+    connected = True
+
+    def __init__(self, client: StandInClient):
+        self.client = client
+
+    def ping(self) -> bool:
+        return True
+
+    def send_query(self, query: str, query_id: Optional[str] = None) -> None:
+        self.client._pending_query = query
+
+    def send_external_tables(self, tables: Any) -> None:
+        pass
+
+
+class _Block:
+    __slots__ = ("columns_with_types", "columns", "num_rows")
+
+    def __init__(self, columns_with_types: List[Tuple[str, str]], columns: List[np.ndarray]):
+        self.columns_with_types = columns_with_types
+        self.columns = columns
+        self.num_rows = len(columns[0]) if columns else 0
+
+    def get_columns(self) -> List[np.ndarray]:
+        return self.columns
+
+
+class _Packet:
+    __slots__ = ("type", "block")
+
+    def __init__(self, block: _Block):
+        self.type = ServerPacketTypes.DATA
+        self.block = block
+
+
+class _Result:
+    def __init__(
+        self,
+        names: Sequence[str] = (),
+        columns: Sequence[np.ndarray] = (),
+        written_rows: Optional[int] = None,
+    ):
+        self.names = list(names)
+        self.columns = list(columns)
+        self.written_rows = written_rows
+
+    @property
+    def rows(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    @property
+    def column_types(self) -> List[Tuple[str, str]]:
+        return [(name, _type_name(column.dtype)) for name, column in zip(self.names, self.columns)]
+
+
+class _Table:
+    def __init__(self, schema: TableSchema):
+        """Columns of a table as lists of inserted chunks, concatenated on the first read after an insert."""
+        self.schema = schema
+        self._chunks: Dict[str, List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+        self.truncate()
+
+    def truncate(self) -> None:
+        with self._lock:
+            self._chunks = {column.name: [np.empty(0, dtype=column.dtype)] for column in self.schema.columns}
+
+    def insert(self, data: Dict[str, Any]) -> int:
+        unknown = [name for name in data if name not in self._chunks]
+        if unknown:
+            raise ServerException(
+                f"No such column {unknown[0]} in table {self.schema.name}", ErrorCodes.NO_SUCH_COLUMN_IN_TABLE
+            )
+        rows = len(next(iter(data.values()), ()))
+        columns = {}
+        for column in self.schema.columns:
+            if column.name in data:
+                columns[column.name] = column.cast(data[column.name], table_name=self.schema.name)
+            else:
+                # columns missing from the insert get the default of their type
+                columns[column.name] = _defaults(column.dtype, rows)
+            if len(columns[column.name]) != rows:
+                raise ServerException(
+                    f"Columns of the insert into {self.schema.name} differ in length",
+                    ErrorCodes.SIZES_OF_COLUMNS_DOESNT_MATCH,
+                )
+        with self._lock:
+            for name, column in columns.items():
+                self._chunks[name].append(column)
+        return rows
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        with self._lock:
+            return self._concatenate()
+
+    def delete(self, condition: Callable[[Dict[str, np.ndarray]], np.ndarray]) -> None:
+        """Deletes the rows 'condition' of the columns is true for, inserts wait until it is done."""
+        with self._lock:
+            columns = self._concatenate()
+            keep = ~condition(columns)
+            self._chunks = {name: [column[keep]] for name, column in columns.items()}
+
+    def _concatenate(self) -> Dict[str, np.ndarray]:
+        for name, chunks in self._chunks.items():
+            if len(chunks) > 1:
+                self._chunks[name] = [np.concatenate(chunks)]
+        return {name: chunks[0] for name, chunks in self._chunks.items()}
+
+
+class _Frame:
+    def __init__(self, columns: Dict[str, np.ndarray], names: List[str], rows: int):
+        """Columns of a FROM clause, keyed by name and by '<qualifier>.<name>', 'names' are those of '*'."""
+        self.columns = columns
+        self.names = names
+        self.rows = rows
+
+    @classmethod
+    def from_table(cls, columns: Dict[str, np.ndarray], qualifiers: Sequence[str]) -> "_Frame":
+        keyed = dict(columns)
+        for qualifier in qualifiers:
+            keyed.update({f"{qualifier}.{name}": column for name, column in columns.items()})
+        return cls(keyed, list(columns), len(next(iter(columns.values()), ())))
+
+    @classmethod
+    def one(cls) -> "_Frame":
+        """The single row of a SELECT without FROM."""
+        return cls({"dummy": np.zeros(1, dtype=np.uint8)}, ["dummy"], 1)
+
+    def get(self, parts: Tuple[str, ...]) -> Optional[np.ndarray]:
+        column = self.columns.get(".".join(parts))
+        if column is None and len(parts) > 2:
+            # 'database.table.column'
+            column = self.columns.get(".".join(parts[1:]))
+        return column
+
+    def take(self, positions: np.ndarray) -> "_Frame":
+        # qualified keys share arrays with plain ones, each array is taken once
+        taken: Dict[int, np.ndarray] = {}
+        columns = {}
+        for name, column in self.columns.items():
+            if id(column) not in taken:
+                taken[id(column)] = column[positions]
+            columns[name] = taken[id(column)]
+        return _Frame(columns, self.names, len(positions))
+
+
+@dataclass(eq=False)
+class _Select:
+    items: List[Tuple[Any, Optional[str], str]]
+    ctes: Dict[str, "_Select"] = field(default_factory=dict)
+    distinct: bool = False
+    source: Any = None
+    where: Any = None
+    group_by: List[Any] = field(default_factory=list)
+    having: Any = None
+    order_by: List[Tuple[Any, bool]] = field(default_factory=list)
+    limit: Optional[int] = None
+    offset: int = 0
+
+
+class _Token:
+    __slots__ = ("kind", "value", "start", "end")
+
+    def __init__(self, kind: str, value: Any, start: int, end: int):
+        self.kind = kind
+        self.value = value
+        self.start = start
+        self.end = end
+
+
+class _Parser:
+    def __init__(self, query: str):
+        """Recursive descent parser of the supported statements, expressions are nested tuples."""
+        self.query = query
+        self.tokens = _tokenize(query)
+        self.position = 0
+
+    def peek(self) -> Optional[_Token]:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def keyword(self, *words: str, peek: bool = False) -> bool:
+        token = self.peek()
+        if token is not None and token.kind == "name" and token.value.upper() in words:
+            self.position += 0 if peek else 1
+            return True
+        return False
+
+    def expect_keyword(self, word: str) -> bool:
+        if not self.keyword(word):
+            self.error(f"expected {word}")
+        return True
+
+    def symbol(self, *symbols: str) -> Optional[str]:
+        token = self.peek()
+        if token is not None and token.kind == "symbol" and token.value in symbols:
+            self.position += 1
+            return token.value
+        return None
+
+    def expect_symbol(self, symbol: str) -> None:
+        if self.symbol(symbol) is None:
+            self.error(f"expected '{symbol}'")
+
+    def name(self) -> str:
+        """Identifier, dotted names are joined, e.g. 'shop.provider'."""
+        parts = [self.identifier()]
+        while self.symbol("."):
+            parts.append(self.identifier())
+        return ".".join(parts)
+
+    def identifier(self) -> str:
+        token = self.peek()
+        if token is None or token.kind not in ("name", "quoted"):
+            self.error("expected a name")
+        self.position += 1
+        return token.value
+
+    def end(self) -> None:
+        if self.keyword("SETTINGS"):
+            # query level settings change nothing here
+            self.position = len(self.tokens)
+        self.symbol(";")
+        if self.peek() is not None:
+            self.error("unexpected token")
+
+    def error(self, message: str) -> None:
+        token = self.peek()
+        position = token.start if token is not None else len(self.query)
+        raise ServerException(
+            f"Syntax error: {message} at position {position} ({self.query[position : position + 30]!r})",
+            ErrorCodes.SYNTAX_ERROR,
+        )
+
+    def select(self) -> _Select:
+        ctes = {}
+        if self.keyword("WITH"):
+            while True:
+                name = self.identifier()
+                self.expect_keyword("AS")
+                self.expect_symbol("(")
+                ctes[name] = self.select()
+                self.expect_symbol(")")
+                if not self.symbol(","):
+                    break
+        self.expect_keyword("SELECT")
+        select = _Select(items=[], ctes=ctes, distinct=self.keyword("DISTINCT"))
+        while True:
+            select.items.append(self.select_item())
+            if not self.symbol(","):
+                break
+        if self.keyword("FROM"):
+            select.source = self.source()
+            while True:
+                kind = "INNER"
+                if self.keyword("LEFT"):
+                    kind = "LEFT"
+                elif self.keyword("RIGHT", "FULL", "CROSS"):
+                    raise ServerException("Only INNER and LEFT joins are supported", ErrorCodes.NOT_IMPLEMENTED)
+                else:
+                    self.keyword("INNER")
+                self.keyword("OUTER")
+                self.keyword("ANY", "ALL")
+                if not self.keyword("JOIN"):
+                    break
+                right = self.source()
+                self.expect_keyword("ON")
+                select.source = ("join", kind, select.source, right, self.expression())
+        if self.keyword("WHERE", "PREWHERE"):
+            select.where = self.expression()
+        if self.keyword("GROUP"):
+            self.expect_keyword("BY")
+            select.group_by = self.expressions()
+        if self.keyword("HAVING"):
+            select.having = self.expression()
+        if self.keyword("ORDER"):
+            self.expect_keyword("BY")
+            while True:
+                expression = self.expression()
+                descending = self.keyword("DESC", "DESCENDING")
+                if not descending:
+                    self.keyword("ASC", "ASCENDING")
+                select.order_by.append((expression, descending))
+                if not self.symbol(","):
+                    break
+        if self.keyword("LIMIT"):
+            select.limit = self.integer()
+            if self.symbol(","):
+                select.offset, select.limit = select.limit, self.integer()
+            elif self.keyword("OFFSET"):
+                select.offset = self.integer()
+        return select
+
+    def select_item(self) -> Tuple[Any, Optional[str], str]:
+        """(expression, alias, text of the expression)."""
+        start = self.peek().start if self.peek() is not None else len(self.query)
+        if self.symbol("*"):
+            return ("star",), None, "*"
+        expression = self.expression()
+        text = self.query[start : self.tokens[self.position - 1].end]
+        return expression, self.alias(), text
+
+    def alias(self) -> Optional[str]:
+        if self.keyword("AS"):
+            return self.identifier()
+        token = self.peek()
+        if token is not None and (
+            token.kind == "quoted" or (token.kind == "name" and token.value.upper() not in _CLAUSE_WORDS)
+        ):
+            self.position += 1
+            return token.value
+        return None
+
+    def source(self) -> Tuple[Any, ...]:
+        if self.symbol("("):
+            select = self.select()
+            self.expect_symbol(")")
+            return ("subquery", select, self.alias())
+        name = self.name()
+        self.keyword("FINAL")
+        return ("table", name, self.alias())
+
+    def integer(self) -> int:
+        token = self.peek()
+        if token is None or token.kind != "number" or not isinstance(token.value, int):
+            self.error("expected an integer")
+        self.position += 1
+        return token.value
+
+    def expressions(self) -> List[Any]:
+        expressions = [self.expression()]
+        while self.symbol(","):
+            expressions.append(self.expression())
+        return expressions
+
+    def expression(self) -> Any:
+        left = self.conjunction()
+        while self.keyword("OR"):
+            left = ("op", "OR", left, self.conjunction())
+        return left
+
+    def conjunction(self) -> Any:
+        left = self.negation()
+        while self.keyword("AND"):
+            left = ("op", "AND", left, self.negation())
+        return left
+
+    def negation(self) -> Any:
+        if self.keyword("NOT"):
+            return ("not", self.negation())
+        return self.comparison()
+
+    def comparison(self) -> Any:
+        left = self.additive()
+        symbol = self.symbol(*_COMPARISONS)
+        if symbol is not None:
+            return ("op", symbol, left, self.additive())
+        negated = self.keyword("NOT")
+        if self.keyword("IN"):
+            return ("in", left, self.in_target(), negated)
+        if self.keyword("BETWEEN"):
+            low = self.additive()
+            self.expect_keyword("AND")
+            between = ("op", "AND", ("op", ">=", left, low), ("op", "<=", left, self.additive()))
+            return ("not", between) if negated else between
+        if self.keyword("LIKE"):
+            like = ("like", left, self.additive())
+            return ("not", like) if negated else like
+        if negated:
+            self.error("expected IN, BETWEEN or LIKE")
+        return left
+
+    def in_target(self) -> Any:
+        if self.symbol("("):
+            if self.keyword("SELECT", "WITH", peek=True):
+                target = ("subquery", self.select())
+            else:
+                target = ("tuple", tuple(self.expressions()))
+            self.expect_symbol(")")
+            return target
+        if self.symbol("["):
+            target = ("tuple", tuple(self.expressions()))
+            self.expect_symbol("]")
+            return target
+        return ("cte", self.name())
+
+    def additive(self) -> Any:
+        left = self.multiplicative()
+        while True:
+            symbol = self.symbol("+", "-")
+            if symbol is None:
+                return left
+            left = ("op", symbol, left, self.multiplicative())
+
+    def multiplicative(self) -> Any:
+        left = self.unary()
+        while True:
+            symbol = self.symbol("*", "/", "%")
+            if symbol is None:
+                return left
+            left = ("op", symbol, left, self.unary())
+
+    def unary(self) -> Any:
+        if self.symbol("-"):
+            return ("op", "-", ("literal", 0), self.unary())
+        return self.primary()
+
+    def primary(self) -> Any:
+        token = self.peek()
+        if token is None:
+            self.error("unexpected end of query")
+        if token.kind in ("number", "string"):
+            self.position += 1
+            return ("literal", token.value)
+        if self.symbol("("):
+            if self.keyword("SELECT", "WITH", peek=True):
+                expression = ("scalar", self.select())
+            else:
+                expressions = self.expressions()
+                expression = expressions[0] if len(expressions) == 1 else ("tuple", tuple(expressions))
+            self.expect_symbol(")")
+            return expression
+        if self.symbol("["):
+            expressions = self.expressions()
+            self.expect_symbol("]")
+            return ("tuple", tuple(expressions))
+        if token.kind == "name" and token.value.upper() in ("NULL", "TRUE", "FALSE"):
+            self.position += 1
+            return ("literal", {"NULL": None, "TRUE": 1, "FALSE": 0}[token.value.upper()])
+        parts = [self.identifier()]
+        if self.symbol("("):
+            name = parts[0].lower()
+            arguments = []
+            if self.keyword("DISTINCT"):
+                if name != "count":
+                    self.error("DISTINCT is supported in count only")
+                name = "uniqexact"
+            token = self.peek()
+            if self.symbol("*") or (token is not None and token.kind == "symbol" and token.value == ")"):
+                arguments = []
+            else:
+                arguments = self.expressions()
+            self.expect_symbol(")")
+            return ("function", name, tuple(arguments))
+        while self.symbol("."):
+            parts.append(self.identifier())
+        return ("column", tuple(parts))
+
+
+class _Groups:
+    def __init__(self, frame: _Frame, keys: List[np.ndarray], normalized_keys: List[Any]):
+        """Group ids of the rows of 'frame', groups are sorted by their keys. Without keys all rows are one group."""
+        self.frame = frame
+        if keys:
+            codes, sizes = [], []
+            for key in keys:
+                key_codes, uniques = pd.factorize(key, sort=True)
+                codes.append(key_codes.astype(np.int64))
+                sizes.append(max(len(uniques), 1))
+            ids = codes[0]
+            if len(codes) > 1:
+                ids = pd.factorize(np.ravel_multi_index(codes, sizes), sort=True)[0]
+            self.ids = ids
+            self.count = int(ids.max()) + 1 if len(ids) else 0
+            order = np.argsort(ids, kind="stable")
+            first = order[np.searchsorted(ids[order], np.arange(self.count))]
+            self.keys = {normalized: key[first] for normalized, key in zip(normalized_keys, keys)}
+        else:
+            self.ids = np.zeros(frame.rows, dtype=np.int64)
+            self.count = 1
+            self.keys = {}
+
+    def aggregate(self, name: str, values: Any) -> np.ndarray:
+        if name == "count":
+            return np.bincount(self.ids, minlength=self.count).astype(np.uint64)
+        values = _broadcast(values, self.frame.rows)
+        if values.dtype == bool:
+            values = values.astype(np.uint8)
+        if not self.frame.rows:
+            # aggregates of an empty table without GROUP BY are the defaults of their type
+            if name in ("uniq", "uniqexact"):
+                return np.zeros(self.count, dtype=np.uint64)
+            if name == "avg":
+                return np.full(self.count, np.nan)
+            return _defaults(_sum_dtype(values.dtype) if name == "sum" else values.dtype, self.count)
+        grouped = pd.Series(values, copy=False).groupby(self.ids, sort=True)
+        if name == "sum":
+            return grouped.sum().to_numpy().astype(_sum_dtype(values.dtype))
+        if name == "avg":
+            return grouped.mean().to_numpy().astype(np.float64)
+        if name in ("uniq", "uniqexact"):
+            return grouped.nunique().to_numpy().astype(np.uint64)
+        result = {"min": grouped.min, "max": grouped.max, "any": grouped.first}[name]()
+        return result.to_numpy().astype(values.dtype)
+
+
+class _Executor:
+    def __init__(self, server: StandInServer, database: str, ctes: Optional[Dict[str, _Select]] = None):
+        self.server = server
+        self.database = database
+        self.ctes = dict(ctes or {})
+        self._cte_values: Dict[str, np.ndarray] = {}
+
+    def select(self, select: _Select) -> _Result:
+        executor = _Executor(self.server, self.database, dict(self.ctes, **select.ctes)) if select.ctes else self
+        return executor._select(select)
+
+    def _select(self, select: _Select) -> _Result:
+        frame = self.source(select.source) if select.source is not None else _Frame.one()
+        aliases = {alias: expression for expression, alias, _ in select.items if alias is not None}
+        if select.where is not None:
+            mask = _as_bool(_broadcast(self.evaluate(select.where, frame, aliases), frame.rows))
+            frame = frame.take(np.flatnonzero(mask))
+
+        items = []
+        for expression, alias, text in select.items:
+            if expression == ("star",):
+                items += [(("column", (name,)), name) for name in frame.names]
+            else:
+                items.append((expression, alias if alias is not None else text))
+        groups = None
+        if select.group_by or any(_has_aggregate(expression) for expression, _ in items):
+            keys = [_broadcast(self.evaluate(key, frame, aliases), frame.rows) for key in select.group_by]
+            groups = _Groups(frame, keys, [_normalize(key, aliases) for key in select.group_by])
+        rows = groups.count if groups is not None else frame.rows
+        names = [name for _, name in items]
+        columns = [_output(self.evaluate(expression, frame, aliases, groups), rows) for expression, _ in items]
+
+        positions = None
+        if groups is not None and select.having is not None:
+            positions = np.flatnonzero(_as_bool(_broadcast(self.evaluate(select.having, frame, aliases, groups), rows)))
+        if select.distinct:
+            unique = pd.DataFrame(dict(enumerate(columns))).drop_duplicates().index.to_numpy()
+            positions = unique if positions is None else np.intersect1d(positions, unique)
+        if select.order_by:
+            outputs = dict(zip(names, columns))
+            sort_keys = {}
+            for position, (expression, _) in enumerate(select.order_by):
+                if expression[0] == "column" and len(expression[1]) == 1 and expression[1][0] in outputs:
+                    sort_keys[position] = outputs[expression[1][0]]
+                else:
+                    sort_keys[position] = _output(self.evaluate(expression, frame, aliases, groups), rows)
+            order = pd.DataFrame(sort_keys)
+            if positions is not None:
+                order = order.iloc[positions]
+            ascending = [not descending for _, descending in select.order_by]
+            positions = order.sort_values(list(sort_keys), ascending=ascending, kind="stable").index.to_numpy()
+        if select.limit is not None or select.offset:
+            positions = positions if positions is not None else np.arange(rows)
+            end = select.offset + select.limit if select.limit is not None else None
+            positions = positions[select.offset : end]
+        if positions is not None:
+            columns = [column[positions] for column in columns]
+        return _Result(names, columns)
+
+    def source(self, source: Tuple[Any, ...]) -> _Frame:
+        if source[0] == "table":
+            _, name, alias = source
+            if alias is None and name in self.ctes:
+                return self._result_frame(self.select(self.ctes[name]), name)
+            table_name = _qualify(name, self.database)
+            qualifiers = [alias] if alias is not None else [name, table_name, table_name.split(".", 1)[1]]
+            return _Frame.from_table(self.server.get_table(table_name).columns(), qualifiers)
+        if source[0] == "subquery":
+            return self._result_frame(self.select(source[1]), source[2])
+        return self._join(*source[1:])
+
+    def _join(self, kind: str, left_source: Any, right_source: Any, condition: Any) -> _Frame:
+        left, right = self.source(left_source), self.source(right_source)
+        left_keys, right_keys = [], []
+        for left_key, right_key in _equalities(condition):
+            # each side of an equality may name either table
+            if _resolves(left_key, left) and _resolves(right_key, right):
+                pass
+            elif _resolves(right_key, left) and _resolves(left_key, right):
+                left_key, right_key = right_key, left_key
+            else:
+                raise ServerException("JOIN ON needs equalities of both tables' columns", ErrorCodes.NOT_IMPLEMENTED)
+            left_keys.append(_broadcast(self.evaluate(left_key, left, {}), left.rows))
+            right_keys.append(_broadcast(self.evaluate(right_key, right, {}), right.rows))
+        on = [f"key{position}" for position in range(len(left_keys))]
+        left_frame = pd.DataFrame(dict(zip(on, left_keys), left=np.arange(left.rows)))
+        right_frame = pd.DataFrame(dict(zip(on, right_keys), right=np.arange(right.rows)))
+        pairs = left_frame.merge(right_frame, on=on, how="left" if kind == "LEFT" else "inner", sort=False)
+        left_positions = pairs["left"].to_numpy()
+        # rows without a match get the defaults of the column types, as with 'join_use_nulls = 0'
+        right_positions = pairs["right"].fillna(-1).to_numpy().astype(np.int64)
+        matched = right_positions >= 0
+
+        columns, names = {}, list(left.names)
+        taken_left = left.take(left_positions)
+        taken_right = {}
+        for name, column in right.columns.items():
+            if id(column) not in taken_right:
+                values = _defaults(column.dtype, len(right_positions))
+                values[matched] = column[right_positions[matched]]
+                taken_right[id(column)] = values
+        columns.update({name: taken_right[id(column)] for name, column in right.columns.items()})
+        columns.update(taken_left.columns)
+        for name in right.names:
+            if name not in names:
+                names.append(name)
+        return _Frame(columns, names, len(left_positions))
+
+    @staticmethod
+    def _result_frame(result: _Result, alias: Optional[str]) -> _Frame:
+        columns = dict(zip(result.names, result.columns))
+        return _Frame.from_table(columns, [alias] if alias is not None else [])
+
+    def evaluate(self, node: Any, frame: _Frame, aliases: Dict[str, Any], groups: Optional[_Groups] = None) -> Any:
+        """Value of an expression: an array of the frame's (or groups') rows or a scalar."""
+        if groups is not None:
+            normalized = _normalize(node, aliases)
+            if normalized in groups.keys:
+                return groups.keys[normalized]
+        kind = node[0]
+        if kind == "literal":
+            return node[1]
+        if kind == "column":
+            column = frame.get(node[1]) if groups is None else None
+            if column is not None:
+                return column
+            if len(node[1]) == 1 and node[1][0] in aliases and aliases[node[1][0]] != node:
+                return self.evaluate(aliases[node[1][0]], frame, aliases, groups)
+            if groups is not None and frame.get(node[1]) is not None:
+                raise ServerException(
+                    f"Column {'.'.join(node[1])} is not under aggregate function and not in GROUP BY",
+                    ErrorCodes.NOT_AN_AGGREGATE,
+                )
+            raise ServerException(f"Unknown identifier: {'.'.join(node[1])}", ErrorCodes.UNKNOWN_IDENTIFIER)
+        if kind == "function" and node[1] in _AGGREGATES:
+            if groups is None:
+                raise ServerException(f"Aggregate function {node[1]} is found in WHERE", ErrorCodes.ILLEGAL_AGGREGATION)
+            arguments = [self.evaluate(argument, frame, aliases) for argument in node[2]]
+            return groups.aggregate(node[1], arguments[0] if arguments else None)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if kind == "op":
+                left = self.evaluate(node[2], frame, aliases, groups)
+                right = self.evaluate(node[3], frame, aliases, groups)
+                left, right = _coerce(left, right)
+                return _OPERATORS[node[1]](left, right)
+            if kind == "not":
+                return np.logical_not(self.evaluate(node[1], frame, aliases, groups))
+            if kind == "function":
+                arguments = [self.evaluate(argument, frame, aliases, groups) for argument in node[2]]
+                return _call_function(node[1], arguments)
+        if kind == "in":
+            values = self.evaluate(node[1], frame, aliases, groups)
+            candidates = self._in_values(node[2], frame, aliases)
+            values, candidates = _coerce(values, candidates)
+            found = np.isin(values, candidates)
+            return ~found if node[3] else found
+        if kind == "like":
+            values = self.evaluate(node[1], frame, aliases, groups)
+            pattern = re.compile(_like_pattern(self.evaluate(node[2], frame, aliases, groups)), re.DOTALL)
+            return np.vectorize(lambda value: pattern.fullmatch(str(value)) is not None, otypes=[bool])(values)
+        if kind == "scalar":
+            result = self.select(node[1])
+            return result.columns[0][0] if result.rows else _defaults(result.columns[0].dtype, 1)[0]
+        if kind == "tuple":
+            return _array([self.evaluate(item, frame, aliases) for item in node[1]])
+        raise ServerException(f"Unsupported expression {kind}", ErrorCodes.NOT_IMPLEMENTED)
+
+    def _in_values(self, target: Any, frame: _Frame, aliases: Dict[str, Any]) -> np.ndarray:
+        if target[0] == "tuple":
+            return _array([self.evaluate(item, frame, aliases) for item in target[1]])
+        if target[0] == "cte":
+            name = target[1]
+            if name not in self._cte_values:
+                if name in self.ctes:
+                    select = self.ctes[name]
+                else:
+                    select = _Select(items=[(("star",), None, "*")], source=("table", name, None))
+                self._cte_values[name] = self.select(select).columns[0]
+            return self._cte_values[name]
+        return self.select(target[1]).columns[0]
+
+
+def _tokenize(query: str) -> List[_Token]:
+    tokens, position = [], 0
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if match is None:
+            raise ServerException(
+                f"Syntax error at position {position} ({query[position : position + 30]!r})", ErrorCodes.SYNTAX_ERROR
+            )
+        kind = match.lastgroup
+        if kind is not None:
+            value = match[kind]
+            if kind == "string":
+                value = re.sub(r"\\(.)", _unescape, value[1:-1], flags=re.DOTALL)
+            elif kind == "number":
+                value = float(value) if re.search(r"[.eE]", value) else int(value)
+            elif kind == "name" and value.startswith("`"):
+                kind, value = "quoted", value[1:-1]
+            tokens.append(_Token(kind, value, match.start(), match.end()))
+        position = match.end()
+    return tokens
+
+
+def _unescape(escape: "re.Match") -> str:
+    return _ESCAPES.get(escape[1], escape[1])
+
+
+def _qualify(table_name: str, database: str) -> str:
+    return table_name if "." in table_name else f"{database}.{table_name}"
+
+
+def _unknown_table(table_name: str) -> ServerException:
+    return ServerException(f"Table {table_name} doesn't exist", ErrorCodes.UNKNOWN_TABLE)
+
+
+def _is_insert(query: str) -> bool:
+    return re.match(r"\s*INSERT\b", query, re.IGNORECASE) is not None
+
+
+def _substitute_params(query: str, params: Any) -> str:
+    """The driver's client side '%(name)s' substitution."""
+    if not params:
+        return query
+    return query % {name: _escape(value) for name, value in params.items()}
+
+
+def _escape(value: Any) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, datetime):
+        return f"'{value.strftime('%Y-%m-%d %H:%M:%S')}'"
+    if isinstance(value, date):
+        return f"'{value.strftime('%Y-%m-%d')}'"
+    if isinstance(value, str):
+        return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+    if isinstance(value, (list, tuple)):
+        items = ", ".join(_escape(item) for item in value)
+        return f"[{items}]" if isinstance(value, list) else f"({items})"
+    return str(value)
+
+
+def _type_name(dtype: np.dtype) -> str:
+    if dtype == np.dtype("datetime64[s]"):
+        return "DateTime"
+    if dtype == np.dtype("datetime64[D]"):
+        return "Date"
+    if dtype == bool:
+        return "UInt8"
+    return CLICKHOUSE_TYPES.get(dtype, "String")
+
+
+def _defaults(dtype: np.dtype, rows: int) -> np.ndarray:
+    if dtype.kind == "O":
+        return np.full(rows, "", dtype=object)
+    return np.zeros(rows, dtype=dtype)
+
+
+def _sum_dtype(dtype: np.dtype) -> np.dtype:
+    return np.dtype({"u": np.uint64, "i": np.int64, "b": np.uint64}.get(dtype.kind, np.float64))
+
+
+def _broadcast(value: Any, rows: int) -> np.ndarray:
+    if np.ndim(value) == 0:
+        return np.full(rows, value, dtype=object if isinstance(value, str) else None)
+    return np.asarray(value)
+
+
+def _output(value: Any, rows: int) -> np.ndarray:
+    """A result column, comparisons are UInt8 as in clickhouse."""
+    column = _broadcast(value, rows)
+    return column.astype(np.uint8) if column.dtype == bool else column
+
+
+def _array(values: List[Any]) -> np.ndarray:
+    return np.array(values, dtype=object if any(isinstance(value, str) for value in values) else None)
+
+
+def _as_bool(value: np.ndarray) -> np.ndarray:
+    return value.astype(bool) if value.dtype != bool else value
+
+
+def _coerce(left: Any, right: Any) -> Tuple[Any, Any]:
+    """Parses string literals compared with dates and times, e.g. DeliveryDateTime >= '2022-03-01 00:00:00'."""
+    left_dtype, right_dtype = np.asarray(left).dtype, np.asarray(right).dtype
+    if left_dtype.kind == "M" and right_dtype.kind in "UO":
+        right = np.asarray(right, dtype=object).astype(left_dtype)
+    elif right_dtype.kind == "M" and left_dtype.kind in "UO":
+        left = np.asarray(left, dtype=object).astype(right_dtype)
+    return left, right
+
+
+def _to_date_time(value: Any, unit: str) -> np.ndarray:
+    values = np.asarray(value)
+    if values.dtype.kind in "UO":
+        values = values.astype(object).astype("datetime64[s]")
+    return values.astype(f"datetime64[{unit}]")
+
+
+def _to_yyyymm(value: Any) -> np.ndarray:
+    months = _to_date_time(value, "M").astype(np.int64)
+    return ((months // 12 + 1970) * 100 + months % 12 + 1).astype(np.uint32)
+
+
+_FUNCTIONS: Dict[str, Callable[..., Any]] = {
+    "if": lambda condition, then, otherwise: np.where(_as_bool(np.asarray(condition)), then, otherwise),
+    "toyyyymm": _to_yyyymm,
+    "toyear": lambda value: (_to_date_time(value, "Y").astype(np.int64) + 1970).astype(np.uint16),
+    "tomonth": lambda value: (_to_date_time(value, "M").astype(np.int64) % 12 + 1).astype(np.uint8),
+    "tostartofmonth": lambda value: _to_date_time(value, "M").astype("datetime64[D]"),
+    "todate": lambda value: _to_date_time(value, "D"),
+    "todatetime": lambda value: _to_date_time(value, "s"),
+    "intdiv": np.floor_divide,
+    "modulo": np.mod,
+    "abs": np.abs,
+    "round": lambda value, digits=0: np.round(value, int(digits)),
+    "length": lambda value: np.vectorize(len, otypes=[np.uint64])(value),
+    "lower": lambda value: np.vectorize(str.lower, otypes=[object])(value),
+    "upper": lambda value: np.vectorize(str.upper, otypes=[object])(value),
+}
+
+
+# toUInt32, toFloat64 etc.
+_CASTS = {f"to{type_name.lower()}": dtype for dtype, type_name in CLICKHOUSE_TYPES.items() if type_name != "String"}
+
+
+def _call_function(name: str, arguments: List[Any]) -> Any:
+    if name in _FUNCTIONS:
+        return _FUNCTIONS[name](*arguments)
+    if name in _CASTS:
+        return np.asarray(arguments[0]).astype(_CASTS[name])
+    raise ServerException(f"Unknown function {name}", ErrorCodes.UNKNOWN_FUNCTION)
+
+
+def _like_pattern(pattern: str) -> str:
+    return "".join(".*" if char == "%" else "." if char == "_" else re.escape(char) for char in pattern)
+
+
+def _has_aggregate(node: Any) -> bool:
+    if not isinstance(node, tuple) or not node:
+        return False
+    if not isinstance(node[0], str):
+        # function arguments
+        return any(_has_aggregate(child) for child in node)
+    if node[0] == "function" and node[1] in _AGGREGATES:
+        return True
+    if node[0] in ("scalar", "subquery", "literal", "column"):
+        return False
+    return any(_has_aggregate(child) for child in node[1:] if isinstance(child, tuple))
+
+
+def _normalize(node: Any, aliases: Dict[str, Any]) -> Any:
+    """Expression with aliases replaced by what they name and columns unqualified, to match GROUP BY keys."""
+    if not isinstance(node, tuple) or not node:
+        return node
+    if node[0] == "column":
+        name = node[1][-1]
+        if len(node[1]) == 1 and name in aliases and aliases[name] != node:
+            return _normalize(aliases[name], {})
+        return ("column", (name,))
+    if node[0] in ("literal", "scalar"):
+        return node
+    return tuple(_normalize(child, aliases) if isinstance(child, tuple) else child for child in node)
+
+
+def _equalities(condition: Any) -> List[Tuple[Any, Any]]:
+    if condition[0] == "op" and condition[1] == "AND":
+        return _equalities(condition[2]) + _equalities(condition[3])
+    if condition[0] == "op" and condition[1] in ("=", "=="):
+        return [(condition[2], condition[3])]
+    raise ServerException("JOIN ON supports equalities joined with AND only", ErrorCodes.NOT_IMPLEMENTED)
+
+
+def _resolves(node: Any, frame: _Frame) -> bool:
+    """Whether all columns of an expression are found in 'frame'."""
+    if not isinstance(node, tuple) or not node:
+        return True
+    if not isinstance(node[0], str):
+        return all(_resolves(child, frame) for child in node)
+    if node[0] == "column":
+        return frame.get(node[1]) is not None
+    return all(_resolves(child, frame) for child in node[1:] if isinstance(child, tuple))
@@ -0,0 +1,193 @@
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from lib.samplers import Sampler
+
+_STORAGE_BITS = np.uint64(32)
+_STORAGE_MASK = np.uint64(0xFFFFFFFF)
+_NO_DELIVERY = np.iinfo(np.int64).max
+
+
+class StockLedger:
+    DELIVERED, INVOICED, FIRST_DELIVERY, LINES = range(4)
+
+    def __init__(self):
+        """
+        In-memory stock balances keyed by (product, storage).
+
+        Every balance holds delivered and invoiced quantities, the earliest delivery datetime (unix seconds)
+        and the quantity of delivery lines. Balances are NumPy arrays sorted by the key 'product << 32 | storage',
+        so the storages of a product are one contiguous slice. A batch of updates finds its balances with one
+        'searchsorted' and books them with 'np.add.at'; pairs seen for the first time are merged in once per batch.
+        """
+        self.keys = np.zeros(0, dtype=np.uint64)
+        self.delivered = np.zeros(0, dtype=np.int64)
+        self.invoiced = np.zeros(0, dtype=np.int64)
+        self.first_deliveries = np.zeros(0, dtype=np.int64)
+        self.lines = np.zeros(0, dtype=np.int64)
+        self.delivery_storages = np.zeros(0, dtype=np.uint32)
+        self.delivery_datetimes = np.zeros(0, dtype=np.int64)
+        self._cumulative_lines: Optional[np.ndarray] = None
+
+    @property
+    def product_ids(self) -> np.ndarray:
+        return (self.keys >> _STORAGE_BITS).astype(np.int64)
+
+    @property
+    def storage_ids(self) -> np.ndarray:
+        return (self.keys & _STORAGE_MASK).astype(np.int64)
+
+    def storages_at(self, positions: np.ndarray) -> np.ndarray:
+        return (self.keys[positions] & _STORAGE_MASK).astype(np.int64)
+
+    def available(self, product_id: int, storage_id: int) -> int:
+        key = _make_keys(product_id, storage_id)
+        position = int(np.searchsorted(self.keys, key))
+        if position == len(self.keys) or self.keys[position] != key:
+            return 0
+        return int(self.delivered[position] - self.invoiced[position])
+
+    def product_slices(self, product_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Start and end positions of the balances of every product, empty for products without any."""
+        product_ids = np.asarray(product_ids, dtype=np.uint64)
+        starts = np.searchsorted(self.keys, product_ids << _STORAGE_BITS)
+        ends = np.searchsorted(self.keys, (product_ids + np.uint64(1)) << _STORAGE_BITS)
+        return starts, ends
+
+    def best_storage(self, product_id: int) -> Optional[Tuple[int, int, int]]:
+        """Storage with the largest available quantity of the product as (storage, available, first delivery)."""
+        starts, ends = self.product_slices([product_id])
+        start, end = int(starts[0]), int(ends[0])
+        if start == end:
+            return None
+        # the lowest storage ID wins a tie
+        position = start + int(np.argmax(self.delivered[start:end] - self.invoiced[start:end]))
+        return (
+            int(self.keys[position] & _STORAGE_MASK),
+            int(self.delivered[position] - self.invoiced[position]),
+            int(self.first_deliveries[position]),
+        )
+
+    def sample_products(self, sampler: Sampler, count: int) -> np.ndarray:
+        """Products weighted by their quantity of delivery lines, empty if there are no lines."""
+        if self._cumulative_lines is None:
+            self._cumulative_lines = np.cumsum(self.lines)
+        total = int(self._cumulative_lines[-1]) if len(self._cumulative_lines) else 0
+        if not total:
+            return np.zeros(0, dtype=np.int64)
+        positions = np.searchsorted(self._cumulative_lines, sampler.integers(0, total, size=count), side="right")
+        return (self.keys[positions] >> _STORAGE_BITS).astype(np.int64)
+
+    def add_deliveries(self, delivery_ids: np.ndarray, storage_ids: np.ndarray, datetimes: np.ndarray) -> None:
+        """Registers deliveries so that their lines can be booked to the right storage."""
+        delivery_ids = np.asarray(delivery_ids, dtype=np.int64)
+        if not len(delivery_ids):
+            return
+        size = int(delivery_ids.max()) + 1
+        if size > len(self.delivery_storages):
+            size = max(size, 2 * len(self.delivery_storages))
+            self.delivery_storages = np.resize(self.delivery_storages, size)
+            self.delivery_datetimes = np.resize(self.delivery_datetimes, size)
+        self.delivery_storages[delivery_ids] = storage_ids
+        self.delivery_datetimes[delivery_ids] = np.asarray(datetimes, dtype="datetime64[s]").astype(np.int64)
+
+    def add_delivery_lines(self, product_ids: np.ndarray, delivery_ids: np.ndarray, quantities: np.ndarray) -> None:
+        delivery_ids = np.asarray(delivery_ids, dtype=np.int64)
+        self.add_delivered(
+            product_ids,
+            self.delivery_storages[delivery_ids],
+            quantities,
+            self.delivery_datetimes[delivery_ids],
+            np.ones(len(delivery_ids), dtype=np.int64),
+        )
+
+    def add_delivered(
+        self,
+        product_ids: np.ndarray,
+        storage_ids: np.ndarray,
+        quantities: np.ndarray,
+        first_datetimes: np.ndarray,
+        lines: np.ndarray,
+    ) -> None:
+        """Books deliveries, aggregated per (product, storage) or not."""
+        positions = self._positions(_make_keys(product_ids, storage_ids))
+        np.add.at(self.delivered, positions, np.asarray(quantities, dtype=np.int64))
+        np.minimum.at(
+            self.first_deliveries, positions, np.asarray(first_datetimes).astype("datetime64[s]").astype(np.int64)
+        )
+        np.add.at(self.lines, positions, np.asarray(lines, dtype=np.int64))
+        self._cumulative_lines = None
+
+    def add_invoiced(self, product_ids: np.ndarray, storage_ids: np.ndarray, quantities: np.ndarray) -> None:
+        positions = self._positions(_make_keys(product_ids, storage_ids))
+        np.add.at(self.invoiced, positions, np.asarray(quantities, dtype=np.int64))
+
+    def to_frame(self) -> DataFrame:
+        """Balances sorted by key as columns: ProductID, StorageID, LinesCount, QuantityDiff, DeliveryDateTimeMin."""
+        return DataFrame(
+            {
+                "ProductID": self.product_ids,
+                "StorageID": self.storage_ids,
+                "LinesCount": self.lines,
+                "QuantityDiff": self.delivered - self.invoiced,
+                "DeliveryDateTimeMin": self.first_deliveries.astype("datetime64[s]"),
+            }
+        )
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Ledger as plain arrays, e.g. for a checkpoint, see 'from_arrays'."""
+        values = np.empty((len(self.keys), 4), dtype=np.int64)
+        values[:, self.DELIVERED] = self.delivered
+        values[:, self.INVOICED] = self.invoiced
+        values[:, self.FIRST_DELIVERY] = self.first_deliveries
+        values[:, self.LINES] = self.lines
+        return {
+            "keys": np.column_stack([self.product_ids, self.storage_ids]),
+            "values": values,
+            "delivery_storages": self.delivery_storages,
+            "delivery_datetimes": self.delivery_datetimes,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]) -> "StockLedger":
+        ledger = cls()
+        keys, values = arrays["keys"].reshape(-1, 2), arrays["values"].reshape(-1, 4)
+        keys = _make_keys(keys[:, 0], keys[:, 1])
+        order = np.argsort(keys, kind="stable")
+        ledger.keys = keys[order]
+        ledger.delivered = values[order, cls.DELIVERED].astype(np.int64)
+        ledger.invoiced = values[order, cls.INVOICED].astype(np.int64)
+        ledger.first_deliveries = values[order, cls.FIRST_DELIVERY].astype(np.int64)
+        ledger.lines = values[order, cls.LINES].astype(np.int64)
+        ledger.delivery_storages = np.array(arrays["delivery_storages"], dtype=np.uint32)
+        ledger.delivery_datetimes = np.array(arrays["delivery_datetimes"], dtype=np.int64)
+        return ledger
+
+    def _positions(self, keys: np.ndarray) -> np.ndarray:
+        """Positions of the balances of 'keys', new pairs are inserted with empty balances first."""
+        # sorted lookups walk 'self.keys' in order, several times faster than random ones
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        sorted_positions = np.searchsorted(self.keys, sorted_keys)
+        found = sorted_positions < len(self.keys)
+        found[found] = self.keys[sorted_positions[found]] == sorted_keys[found]
+        if not found.all():
+            new_keys = sorted_keys[~found]
+            new_keys = new_keys[np.concatenate(([True], new_keys[1:] != new_keys[:-1]))]
+            insert_at = np.searchsorted(self.keys, new_keys)
+            self.keys = np.insert(self.keys, insert_at, new_keys)
+            self.delivered = np.insert(self.delivered, insert_at, 0)
+            self.invoiced = np.insert(self.invoiced, insert_at, 0)
+            self.first_deliveries = np.insert(self.first_deliveries, insert_at, _NO_DELIVERY)
+            self.lines = np.insert(self.lines, insert_at, 0)
+            self._cumulative_lines = None
+            sorted_positions = np.searchsorted(self.keys, sorted_keys)
+        positions = np.empty_like(sorted_positions)
+        positions[order] = sorted_positions
+        return positions
+
+
+def _make_keys(product_ids: np.ndarray, storage_ids: np.ndarray) -> np.ndarray:
+    return (np.asarray(product_ids).astype(np.uint64) << _STORAGE_BITS) | np.asarray(storage_ids).astype(np.uint64)
@@ -0,0 +1,136 @@
+import glob
+import gzip
+import io
+import os
+from typing import Any, BinaryIO, Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+
+from lib.schema import NUMPY_TYPES, TIME_TYPES
+
+try:
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - optional dependency
+    pyarrow = None
+
+
+class TableSource:
+    """Reads columns of a table as {column name: NumPy array} batches."""
+
+    def iter_columns(self, table_name: str, columns: List[str], batch_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        raise NotImplementedError
+
+
+class ClickhouseTableSource(TableSource):
+    def __init__(self, hook: Any):
+        """
+        Streams columns from clickhouse with 'ClickhouseNativeHook.iter_batches', one connection per table.
+
+        :param hook: clickhouse hook
+        """
+        self.hook = hook
+
+    def iter_columns(self, table_name: str, columns: List[str], batch_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        query = f"SELECT {', '.join(columns)} FROM {table_name}"
+        return self.hook.iter_batches(query, batch_size=batch_size, log_query=False)
+
+
+class FileTableSource(TableSource):
+    extension = ""
+
+    def __init__(self, path: str):
+        """
+        Reads the files a 'FileSink' of the same format wrote: '<path>/<table>/<table>.<partition>.<extension>'.
+        Batches hold up to 'batch_size' rows and never span two files.
+
+        :param path: output directory of the sink
+        """
+        self.path = path
+
+    def iter_columns(self, table_name: str, columns: List[str], batch_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        for file_path in self.get_files(table_name):
+            for batch in self._read(file_path, columns, batch_size):
+                yield {name: batch[name] for name in columns}
+
+    def get_files(self, table_name: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.path, table_name, f"{table_name}.*.{self.extension}")))
+
+    def _read(self, file_path: str, columns: List[str], batch_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        raise NotImplementedError
+
+
+class CsvTableSource(FileTableSource):
+    extension = "csv.gz"
+
+    def _read(self, file_path: str, columns: List[str], batch_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        with pd.read_csv(file_path, usecols=columns, chunksize=batch_size, compression="gzip") as reader:
+            for frame in reader:
+                yield {name: frame[name].to_numpy() for name in columns}
+
+
+class NativeTableSource(FileTableSource):
+    extension = "native.gz"
+
+    def _read(self, file_path: str, columns: List[str], batch_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        # a file holds one block per written chunk, blocks are sliced to 'batch_size' rows
+        with io.BufferedReader(gzip.GzipFile(file_path, "rb")) as f:
+            while f.peek(1):
+                block = _read_native_block(f, set(columns))
+                rows = len(next(iter(block.values()), ()))
+                for start in range(0, rows, batch_size):
+                    yield {name: column[start : start + batch_size] for name, column in block.items()}
+
+
+class ParquetTableSource(FileTableSource):
+    extension = "parquet"
+
+    def __init__(self, path: str):
+        if pyarrow is None:
+            raise ImportError("ParquetTableSource requires 'pyarrow', install it with 'pip install pyarrow'")
+        super().__init__(path)
+
+    def _read(self, file_path: str, columns: List[str], batch_size: int) -> Iterator[Dict[str, np.ndarray]]:
+        for batch in pyarrow.parquet.ParquetFile(file_path).iter_batches(batch_size=batch_size, columns=columns):
+            yield {name: batch.column(name).to_numpy(zero_copy_only=False) for name in columns}
+
+
+TABLE_SOURCES = {"csv": CsvTableSource, "native": NativeTableSource, "parquet": ParquetTableSource}
+
+
+def _read_native_block(f: BinaryIO, columns: set) -> Dict[str, np.ndarray]:
+    """Decodes a Native block of the types 'NativeFileSink' writes, keeping only 'columns'."""
+    column_count, rows = _read_var_uint(f), _read_var_uint(f)
+    block = {}
+    for _ in range(column_count):
+        name, column_type = _read_string(f).decode(), _read_string(f).decode()
+        if column_type == "String":
+            column = np.array([_read_string(f).decode() for _ in range(rows)], dtype=object)
+        elif column_type in TIME_TYPES:
+            dtype = "<u4" if column_type == "DateTime" else "<u2"
+            values = np.frombuffer(f.read(rows * np.dtype(dtype).itemsize), dtype=dtype)
+            column = values.astype(np.int64).astype(TIME_TYPES[column_type][0])
+        elif column_type in NUMPY_TYPES:
+            dtype = np.dtype(NUMPY_TYPES[column_type]).newbyteorder("<")
+            column = np.frombuffer(f.read(rows * dtype.itemsize), dtype=dtype)
+        else:
+            raise ValueError(f"Unsupported Native column type {column_type} of {name}")
+        if name in columns:
+            block[name] = column
+    return block
+
+
+def _read_var_uint(f: BinaryIO) -> int:
+    value, shift = 0, 0
+    while True:
+        byte = f.read(1)
+        if not byte:
+            raise EOFError("Truncated Native block")
+        value |= (byte[0] & 0x7F) << shift
+        if byte[0] < 0x80:
+            return value
+        shift += 7
+
+
+def _read_string(f: BinaryIO) -> bytes:
+    return f.read(_read_var_uint(f))
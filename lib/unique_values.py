@@ -0,0 +1,106 @@
+from math import gcd
+from typing import Any, Iterable, List, Optional
+
+import numpy as np
+
+
+class UniqueValueAllocator:
+    def __init__(self, size: int, seed: Any = None):
+        """
+        Allocates unique values of a finite space without retries.
+
+        Every value of the space has an index in [0, size). Allocation walks a seeded affine permutation
+        'index = (multiplier * position + offset) % size' and skips positions of values that already exist,
+        so each call costs a single vectorized pass and never repeats a value.
+
+        :param size: quantity of values in the space
+        :param seed: seed for the permutation, see 'numpy.random.default_rng'
+        """
+        if size <= 0:
+            raise ValueError(f"Value space must not be empty, got size {size}")
+        self.size = size
+        rng = np.random.default_rng(seed)
+        self.multiplier = 1
+        if size > 2:
+            self.multiplier = int(rng.integers(1, size))
+            while gcd(self.multiplier, size) != 1:
+                self.multiplier = int(rng.integers(1, size))
+        self.offset = int(rng.integers(0, size))
+        self.position = 0
+        self.taken_positions = np.empty(0, dtype=np.int64)
+
+    @property
+    def remaining(self) -> int:
+        """Quantity of values that can still be allocated."""
+        taken_ahead = len(self.taken_positions) - np.searchsorted(self.taken_positions, self.position)
+        return self.size - self.position - int(taken_ahead)
+
+    def add_existing(self, values: Iterable[Any]) -> None:
+        """Marks values as used; values outside of the space are ignored."""
+        indices = self.to_indices(values)
+        positions = (indices - self.offset) * pow(self.multiplier, -1, self.size) % self.size
+        self.taken_positions = np.union1d(self.taken_positions, positions.astype(np.int64))
+
+    def allocate(self, count: int) -> np.ndarray:
+        return self.from_indices(self.allocate_indices(count))
+
+    def allocate_indices(self, count: int) -> np.ndarray:
+        if count > self.remaining:
+            raise ValueError(f"Not enough unique values: {self.remaining} left, {count} requested")
+        start, stop = self.position, self.position + count
+        while True:
+            skipped = np.searchsorted(self.taken_positions, stop) - np.searchsorted(self.taken_positions, start)
+            if start + count + skipped == stop:
+                break
+            stop = start + count + int(skipped)
+        positions = np.arange(start, stop, dtype=np.int64)
+        if stop - start != count:
+            positions = positions[~np.isin(positions, self.taken_positions, assume_unique=True)]
+        self.position = stop
+        return (positions * self.multiplier + self.offset) % self.size
+
+    def to_indices(self, values: Iterable[Any]) -> np.ndarray:
+        raise NotImplementedError
+
+    def from_indices(self, indices: np.ndarray) -> np.ndarray:
+        raise NotImplementedError
+
+
+class UniqueNameAllocator(UniqueValueAllocator):
+    def __init__(self, prefixes: List[str], max_suffix: int = 2000, seed: Any = None):
+        """Names like 'Prefix_123' with suffix in [0, max_suffix)."""
+        self.prefixes = list(prefixes)
+        self.prefix_indices = {prefix: i for i, prefix in enumerate(self.prefixes)}
+        self.max_suffix = max_suffix
+        super().__init__(size=len(self.prefixes) * max_suffix, seed=seed)
+
+    def to_indices(self, values: Iterable[Any]) -> np.ndarray:
+        indices = [index for index in map(self._to_index, values) if index is not None]
+        return np.array(indices, dtype=np.int64)
+
+    def from_indices(self, indices: np.ndarray) -> np.ndarray:
+        prefixes, suffixes = np.divmod(indices, self.max_suffix)
+        return np.array(
+            [f"{self.prefixes[prefix]}_{suffix}" for prefix, suffix in zip(prefixes.tolist(), suffixes.tolist())],
+            dtype=object,
+        )
+
+    def _to_index(self, value: str) -> Optional[int]:
+        prefix, _, suffix = value.rpartition("_")
+        if prefix not in self.prefix_indices or not suffix.isdigit() or int(suffix) >= self.max_suffix:
+            return None
+        return self.prefix_indices[prefix] * self.max_suffix + int(suffix)
+
+
+class UniqueCodeAllocator(UniqueValueAllocator):
+    def __init__(self, min_value: int, max_value: int, seed: Any = None):
+        """Integer codes in [min_value, max_value)."""
+        self.min_value = min_value
+        super().__init__(size=max_value - min_value, seed=seed)
+
+    def to_indices(self, values: Iterable[Any]) -> np.ndarray:
+        indices = np.fromiter(values, dtype=np.int64) - self.min_value
+        return indices[(indices >= 0) & (indices < self.size)]
+
+    def from_indices(self, indices: np.ndarray) -> np.ndarray:
+        return (indices + self.min_value).astype(np.uint64)
@@ -0,0 +1,365 @@
+import logging
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from lib.table_source import TableSource
+
+ENTITIES = [
+    "provider",
+    "storage",
+    "product",
+    "delivery",
+    "delivery_products_line",
+    "invoice",
+    "invoice_products_line",
+]
+
+
+@dataclass
+class CheckResult:
+    check: str
+    checked: int = 0
+    violations: int = 0
+    # IDs of violating rows, (ProductID, StorageID) pairs for stock checks
+    sample: List[Any] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.violations == 0
+
+    def add(self, violating: np.ndarray, ids: np.ndarray, sample_size: int) -> None:
+        """Counts a batch of 'len(violating)' checked rows, 'violating' marks the failed ones."""
+        self.checked += len(violating)
+        count = int(np.count_nonzero(violating))
+        self.violations += count
+        if count and len(self.sample) < sample_size:
+            self.sample += [_to_python(value) for value in ids[violating][: sample_size - len(self.sample)]]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(asdict(self), ok=self.ok)
+
+
+class _KeyedReduce:
+    def __init__(self, ufunc: np.ufunc, compact_rows: int = 1 << 22):
+        """
+        Streaming group by: 'ufunc' reduction (np.add, np.minimum) of int64 values per int64 key.
+        Batches are buffered and merged by one sort once more than 'compact_rows' rows are pending,
+        so memory is bounded by the distinct keys and not by the rows.
+        """
+        self.ufunc = ufunc
+        self.compact_rows = compact_rows
+        self._keys: List[np.ndarray] = []
+        self._values: List[np.ndarray] = []
+        self._pending = 0
+        self._distinct = 0
+        self._compacted = False
+
+    def add(self, keys: np.ndarray, values: np.ndarray) -> None:
+        self._keys.append(keys)
+        self._values.append(values)
+        self._pending += len(keys)
+        self._compacted = False
+        if self._pending > max(self.compact_rows, 2 * self._distinct):
+            self._compact()
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Sorted distinct keys and the reduced value of each."""
+        self._compact()
+        return self._keys[0], self._values[0]
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Reduced values of 'keys' (0 if absent) and whether each key was added."""
+        result_keys, result_values = self.result()
+        positions, found = _find(result_keys, keys)
+        values = np.zeros(len(keys), dtype=np.int64)
+        values[found] = result_values[positions[found]]
+        return values, found
+
+    def _compact(self) -> None:
+        if self._compacted:
+            return
+        keys = np.concatenate(self._keys) if self._keys else np.empty(0, dtype=np.int64)
+        values = np.concatenate(self._values) if self._values else np.empty(0, dtype=np.int64)
+        # sums and minimums do not depend on the order of equal keys, the faster unstable sort is enough
+        order = np.argsort(keys)
+        keys, values = keys[order], values[order]
+        starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1]))) if len(keys) else order
+        self._keys = [keys[starts]]
+        self._values = [self.ufunc.reduceat(values, starts) if len(keys) else values]
+        self._pending = self._distinct = len(starts)
+        self._compacted = True
+
+
+class _DenseReduce:
+    def __init__(self, ufunc: np.ufunc, size: int):
+        """'_KeyedReduce' for keys in [0, size), values are reduced in place into an array indexed by key."""
+        self.ufunc = ufunc
+        self.values = np.full(size, 0 if ufunc is np.add else np.iinfo(np.int64).max, dtype=np.int64)
+        self.present = np.zeros(size, dtype=bool)
+
+    def add(self, keys: np.ndarray, values: np.ndarray) -> None:
+        self.ufunc.at(self.values, keys, values)
+        self.present[keys] = True
+
+    def result(self) -> Tuple[np.ndarray, np.ndarray]:
+        keys = np.flatnonzero(self.present)
+        return keys, self.values[keys]
+
+    def lookup(self, keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        found = self.present[keys]
+        return np.where(found, self.values[keys], 0), found
+
+
+class _IdIndex:
+    def __init__(self, ids: np.ndarray, max_density: int = 4):
+        """
+        Row positions of a table's IDs. Generated IDs are contiguous ranges, then a lookup table indexed by ID
+        finds a position with a single gather; sparse IDs ('max(ID)' above 'max_density' times the rows)
+        fall back to binary search. A repeated ID keeps one of its rows.
+        """
+        self.ids = np.asarray(ids)
+        if self.ids.dtype.kind not in "iu" or not len(self.ids):
+            self.lookup = None
+        elif self.ids.min() >= 0 and int(self.ids.max()) <= max_density * len(self.ids) + 1024:
+            self.lookup = np.full(int(self.ids.max()) + 1, -1, dtype=np.int64)
+            self.lookup[self.ids] = np.arange(len(self.ids))
+        else:
+            self.lookup = None
+        if self.lookup is None:
+            self.order = np.argsort(self.ids, kind="stable")
+            self.sorted_ids = self.ids[self.order]
+
+    def find(self, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Row positions of 'values' and whether each was found, positions of missing values are undefined."""
+        values = np.asarray(values)
+        if self.lookup is not None:
+            in_range = (values >= 0) & (values < len(self.lookup))
+            positions = np.where(in_range, self.lookup[np.where(in_range, values, 0)], -1)
+            found = positions >= 0
+            return np.maximum(positions, 0), found
+        positions, found = _find(self.sorted_ids, values)
+        return self.order[np.minimum(positions, len(self.order) - 1)] if len(self.order) else positions, found
+
+
+class IntegrityVerifier:
+    def __init__(
+        self,
+        source: TableSource,
+        batch_size: int = 1000000,
+        sample_size: int = 10,
+        dense_keys_limit: int = 1 << 24,
+        table_names: Optional[Dict[str, str]] = None,
+        logger: Any = None,
+    ):
+        """
+        Checks the invariants 'ShopDataGenerator' keeps over a whole dataset:
+        unique IDs and unique names/codes, foreign keys resolve, no product's stock in a storage goes negative
+        (invoiced quantity never exceeds delivered quantity) and every invoice comes after the first delivery
+        of its product to its storage.
+
+        Parent tables are read whole, their IDs are needed for the joins, line tables are streamed in batches
+        of 'batch_size' rows. Joins are gathers from ID lookup tables (binary searches for sparse IDs), per
+        (product, storage) sums and first delivery times are reduced into arrays indexed by the pair, or by sort
+        based group bys when there are more than 'dense_keys_limit' pairs, so checks never loop over rows.
+
+        :param source: tables to check, clickhouse or files of a 'FileSink' (see 'lib/table_source.py')
+        :param batch_size: rows per batch of line tables
+        :param sample_size: violating IDs kept per check
+        :param dense_keys_limit: maximum products times storages to aggregate stock in dense arrays
+        :param table_names: table name per entity ('provider', 'invoice', ...), 'shop.<entity>' by default
+        """
+        self.source = source
+        self.batch_size = batch_size
+        self.sample_size = sample_size
+        self.dense_keys_limit = dense_keys_limit
+        self.table_names = {entity: f"shop.{entity}" for entity in ENTITIES}
+        self.table_names.update(table_names or {})
+        self.logger = logger if logger is not None else logging.getLogger()
+
+    def verify(self) -> List[CheckResult]:
+        started = time.perf_counter()
+        results: List[CheckResult] = []
+
+        provider = self._read_table("provider", ["ID", "Name"])
+        storage = self._read_table("storage", ["ID", "Name", "Address"])
+        product = self._read_table("product", ["ID", "Code"])
+        delivery = self._read_table("delivery", ["ID", "ProviderID", "StorageID", "DeliveryDateTime"])
+        invoice = self._read_table("invoice", ["ID", "StorageID", "InvoiceDateTime"])
+        for entity, columns in (
+            ("provider", provider),
+            ("storage", storage),
+            ("product", product),
+            ("delivery", delivery),
+            ("invoice", invoice),
+        ):
+            results.append(self._check_unique(entity, "ID", columns["ID"], columns["ID"]))
+        results.append(self._check_unique("provider", "Name", provider["Name"], provider["ID"]))
+        results.append(self._check_unique("storage", "Name", storage["Name"], storage["ID"]))
+        results.append(self._check_unique("storage", "Address", storage["Address"], storage["ID"]))
+        results.append(self._check_unique("product", "Code", product["Code"], product["ID"]))
+
+        provider_ids, storage_ids, product_ids = (_IdIndex(columns["ID"]) for columns in (provider, storage, product))
+        results.append(self._check_reference("delivery", "ProviderID", delivery, provider_ids))
+        results.append(self._check_reference("delivery", "StorageID", delivery, storage_ids))
+        results.append(self._check_reference("invoice", "StorageID", invoice, storage_ids))
+
+        # stock is keyed by (product row, storage row), the pair is 'product position * storages + storage position'
+        stock_keys = _StockKeys(product_ids, storage_ids)
+        delivered, first_deliveries = self._make_reduce(np.add, stock_keys), self._make_reduce(np.minimum, stock_keys)
+        invoiced = self._make_reduce(np.add, stock_keys)
+        results += self._scan_delivery_lines(stock_keys, delivery, delivered, first_deliveries)
+        results += self._scan_invoice_lines(stock_keys, invoice, invoiced, first_deliveries)
+        results.append(self._check_stock(stock_keys, delivered, invoiced))
+
+        for result in results:
+            if result.ok:
+                self.logger.info(f"{result.check}: OK, {result.checked} checked.")
+            else:
+                self.logger.error(
+                    f"{result.check}: нарушений {result.violations} из {result.checked}, например {result.sample}"
+                )
+        self.logger.info(f"Integrity verified in {time.perf_counter() - started:.2f} s.")
+        return results
+
+    def _make_reduce(self, ufunc: np.ufunc, stock_keys: "_StockKeys") -> Any:
+        if stock_keys.size <= self.dense_keys_limit:
+            return _DenseReduce(ufunc, stock_keys.size)
+        return _KeyedReduce(ufunc)
+
+    def _scan_delivery_lines(
+        self, stock_keys: "_StockKeys", delivery: Dict[str, np.ndarray], delivered: Any, first_deliveries: Any
+    ) -> List[CheckResult]:
+        table_name = self.table_names["delivery_products_line"]
+        product_check = CheckResult(f"{table_name}.ProductID -> {self.table_names['product']}.ID")
+        delivery_check = CheckResult(f"{table_name}.DeliveryID -> {self.table_names['delivery']}.ID")
+        delivery_ids = _IdIndex(delivery["ID"])
+        storage_positions, has_storage = stock_keys.storage_ids.find(delivery["StorageID"])
+        ids = []
+        columns = ["ID", "ProductID", "DeliveryID", "Quantity"]
+        for batch in self.source.iter_columns(table_name, columns, self.batch_size):
+            ids.append(batch["ID"])
+            product_positions, has_product = stock_keys.product_ids.find(batch["ProductID"])
+            positions, has_delivery = delivery_ids.find(batch["DeliveryID"])
+            product_check.add(~has_product, batch["ID"], self.sample_size)
+            delivery_check.add(~has_delivery, batch["ID"], self.sample_size)
+            # rows with a broken reference are reported above and left out of the stock
+            valid = has_product & has_delivery & has_storage[positions]
+            positions = positions[valid]
+            keys = stock_keys.encode(product_positions[valid], storage_positions[positions])
+            delivered.add(keys, batch["Quantity"][valid].astype(np.int64))
+            first_deliveries.add(keys, delivery["DeliveryDateTime"][positions])
+        unique_check = self._check_unique("delivery_products_line", "ID", _concatenate(ids), _concatenate(ids))
+        return [unique_check, product_check, delivery_check]
+
+    def _scan_invoice_lines(
+        self, stock_keys: "_StockKeys", invoice: Dict[str, np.ndarray], invoiced: Any, first_deliveries: Any
+    ) -> List[CheckResult]:
+        table_name = self.table_names["invoice_products_line"]
+        product_check = CheckResult(f"{table_name}.ProductID -> {self.table_names['product']}.ID")
+        invoice_check = CheckResult(f"{table_name}.InvoiceID -> {self.table_names['invoice']}.ID")
+        time_check = CheckResult(f"{self.table_names['invoice']}.InvoiceDateTime >= first delivery of the product")
+        invoice_ids = _IdIndex(invoice["ID"])
+        storage_positions, has_storage = stock_keys.storage_ids.find(invoice["StorageID"])
+        ids = []
+        columns = ["ID", "ProductID", "InvoiceID", "Quantity"]
+        for batch in self.source.iter_columns(table_name, columns, self.batch_size):
+            ids.append(batch["ID"])
+            product_positions, has_product = stock_keys.product_ids.find(batch["ProductID"])
+            positions, has_invoice = invoice_ids.find(batch["InvoiceID"])
+            product_check.add(~has_product, batch["ID"], self.sample_size)
+            invoice_check.add(~has_invoice, batch["ID"], self.sample_size)
+            valid = has_product & has_invoice & has_storage[positions]
+            positions = positions[valid]
+            keys = stock_keys.encode(product_positions[valid], storage_positions[positions])
+            invoiced.add(keys, batch["Quantity"][valid].astype(np.int64))
+            # a product never delivered to the storage has no first delivery and fails as well
+            first_times, was_delivered = first_deliveries.lookup(keys)
+            too_early = ~was_delivered | (invoice["InvoiceDateTime"][positions] < first_times)
+            time_check.add(too_early, batch["ID"][valid], self.sample_size)
+        unique_check = self._check_unique("invoice_products_line", "ID", _concatenate(ids), _concatenate(ids))
+        return [unique_check, product_check, invoice_check, time_check]
+
+    def _check_stock(self, stock_keys: "_StockKeys", delivered: Any, invoiced: Any) -> CheckResult:
+        """Invoiced quantity per (product, storage) against delivered quantity, the final stock is never negative."""
+        check = CheckResult("invoiced quantity <= delivered quantity per (ProductID, StorageID)")
+        keys, invoiced_quantities = invoiced.result()
+        available = delivered.lookup(keys)[0]
+        check.add(invoiced_quantities > available, stock_keys.decode(keys), self.sample_size)
+        check.sample = [tuple(pair) for pair in check.sample]
+        return check
+
+    def _check_unique(self, entity: str, field_name: str, values: np.ndarray, ids: np.ndarray) -> CheckResult:
+        check = CheckResult(f"{self.table_names[entity]}.{field_name} unique")
+        order = np.argsort(values, kind="stable")
+        sorted_values = values[order]
+        repeated = np.zeros(len(values), dtype=bool)
+        repeated[1:] = sorted_values[1:] == sorted_values[:-1]
+        check.add(repeated, ids[order], self.sample_size)
+        return check
+
+    def _check_reference(
+        self, entity: str, field_name: str, columns: Dict[str, np.ndarray], parent_ids: _IdIndex
+    ) -> CheckResult:
+        parent = {"ProviderID": "provider", "StorageID": "storage"}[field_name]
+        check = CheckResult(f"{self.table_names[entity]}.{field_name} -> {self.table_names[parent]}.ID")
+        check.add(~parent_ids.find(columns[field_name])[1], columns["ID"], self.sample_size)
+        return check
+
+    def _read_table(self, entity: str, columns: List[str]) -> Dict[str, np.ndarray]:
+        batches = list(self.source.iter_columns(self.table_names[entity], columns, self.batch_size))
+        table = {name: _concatenate([batch[name] for batch in batches]) for name in columns}
+        for name in columns:
+            if name.endswith("DateTime"):
+                table[name] = _seconds(table[name])
+        return table
+
+
+def _concatenate(arrays: List[np.ndarray]) -> np.ndarray:
+    return np.concatenate([np.asarray(array) for array in arrays]) if arrays else np.empty(0, dtype=np.int64)
+
+
+def _seconds(column: np.ndarray) -> np.ndarray:
+    """Unix seconds of a DateTime column, read as datetime64 or, from CSV, as strings."""
+    column = np.asarray(column)
+    if column.dtype.kind != "M":
+        column = pd.to_datetime(column, utc=True).tz_convert(None).to_numpy()
+    return column.astype("datetime64[s]").astype(np.int64)
+
+
+def _find(sorted_values: np.ndarray, values: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Positions of 'values' in 'sorted_values' and whether each was found."""
+    # probing in sorted order walks the array forward instead of jumping around it, several times faster
+    order = np.argsort(values)
+    positions = np.empty(len(values), dtype=np.intp)
+    positions[order] = np.searchsorted(sorted_values, values[order])
+    found = positions < len(sorted_values)
+    found[found] = sorted_values[positions[found]] == values[found]
+    return positions, found
+
+
+class _StockKeys:
+    def __init__(self, product_ids: _IdIndex, storage_ids: _IdIndex):
+        self.product_ids = product_ids
+        self.storage_ids = storage_ids
+        self.storages = max(len(storage_ids.ids), 1)
+        self.size = len(product_ids.ids) * self.storages
+
+    def encode(self, product_positions: np.ndarray, storage_positions: np.ndarray) -> np.ndarray:
+        return product_positions.astype(np.int64) * self.storages + storage_positions
+
+    def decode(self, keys: np.ndarray) -> np.ndarray:
+        """(ProductID, StorageID) rows of the keys."""
+        product_positions, storage_positions = np.divmod(keys, self.storages)
+        return np.stack(
+            [self.product_ids.ids[product_positions].astype(np.int64), self.storage_ids.ids[storage_positions]], axis=1
+        )
+
+
+def _to_python(value: Any) -> Any:
+    if isinstance(value, np.ndarray):
+        return [_to_python(item) for item in value]
+    return value.item() if isinstance(value, np.generic) else value
@@ -0,0 +1,93 @@
+import argparse
+import dataclasses
+import json
+import logging
+import sys
+
+from data_generator_executor import get_credentials, get_generator_kwargs
+from lib.load_test import SHOP_QUERIES, LoadTest
+from lib.scale import SCALE_PRESETS, parse_scale_factor
+
+HOST = "localhost"
+STAND_IN_SCALE_FACTOR = "small"
+
+
+def parse_query_weights(values: list) -> list:
+    """'SHOP_QUERIES' named by '--query NAME' or '--query NAME=WEIGHT' options, all of them without options."""
+    queries = {query.name: query for query in SHOP_QUERIES}
+    if not values:
+        return list(SHOP_QUERIES)
+    selected = []
+    for value in values:
+        name, _, weight = value.partition("=")
+        if name not in queries:
+            raise ValueError(f"Unknown query {name!r}, expected one of {list(queries)}")
+        query = queries[name]
+        selected.append(dataclasses.replace(query, weight=float(weight)) if weight else query)
+    return selected
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Read workload load test over the shop database")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--qps", type=float, default=10.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds of sending requests")
+    parser.add_argument("--concurrency", type=int, default=8, help="maximum requests running at once")
+    parser.add_argument("--arrivals", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--timeout", type=float, help="seconds after which a request counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--query",
+        action="append",
+        metavar="NAME[=WEIGHT]",
+        help=f"query of the mix, repeatable, all by default: {', '.join(query.name for query in SHOP_QUERIES)}",
+    )
+    parser.add_argument(
+        "--stand-in", action="store_true", help="generate data into an in-memory stand-in and load test it"
+    )
+    parser.add_argument(
+        "--scale-factor",
+        "-s",
+        default=STAND_IN_SCALE_FACTOR,
+        help=f"stand-in data size, a preset ({', '.join(SCALE_PRESETS)}) or a number",
+    )
+    parser.add_argument("--max-error-rate", type=float, default=0.0, help="exit code 1 above this error rate")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+    try:
+        queries = parse_query_weights(args.query)
+        args.scale_factor = parse_scale_factor(args.scale_factor)
+    except ValueError as e:
+        parser.error(str(e))
+    logging.basicConfig(level=logging.INFO)
+
+    if args.stand_in:
+        from lib.data_generator import ShopDataGenerator
+        from lib.schema import QUERIES_PATH
+        from lib.stand_in import StandInHook, StandInServer
+
+        hook = StandInHook(StandInServer(QUERIES_PATH), pool_size=args.concurrency)
+        ShopDataGenerator(
+            clickhouse_connection=hook.get_connection(), seed=args.seed, **get_generator_kwargs(args)
+        ).execute_bulk()
+    else:
+        from lib.clickhouse_hook import ClickhouseNativeHook
+
+        login, password = get_credentials()
+        hook = ClickhouseNativeHook(login=login, password=password, host=args.host, pool_size=args.concurrency)
+    report = LoadTest(
+        hook,
+        queries=queries,
+        qps=args.qps,
+        duration=args.duration,
+        concurrency=args.concurrency,
+        arrivals=args.arrivals,
+        timeout=args.timeout,
+        seed=args.seed,
+    ).run()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report.to_dict(), f, indent=2)
+    if report.total.error_rate > args.max_error_rate:
+        sys.exit(1)
@@ -0,0 +1,39 @@
+import argparse
+import json
+import logging
+import sys
+
+from data_generator_executor import get_credentials
+from lib.table_source import TABLE_SOURCES, ClickhouseTableSource
+from lib.verifier import IntegrityVerifier
+
+HOST = "localhost"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shop dataset integrity verifier")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument(
+        "--input-format", choices=list(TABLE_SOURCES), help="verify files of data_generator_executor.py --output-format"
+    )
+    parser.add_argument("--input-path", default="output", help="output directory of the files")
+    parser.add_argument("--batch-size", type=int, default=1000000, help="rows per batch of line tables")
+    parser.add_argument("--sample-size", type=int, default=10, help="violating IDs reported per check")
+    parser.add_argument("--output", help="write results as JSON to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.input_format is not None:
+        source = TABLE_SOURCES[args.input_format](args.input_path)
+    else:
+        from lib.clickhouse_hook import ClickhouseNativeHook
+
+        login, password = get_credentials()
+        hook = ClickhouseNativeHook(login=login, password=password, host=args.host)
+        source = ClickhouseTableSource(hook)
+    results = IntegrityVerifier(source, batch_size=args.batch_size, sample_size=args.sample_size).verify()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump([result.to_dict() for result in results], f, indent=2)
+    if not all(result.ok for result in results):
+        sys.exit(1)